@@ -0,0 +1,62 @@
+#! /usr/bin/env python
+# -*- coding: utf-8 -*-
+#######################
+#
+# monotonic() for Python 2.7, which has no time.monotonic(): seconds from an
+# arbitrary start that never jump with the wall clock (NTP corrections,
+# manual changes, sleep). Only differences between two values mean anything.
+
+import ctypes
+import ctypes.util
+import sys
+import threading
+import time
+
+# CLOCK_MONOTONIC differs between the systems that have clock_gettime()
+CLOCK_MONOTONIC = {'darwin': 6, 'linux2': 1, 'linux': 1}
+
+class timespec(ctypes.Structure):
+    _fields_ = [('tv_sec', ctypes.c_long), ('tv_nsec', ctypes.c_long)]
+
+#-------------------------------------------------------------------------------
+def _clockGettime():
+    clockId = CLOCK_MONOTONIC.get(sys.platform, None)
+    if clockId is None:
+        return None
+    try:
+        libc = ctypes.CDLL(ctypes.util.find_library('c') or 'libc.so.6', use_errno=True)
+        clock_gettime = libc.clock_gettime
+    except (OSError, AttributeError):
+        # macOS before 10.12 has no clock_gettime()
+        return None
+    clock_gettime.argtypes = [ctypes.c_int, ctypes.POINTER(timespec)]
+    clock_gettime.restype = ctypes.c_int
+    value = timespec()
+    if clock_gettime(clockId, ctypes.byref(value)) != 0:
+        return None
+
+    def monotonic():
+        # one buffer per call, any thread may ask
+        value = timespec()
+        if clock_gettime(clockId, ctypes.byref(value)) != 0:
+            raise OSError(ctypes.get_errno(), 'clock_gettime failed')
+        return value.tv_sec + value.tv_nsec * 1e-9
+    return monotonic
+
+#-------------------------------------------------------------------------------
+# last resort: the wall clock, held still while it runs backwards
+def _wallClock():
+    lock = threading.Lock()
+    state = {'last': time.time(), 'offset': 0.0}
+
+    def monotonic():
+        with lock:
+            now = time.time() + state['offset']
+            if now < state['last']:
+                state['offset'] += state['last'] - now
+                now = state['last']
+            state['last'] = now
+            return now
+    return monotonic
+
+monotonic = _clockGettime() or _wallClock()
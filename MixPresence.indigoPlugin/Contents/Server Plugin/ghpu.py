@@ -12,18 +12,23 @@
 # https://github.com/jheddings/indigo-ghpu
 
 import os
+import time
+import base64
+import hashlib
+import threading
 import tempfile
 import subprocess
 import shutil
 import json
+import socket
+import ssl
 import httplib
+import urlparse
 import plistlib
 
 import ConfigParser
 
-from urllib2 import urlopen
-from StringIO import StringIO
-from zipfile import ZipFile
+from zipfile import ZipFile, BadZipfile
 from collections import namedtuple
 
 PluginInfo = namedtuple('PluginInfo', ['id', 'name', 'version'])
@@ -32,7 +37,7 @@ PluginInfo = namedtuple('PluginInfo', ['id', 'name', 'version'])
 class GitHubPluginUpdater(object):
 
     #---------------------------------------------------------------------------
-    def __init__(self, plugin=None, configFile='ghpu.cfg'):
+    def __init__(self, plugin=None, configFile='ghpu.cfg', cacheFile=None):
         self.plugin = plugin
 
         config = ConfigParser.RawConfigParser()
@@ -46,6 +51,39 @@ class GitHubPluginUpdater(object):
         else:
             self.path = ''
 
+        # the API can be pointed at a local stand-in server for testing
+        if (config.has_option('repository', 'api')):
+            self.api = config.get('repository', 'api').rstrip('/')
+        else:
+            self.api = 'https://api.github.com'
+
+        # automatic update checks, see checkForUpdateInBackground()
+        self.autoCheck = self._getOption(config, 'auto-update', 'check', True, config.getboolean)
+        self.checkInterval = self._getOption(config, 'auto-update', 'interval', 86400, config.getint)
+        self.checkDelay = self._getOption(config, 'auto-update', 'delay', 300, config.getint)
+        self.retryInterval = self._getOption(config, 'auto-update', 'retry', 3600, config.getint)
+        self.timeout = self._getOption(config, 'auto-update', 'timeout', 30, config.getint)
+        self.downloadTimeout = self._getOption(config, 'auto-update', 'downloadTimeout', 300, config.getint)
+        self.maxDownloadSize = self._getOption(config, 'auto-update', 'maxDownloadSize', 50 * 1024 * 1024, config.getint)
+
+        # one client for every request, so connections are kept and reused
+        self.http = HTTPClient({
+            'User-Agent': 'Indigo-Plugin-Updater',
+            'Accept': 'application/vnd.github.v3+json'
+        }, timeout=self.timeout)
+        self.http.log = self._debug
+
+        # result of the last check, cached API responses and the rate limit
+        # status, all kept across restarts in cacheFile
+        self.cacheFile = cacheFile
+        self.lastCheck = None
+        self.responses = { }
+        self.rate = { 'remaining': None, 'reset': 0 }
+        # why the last request got no fresh answer, None if it did
+        self.lastError = None
+        self._readCache()
+        self.checkThread = None
+
         # TODO error checking on configuration
 
     #---------------------------------------------------------------------------
@@ -87,6 +125,59 @@ class GitHubPluginUpdater(object):
 
         return (update != None)
 
+    #---------------------------------------------------------------------------
+    # runs checkForUpdate on its own thread, so the caller never waits on the
+    # network. Returns False if a check is already running.
+    def checkForUpdateInBackground(self, currentVersion=None):
+        if (self.checkThread != None and self.checkThread.is_alive()):
+            return False
+
+        self.checkThread = threading.Thread(target=self._checkForUpdateSafely, args=(currentVersion,))
+        self.checkThread.daemon = True
+        self.checkThread.start()
+
+        return True
+
+    #---------------------------------------------------------------------------
+    # returns the time.time() the next automatic check is due, never sooner
+    # than the configured delay from now
+    def nextCheckTime(self, now=None):
+        if (now == None): now = time.time()
+
+        if (self.lastCheck == None):
+            return now + self.checkDelay
+
+        return max(self.lastCheck['checkedAt'] + self.checkInterval, now + self.checkDelay)
+
+    #---------------------------------------------------------------------------
+    # returns True when no check has succeeded within the check interval
+    def checkDue(self, now=None):
+        if (now == None): now = time.time()
+
+        if (self.lastCheck == None):
+            return True
+
+        return (self.lastCheck['checkedAt'] + self.checkInterval <= now)
+
+    #---------------------------------------------------------------------------
+    # returns the html_url of a newer release found by the last check, without
+    # asking the network
+    def getCachedUpdate(self, currentVersion=None):
+        if (self.lastCheck == None or self.lastCheck.get('latestVersion', None) == None):
+            return None
+
+        if (currentVersion == None):
+            if (self.plugin == None): return None
+            currentVersion = str(self.plugin.pluginVersion)
+
+        try:
+            if (ver(currentVersion) >= ver(self.lastCheck['latestVersion'])):
+                return None
+        except ValueError:
+            return None
+
+        return self.lastCheck.get('url', None)
+
     #---------------------------------------------------------------------------
     # returns the update package, if there is one
     def getUpdate(self, currentVersion):
@@ -94,6 +185,10 @@ class GitHubPluginUpdater(object):
 
         update = self.getLatestRelease()
 
+        # a failed check says nothing new, keep the last result and its time
+        if (self.lastError == None):
+            self._saveCache(update)
+
         if (update == None):
             self._debug('No release available')
             return None
@@ -120,61 +215,125 @@ class GitHubPluginUpdater(object):
     # NOTE this does not count against the current limit
     def getRateLimit(self):
         limiter = self._GET('/rate_limit')
+        if (limiter == None):
+            return None
 
         remain = int(limiter['rate']['remaining'])
         limit = int(limiter['rate']['limit'])
         resetAt = int(limiter['rate']['reset'])
 
+        self.rate = { 'remaining': remain, 'reset': resetAt }
+
         return (limit, remain, resetAt)
 
     #---------------------------------------------------------------------------
-    # form a GET request to api.github.com and return the parsed JSON response
-    def _GET_old(self, requestPath):
+    # GET from the API and return the parsed JSON response. Responses carrying
+    # an ETag or Last-Modified are cached and revalidated with a conditional
+    # request, which GitHub does not count against the rate limit when it
+    # answers 304. Nothing is sent while the cached copy is fresh or while the
+    # rate limit is exhausted. When the request fails the cached copy is
+    # returned, if there is one, and lastError says why.
+    def _GET(self, requestPath):
         self._debug('GET %s' % requestPath)
+        now = time.time()
+        self.lastError = None
+        cached = self.responses.get(self.api + requestPath, None)
+
+        if (cached != None and cached.get('expires', 0) > now):
+            self._debug('Using cached response')
+            return cached['data']
+
+        # /rate_limit itself is free
+        if (self.rate['remaining'] == 0 and self.rate['reset'] > now and requestPath != '/rate_limit'):
+            self._debug('Rate limit exhausted, backing off until %s' % time.ctime(self.rate['reset']))
+            if (cached != None): return cached['data']
+            return None
 
-        headers = {
-            'User-Agent': 'Indigo-Plugin-Updater',
-            'Accept': 'application/vnd.github.v3+json'
-        }
-
-        data = None
-
-        conn = httplib.HTTPSConnection('api.github.com')
-        conn.request('GET', requestPath, None, headers)
+        headers = { }
+        if (cached != None):
+            if (cached.get('etag', None) != None):
+                headers['If-None-Match'] = cached['etag']
+            if (cached.get('lastModified', None) != None):
+                headers['If-Modified-Since'] = cached['lastModified']
 
-        resp = conn.getresponse()
-        self._debug('HTTP %d %s' % (resp.status, resp.reason))
+        (status, respHeaders, body) = self._request(requestPath, headers)
+        if (status == None):
+            if (cached != None): return cached['data']
+            return None
+        self._debug('HTTP %d' % status)
+        self._updateRateLimit(status, respHeaders, now)
 
-        if (resp.status == 200):
-            data = json.loads(resp.read())
-        elif (400 <= resp.status < 500):
-            error = json.loads(resp.read())
-            self._error('%s' % error['message'])
+        data = None
+        if (status == 304 and cached != None):
+            cached['expires'] = now + self._maxAge(respHeaders)
+            data = cached['data']
+        elif (status == 200):
+            data = json.loads(body)
+            if ('etag' in respHeaders or 'last-modified' in respHeaders):
+                self.responses[self.api + requestPath] = {
+                    'etag': respHeaders.get('etag', None),
+                    'lastModified': respHeaders.get('last-modified', None),
+                    'expires': now + self._maxAge(respHeaders),
+                    'data': data
+                }
+        elif (400 <= status < 500):
+            try:
+                self._error('%s' % json.loads(body)['message'])
+            except (ValueError, KeyError, TypeError):
+                self._error('Error: HTTP %d' % status)
+            # rate limited, the last known answer is better than none
+            if (status in (403, 429) and cached != None):
+                data = cached['data']
         else:
-            self._error('Error: %s' % resp.reason)
+            # the server is having trouble, the last known answer still holds
+            self.lastError = 'HTTP %d' % status
+            self._error('Error: %s' % self.lastError)
+            if (cached != None):
+                data = cached['data']
 
+        self._writeCache()
         return data
 
-    def _GET(self, requestPath):
-        self._debug('GET %s' % requestPath)
-        headers = {
-            'User-Agent': 'Indigo-Plugin-Updater',
-            'Accept': 'application/vnd.github.v3+json'
-        }
-        data = None
-        requestPath = 'https://api.github.com'+ requestPath
-        f = subprocess.Popen(["curl",  requestPath], stdout=subprocess.PIPE, stderr=subprocess.PIPE, shell=False)
-        #'-H', str(headers), "-k",
-        out, err = f.communicate()
-        if (int(f.returncode) == 0):
-            data = json.loads(out)
-        elif (400 <= f.status < 500):
-            error = json.loads(out)
-            self._error('%s' % error['message'])
-        else:
-            self._error('Error: %s' % unicode(err))
+    #---------------------------------------------------------------------------
+    # runs a single API request, returns (status, headers, body) where header
+    # names are lower case, or (None, None, None) if it failed
+    def _request(self, requestPath, headers):
+        try:
+            return self.http.fetch(self.api + requestPath, headers)
+        except (HTTPError, socket.error, httplib.HTTPException) as e:
+            self.lastError = str(e) or e.__class__.__name__
+            self._error('Error: %s' % self.lastError)
+            return (None, None, None)
+
+    #---------------------------------------------------------------------------
+    # keeps track of the rate limit budget from the response headers
+    def _updateRateLimit(self, status, headers, now):
+        try:
+            if ('x-ratelimit-remaining' in headers):
+                self.rate['remaining'] = int(headers['x-ratelimit-remaining'])
+            if ('x-ratelimit-reset' in headers):
+                self.rate['reset'] = int(headers['x-ratelimit-reset'])
+            if (status in (403, 429) and 'retry-after' in headers):
+                self.rate['remaining'] = 0
+                self.rate['reset'] = now + int(headers['retry-after'])
+        except ValueError:
+            pass
+
+        if (self.rate['remaining'] == 0):
+            self._debug('Rate limit exhausted until %s' % time.ctime(self.rate['reset']))
+
+    #---------------------------------------------------------------------------
+    # seconds a response may be used without asking again (Cache-Control)
+    def _maxAge(self, headers):
+        for directive in headers.get('cache-control', '').split(','):
+            (name, sep, value) = directive.strip().partition('=')
+            if (name == 'max-age'):
+                try:
+                    return int(value)
+                except ValueError:
+                    pass
+        return 0
 
-        return data
     #---------------------------------------------------------------------------
     # prepare for an update
     def _prepareForUpdate(self, currentVersion=None):
@@ -192,7 +351,10 @@ class GitHubPluginUpdater(object):
 
         update = self.getUpdate(currentVersion)
 
-        if (update == None):
+        if (update == None and self.lastError != None):
+            self._error('Update check failed, keeping the last result')
+            return None
+        elif (update == None):
             self._log('No updates are available')
             return None
 
@@ -256,45 +418,86 @@ class GitHubPluginUpdater(object):
     #---------------------------------------------------------------------------
     # install a given release
     def _installRelease(self, release):
-        tmpdir = tempfile.gettempdir()
-        self._debug('Workspace: %s' % tmpdir)
-
-        # the zipfile is held in memory until we extract
-        zipfile = self._getZipFileFromRelease(release)
-        pInfo = self._readPluginInfoFromArchive(zipfile)
-
-        self._verifyPluginInfo(pInfo)
+        # the archive is streamed to a temporary file, only the plugin itself
+        # is ever extracted
+        zipPath = self._getZipFileFromRelease(release)
+        try:
+            try:
+                zipfile = ZipFile(zipPath)
+            except (BadZipfile, IOError) as e:
+                raise Exception('Download corrupted: %s' % str(e))
+            pInfo = self._readPluginInfoFromArchive(zipfile)
 
-        # the top level directory should be the first entry in the zipfile
-        # it is typically a combination of the owner, repo & release tag
-        repotag = zipfile.namelist()[0]
+            self._verifyPluginInfo(pInfo)
 
-        # this is where the repo files will end up after extraction
-        repoBaseDir = os.path.join(tmpdir, repotag)
-        self._debug('Destination directory: %s' % repoBaseDir)
+            # the top level directory should be the first entry in the zipfile
+            # it is typically a combination of the owner, repo & release tag
+            repotag = zipfile.namelist()[0]
 
-        if (os.path.exists(repoBaseDir)):
-            shutil.rmtree(repoBaseDir)
+            # a fresh workspace, so nothing of an earlier attempt gets mixed in
+            tmpdir = tempfile.mkdtemp(prefix='ghpu-')
+            self._debug('Workspace: %s' % tmpdir)
 
-        # this is where the plugin will be after extracting
-        newPluginPath = os.path.join(repoBaseDir, self.path)
-        self._debug('Plugin source path: %s' % newPluginPath)
+            # this is where the plugin will be after extracting
+            newPluginPath = os.path.join(tmpdir, repotag, self.path)
+            self._debug('Plugin source path: %s' % newPluginPath)
 
-        # at this point, we should have been able to confirm the top-level directory
-        # based on reading the pluginId, we know the plugin in the zipfile matches our
-        # internal plugin reference (if we have one), temp directories are available
-        # and we know the package location for installing the plugin
+            # at this point, we should have been able to confirm the top-level directory
+            # based on reading the pluginId, we know the plugin in the zipfile matches our
+            # internal plugin reference (if we have one), temp directories are available
+            # and we know the package location for installing the plugin
 
-        self._debug('Extracting files...')
-        zipfile.extractall(tmpdir)
+            self._debug('Extracting files...')
+            self._extractPlugin(zipfile, repotag, tmpdir)
+            zipfile.close()
+        finally:
+            os.remove(zipPath)
 
         # now, make sure we got what we expected
-        if (not os.path.exists(repoBaseDir)):
+        if (not os.path.exists(newPluginPath)):
             raise Exception('Failed to extract plugin')
 
         self._installPlugin(newPluginPath)
         self._debug('Installation complete')
 
+    #---------------------------------------------------------------------------
+    # extracts the plugin subtree of the archive into destdir, checking the
+    # CRC of every file on the way
+    def _extractPlugin(self, zipfile, repotag, destdir):
+        prefix = repotag
+        if (self.path):
+            prefix = repotag + self.path.strip('/') + '/'
+
+        count = 0
+        for info in zipfile.infolist():
+            name = info.filename
+            if (not name.startswith(prefix)):
+                continue
+            if (name.startswith('/') or '..' in name.split('/')):
+                raise Exception('Unsafe path in archive: %s' % name)
+
+            target = os.path.join(destdir, *name.split('/'))
+            if (name.endswith('/')):
+                if (not os.path.isdir(target)):
+                    os.makedirs(target)
+                continue
+
+            folder = os.path.dirname(target)
+            if (not os.path.isdir(folder)):
+                os.makedirs(folder)
+
+            # ZipExtFile raises BadZipfile on a CRC mismatch at the end
+            source = zipfile.open(info)
+            with open(target, 'wb') as f:
+                shutil.copyfileobj(source, f, 65536)
+            source.close()
+            count += 1
+
+        if (count == 0):
+            raise Exception('Plugin not found in archive: %s' % prefix)
+
+        self._debug('Extracted and verified %d files' % count)
+
     #---------------------------------------------------------------------------
     # install plugin from the existing path
     def _installPlugin(self, pluginPath):
@@ -319,7 +522,10 @@ class GitHubPluginUpdater(object):
         subprocess.call(['open', pluginPath])
 
     #---------------------------------------------------------------------------
-    # return the valid zipfile from the release, or raise an exception
+    # downloads the zipball of the release to a temporary file and returns its
+    # path, or raises an exception. The size is checked while streaming and
+    # against Content-Length, the SHA-256 against a Digest header if the
+    # server sends one.
     def _getZipFileFromRelease(self, release):
         # download and verify zipfile from the release package
         zipball = release.get('zipball_url', None)
@@ -328,16 +534,110 @@ class GitHubPluginUpdater(object):
 
         self._debug('Downloading zip file: %s' % zipball)
 
-        #zipdata = urlopen(zipball).read()
-        f = subprocess.Popen(["curl", "-L",  zipball], stdout=subprocess.PIPE, stderr=subprocess.PIPE, shell=False)
-        zipdata, err = f.communicate()
-        zipfile = ZipFile(StringIO(zipdata))
+        response = self.http.open(zipball, { 'Accept': 'application/octet-stream' })
+        if (response.status != 200):
+            response.close()
+            raise Exception('Download failed: HTTP %d' % response.status)
 
-        self._debug('Verifying zip file (%d bytes)...' % len(zipdata))
-        if (zipfile.testzip() != None):
-            raise Exception('Download corrupted')
+        deadline = time.time() + self.downloadTimeout
+        (fd, zipPath) = tempfile.mkstemp(prefix='ghpu-', suffix='.zip')
+        try:
+            size = 0
+            sha256 = hashlib.sha256()
+            with os.fdopen(fd, 'wb') as out:
+                while True:
+                    chunk = response.read(65536)
+                    if (not chunk):
+                        break
+                    size += len(chunk)
+                    if (size > self.maxDownloadSize):
+                        raise Exception('Download larger than %d bytes' % self.maxDownloadSize)
+                    if (time.time() > deadline):
+                        raise Exception('Download took longer than %d sec.' % self.downloadTimeout)
+                    sha256.update(chunk)
+                    out.write(chunk)
+
+            self._verifyDownload(response.headers, size, sha256)
+        except:
+            response.close()
+            os.remove(zipPath)
+            raise
 
-        return zipfile
+        self._debug('Downloaded %d bytes, sha256 %s' % (size, sha256.hexdigest()))
+        return zipPath
+
+    #---------------------------------------------------------------------------
+    # raises an exception if the download does not match what the server said
+    def _verifyDownload(self, headers, size, sha256):
+        if ('content-length' in headers and int(headers['content-length']) != size):
+            raise Exception('Download truncated: %d of %s bytes' % (size, headers['content-length']))
+
+        for digest in headers.get('digest', '').split(','):
+            (algorithm, sep, value) = digest.strip().partition('=')
+            if (algorithm.lower() == 'sha-256' and base64.b64decode(value) != sha256.digest()):
+                raise Exception('Download corrupted: SHA-256 mismatch')
+
+    #---------------------------------------------------------------------------
+    # background thread body, nothing may escape from here
+    def _checkForUpdateSafely(self, currentVersion):
+        try:
+            self.checkForUpdate(currentVersion)
+        except Exception as e:
+            self._error('Update check failed: %s' % str(e))
+
+    #---------------------------------------------------------------------------
+    # reads an option with a default, ConfigParser in Python 2 has none
+    def _getOption(self, config, section, option, default, getter):
+        if (not config.has_option(section, option)):
+            return default
+        try:
+            return getter(section, option)
+        except ValueError:
+            return default
+
+    #---------------------------------------------------------------------------
+    # loads the last check result, cached responses and rate limit status
+    def _readCache(self):
+        if (self.cacheFile == None or not os.path.exists(self.cacheFile)):
+            return
+        try:
+            with open(self.cacheFile) as f:
+                cache = json.load(f)
+            lastCheck = cache.get('lastCheck', None)
+            if (lastCheck != None):
+                float(lastCheck['checkedAt'])
+            self.lastCheck = lastCheck
+            self.responses = dict(cache.get('responses', { }))
+            self.rate.update(cache.get('rate', { }))
+        except (IOError, ValueError, KeyError, TypeError, AttributeError):
+            self._debug('Ignoring unreadable update cache')
+
+    #---------------------------------------------------------------------------
+    # remembers the outcome of a check, in memory and in the cache file
+    def _saveCache(self, release):
+        lastCheck = { 'checkedAt': time.time(), 'latestVersion': None, 'url': None }
+        if (release != None and 'tag_name' in release):
+            lastCheck['latestVersion'] = release['tag_name'].lstrip('v')
+            lastCheck['url'] = release.get('html_url', None)
+        self.lastCheck = lastCheck
+        self._writeCache()
+
+    #---------------------------------------------------------------------------
+    # replaces the cache file atomically
+    def _writeCache(self):
+        if (self.cacheFile == None): return
+
+        cache = { 'lastCheck': self.lastCheck, 'responses': self.responses, 'rate': self.rate }
+        try:
+            folder = os.path.dirname(self.cacheFile)
+            if (folder and not os.path.isdir(folder)):
+                os.makedirs(folder)
+            tmpFile = self.cacheFile + '.tmp'
+            with open(tmpFile, 'w') as f:
+                json.dump(cache, f)
+            os.rename(tmpFile, self.cacheFile)
+        except (IOError, OSError) as e:
+            self._debug('Cannot write update cache: %s' % str(e))
 
     #---------------------------------------------------------------------------
     # convenience method for log messages
@@ -360,6 +660,168 @@ class GitHubPluginUpdater(object):
         if self.plugin:
             self.plugin.errorLog(msg)
 
+################################################################################
+class HTTPError(Exception):
+    pass
+
+################################################################################
+# small HTTP/HTTPS client that keeps one idle connection per host for reuse,
+# retries transient failures with exponential backoff and follows redirects
+class HTTPClient(object):
+
+    redirects = (301, 302, 303, 307, 308)
+    transient = (500, 502, 503, 504)
+
+    #---------------------------------------------------------------------------
+    def __init__(self, headers=None, timeout=30, retries=3, backoff=1.0):
+        self.headers = dict(headers or { })
+        self.timeout = timeout
+        self.retries = retries
+        self.backoff = backoff
+        # debug message sink
+        self.log = None
+
+        # (scheme, host, port) -> idle connection
+        self.idle = { }
+        self.lock = threading.Lock()
+        self.connectionsOpened = 0
+
+    #---------------------------------------------------------------------------
+    # GET the url and return (status, headers, body)
+    def fetch(self, url, headers=None):
+        response = self.open(url, headers)
+        return (response.status, response.headers, response.read())
+
+    #---------------------------------------------------------------------------
+    # GET the url and return an HTTPClientResponse to read the body from in
+    # pieces; the connection goes back to the pool once the body is read
+    def open(self, url, headers=None, maxRedirects=5):
+        for redirect in range(maxRedirects + 1):
+            response = self._openWithRetries(url, headers)
+            if (response.status not in self.redirects or 'location' not in response.headers):
+                return response
+
+            # drain the redirect body, so the connection can be reused
+            response.read()
+            url = urlparse.urljoin(url, response.headers['location'])
+            self._log('Redirected to %s' % url)
+
+        raise HTTPError('Too many redirects')
+
+    #---------------------------------------------------------------------------
+    # drops every idle connection
+    def close(self):
+        with self.lock:
+            connections = self.idle.values()
+            self.idle = { }
+        for conn in connections:
+            conn.close()
+
+    #---------------------------------------------------------------------------
+    def _openWithRetries(self, url, headers):
+        parts = urlparse.urlsplit(url)
+        if (parts.scheme not in ('http', 'https')):
+            raise HTTPError('Unsupported URL: %s' % url)
+        key = (parts.scheme, parts.hostname, parts.port)
+        path = parts.path or '/'
+        if (parts.query):
+            path += '?' + parts.query
+
+        allHeaders = dict(self.headers)
+        allHeaders.update(headers or { })
+
+        attempt = 0
+        while True:
+            (conn, reused) = self._connection(key)
+            try:
+                conn.request('GET', path, None, allHeaders)
+                response = conn.getresponse()
+            except (socket.error, httplib.HTTPException) as e:
+                conn.close()
+                if (reused):
+                    # the server dropped the idle connection, not a failure
+                    continue
+                error = e
+            else:
+                if (response.status not in self.transient or attempt >= self.retries):
+                    return HTTPClientResponse(self, key, conn, response)
+                response.read()
+                self._release(key, conn, response)
+                error = HTTPError('HTTP %d' % response.status)
+
+            if (attempt >= self.retries):
+                raise error
+            delay = self.backoff * (2 ** attempt)
+            self._log('%s failed (%s), retrying in %.1f sec.' % (url, str(error), delay))
+            time.sleep(delay)
+            attempt += 1
+
+    #---------------------------------------------------------------------------
+    # returns (connection, reused): an idle connection to the host, or a new one
+    def _connection(self, key):
+        with self.lock:
+            conn = self.idle.pop(key, None)
+        if (conn != None):
+            return (conn, True)
+
+        (scheme, host, port) = key
+        self.connectionsOpened += 1
+        if (scheme == 'https'):
+            try:
+                context = ssl.create_default_context()
+                return (httplib.HTTPSConnection(host, port, timeout=self.timeout, context=context), False)
+            except AttributeError:
+                # Python before 2.7.9
+                return (httplib.HTTPSConnection(host, port, timeout=self.timeout), False)
+        return (httplib.HTTPConnection(host, port, timeout=self.timeout), False)
+
+    #---------------------------------------------------------------------------
+    # keeps the connection for the next request to the host, if it can be
+    def _release(self, key, conn, response):
+        if (response.will_close):
+            conn.close()
+            return
+        with self.lock:
+            if (key not in self.idle):
+                self.idle[key] = conn
+                return
+        conn.close()
+
+    #---------------------------------------------------------------------------
+    def _log(self, msg):
+        if (self.log != None):
+            self.log(msg)
+
+################################################################################
+class HTTPClientResponse(object):
+
+    #---------------------------------------------------------------------------
+    def __init__(self, client, key, conn, response):
+        self.client = client
+        self.key = key
+        self.conn = conn
+        self.response = response
+        self.status = response.status
+        self.headers = dict((name.lower(), value) for name, value in response.getheaders())
+
+    #---------------------------------------------------------------------------
+    # reads up to amt bytes of the body, or all of it
+    def read(self, amt=None):
+        if (self.conn == None):
+            return ''
+        data = self.response.read(amt)
+        if (amt == None or not data or self.response.isclosed()):
+            self.client._release(self.key, self.conn, self.response)
+            self.conn = None
+        return data
+
+    #---------------------------------------------------------------------------
+    # gives up on the rest of the body, the connection cannot be reused
+    def close(self):
+        if (self.conn != None):
+            self.conn.close()
+            self.conn = None
+
 ################################################################################
 # maps the standard version string as a tuple for comparrison
 def ver(vstr): return tuple(map(int, (vstr.split('.'))))
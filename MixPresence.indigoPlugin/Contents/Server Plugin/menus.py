@@ -0,0 +1,62 @@
+#! /usr/bin/env python
+# -*- coding: utf-8 -*-
+#######################
+
+################################################################################
+# enabled devices of a few plugin device types ("<pluginId>.<deviceTypeId>"),
+# for the config UI menus. A type is read from the server the first time its
+# menu is asked for and kept current from the device callbacks afterwards.
+class DeviceMenuIndex(object):
+
+    #---------------------------------------------------------------------------
+    def __init__(self):
+        # device type -> {device id: name}, for the types read so far
+        self.devices = {}
+        # device type -> sorted menu list, None until rebuilt
+        self.menus = {}
+        # plugins owning the types read so far, for a cheap first check
+        self.pluginIds = set()
+
+    #---------------------------------------------------------------------------
+    def __contains__(self, deviceType):
+        return deviceType in self.devices
+
+    #---------------------------------------------------------------------------
+    # takes the enabled devices of a type from an iterable of devices
+    def load(self, deviceType, devices):
+        self.devices[deviceType] = dict((device.id, device.name) for device in devices if device.enabled)
+        self.menus[deviceType] = None
+        self.pluginIds.add(deviceType.rsplit('.', 1)[0])
+
+    #---------------------------------------------------------------------------
+    # (device id, name) list sorted by name, built again only after a change
+    def menu(self, deviceType):
+        menuList = self.menus[deviceType]
+        if menuList is None:
+            menuList = sorted(self.devices[deviceType].items(), key=lambda item: item[1].lower())
+            self.menus[deviceType] = menuList
+        return menuList
+
+    #---------------------------------------------------------------------------
+    # for created and updated devices; cheap when the device is of a type
+    # nobody asked for or its name and enabled flag did not change. Callers
+    # on a hot path check device.pluginId in pluginIds first.
+    def update(self, device):
+        deviceType = device.pluginId + '.' + device.deviceTypeId
+        devices = self.devices.get(deviceType, None)
+        if devices is None:
+            return
+        if device.enabled:
+            if devices.get(device.id, None) == device.name:
+                return
+            devices[device.id] = device.name
+        elif devices.pop(device.id, None) is None:
+            return
+        self.menus[deviceType] = None
+
+    #---------------------------------------------------------------------------
+    def remove(self, device):
+        deviceType = device.pluginId + '.' + device.deviceTypeId
+        devices = self.devices.get(deviceType, None)
+        if devices is not None and devices.pop(device.id, None) is not None:
+            self.menus[deviceType] = None
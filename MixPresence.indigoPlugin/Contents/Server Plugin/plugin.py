@@ -9,27 +9,111 @@ import math
 import decimal
 import datetime
 import time
+import collections
 from ghpu import GitHubPluginUpdater
+from scheduler import DeadlineScheduler
+from statusrequest import StatusRequestPool, TokenBucket
+from presence import PresenceRecord, SourceSnapshot, describeTraceEntry
+from stats import CallbackCounter, LatencyHistogram
+from rules import GROUPS, GROUP_VALUES, GROUP_MINUTES, RuleSet, RuleError
+from snapshot import RuntimeSnapshot
+from menus import DeviceMenuIndex
+from prober import ReachabilityProber, parseTarget
+from clock import monotonic
+from timeline import wallAge
 
 class Plugin(indigo.PluginBase):
 
+    # source changes arriving within this window are analyzed together
+    analyzeCoalesceWindow = 0.3
+    # a status response is analyzed this long after it arrived, unless the
+    # deviceUpdated carrying the renewed lastSeen comes first
+    statusSettleTime    = 2
+
+    # adaptive status polling (seconds)
+    statusIntervalMin   = 30
+    statusStableWindow  = 3600
+    statusBackoffMax    = 4
+    # a connected client is asked this long before its lastSeen crosses a threshold
+    statusThresholdLead = 60
+    # lastSeen ages where deviceAnalyzeStatus changes its mind
+    lastSeenThresholds  = (15 * 60, 20 * 60)
+    # +/- share of the interval used to keep devices out of phase
+    statusJitter        = 0.1
+    statusBurst         = 5
+
+    # source snapshots are re-read from the server this often (seconds)
+    sourceReconcileInterval = 900
+
+    # presence rules used when a device does not name its own rules file
+    defaultRulesFile    = 'rules.json'
+
+    # dirty runtime state is written to disk this often (seconds)
+    snapshotInterval    = 60
+
+    # trace entries kept per presence device
+    traceLength         = 100
+
     def __init__(self, pluginId, pluginDisplayName, pluginVersion, pluginPrefs):
         indigo.PluginBase.__init__(self, pluginId, pluginDisplayName, pluginVersion, pluginPrefs)
-        self.updater = GitHubPluginUpdater(self)
+        # the last update check result is cached next to the plugin prefs
+        self.updater = GitHubPluginUpdater(self, cacheFile=self.dataFilePath('update.json'))
             
         self.apiVersion    = "2.0"
         self.localAddress  = ""
 
-        # create empty device list      
+        # create empty device list (device id -> PresenceRecord)
         self.deviceList = {}
+        # source device id -> {presence device id: source kind}
         self.updateableList = {}
+        # every device id deviceUpdated cares about: presence and source devices
+        self.watchedDeviceIds = set()
+        # source device id -> SourceSnapshot, read by the analyzer
+        self.sourceCache = {}
+
+        # presence device id -> trace deque, kept across device restarts
+        self.traces = {}
+
+        # rules file path -> compiled RuleSet
+        self.ruleSets = {}
+
+        # candidate source devices for the config UI menus
+        self.deviceMenus = DeviceMenuIndex()
+
+        self.deviceUpdatedStats = CallbackCounter('deviceUpdated')
+        self.deviceDeletedStats = CallbackCounter('deviceDeleted')
+
+        # stage -> rolling histogram of how long it took (sec.)
+        #   schedule: task run later than its deadline
+        #   request:  silentStatusRequest round trip
+        #   rules:    rule table evaluation
+        #   write:    state update on the server
+        #   decision: source event or status request to decision
+        self.latencyStages = ('schedule', 'request', 'rules', 'write', 'decision')
+        self.latencyStats = dict((stage, LatencyHistogram(stage)) for stage in self.latencyStages)
+
+        # status and analyze deadlines for every presence device
+        self.scheduler = DeadlineScheduler()
+        # Unifi status requests run here, off the concurrent thread
+        self.requestPool = StatusRequestPool()
+        # ... and never faster than this
+        self.requestLimiter = TokenBucket()
+        # ping hosts of the presence devices are checked here
+        self.prober = ReachabilityProber(self.probeChanged)
         
+        # runtime state of the presence devices, kept across restarts
+        self.runtimeSnapshot = RuntimeSnapshot(self.dataFilePath('runtime.json'))
+
         self.unifiPlugin = None
         self.beaconPlugin = None
         
     def __del__(self):
         indigo.PluginBase.__del__(self)     
 
+    def dataFilePath(self, name):
+        # files the plugin keeps for itself, next to its Indigo prefs
+        return os.path.join(indigo.server.getInstallFolderPath(), 'Preferences', 'Plugins', self.pluginId + '.' + name)
+
     ###################################################################
     # Plugin
     ###################################################################
@@ -45,94 +129,323 @@ class Plugin(indigo.PluginBase):
             self.deleteDeviceFromList(device)
 
     def deviceCreated(self, device):
+        if device.pluginId in self.deviceMenus.pluginIds:
+            self.deviceMenus.update(device)
         if device.deviceTypeId == "presence":
             indigo.server.log (u"Created new device \"%s\" of type \"%s\"" % (device.name, device.deviceTypeId))
             pass
         
     def deviceDeleted(self, device):
-        if device.id in self.deviceList:
-            indigo.server.log (u"Deleted device \"%s\" of type \"%s\"" % (device.name, device.deviceTypeId))
-            self.deleteDeviceFromList(device)
+        counter = self.deviceDeletedStats
+        counter.seen += 1
+        if device.pluginId in self.deviceMenus.pluginIds:
+            self.deviceMenus.remove(device)
+        if device.id not in self.deviceList:
+            counter.rejected += 1
+            return
+        counter.accepted += 1
+        indigo.server.log (u"Deleted device \"%s\" of type \"%s\"" % (device.name, device.deviceTypeId))
+        self.deleteDeviceFromList(device)
+        self.traces.pop(device.id, None)
+        self.runtimeSnapshot.remove(device.id)
 
     def deviceUpdated (self, origDev, newDev):
+        # subscribeToChanges() sends every device of the database through
+        # here, so anything we do not watch is dropped right away; only
+        # devices of the plugins behind the config UI menus get a second look
+        counter = self.deviceUpdatedStats
+        counter.seen += 1
+        if origDev.id not in self.watchedDeviceIds:
+            counter.rejected += 1
+            if newDev.pluginId in self.deviceMenus.pluginIds:
+                self.deviceMenus.update(newDev)
+            return
+        counter.accepted += 1
+        started = time.time()
+        try:
+            # renamed, enabled or disabled menu candidates
+            if newDev.pluginId in self.deviceMenus.pluginIds:
+                self.deviceMenus.update(newDev)
+            self.watchedDeviceUpdated(origDev, newDev)
+        finally:
+            counter.elapsed += time.time() - started
+
+    def watchedDeviceUpdated (self, origDev, newDev):
+        snapshot = self.sourceCache.get(newDev.id, None)
+        if snapshot is not None:
+            snapshot.update(newDev)
         if origDev.id > 0:
-            if origDev.deviceTypeId == 'presence':
-                indigo.server.log (u"Updated device \"%s\" of type \"%s\"" % (origDev.name, origDev.deviceTypeId))
-                self.deleteDeviceFromList(origDev)
-                self.addDeviceToList(newDev)
-                pass
+            presence = self.deviceList.get(origDev.id, None)
+            if presence is not None:
+                self.presenceDeviceUpdated(presence, origDev, newDev)
             if origDev.id in self.updateableList:
-                if not origDev.states['onOffState'] == newDev.states['onOffState']:
-                    parentDeviceId = int(self.updateableList[origDev.id]["parentDeviceId"])
-                    if parentDeviceId in self.deviceList:
-                        msg = u'device "' + origDev.name + u'" has been updated. Now is '
-                        if newDev.states['onOffState']:
-                            msg += u'on.'                       
-                        else:
-                            msg += u'off.'
-                        self.debugLog(msg)
-                        #indigo.server.log (msg)
-                        self.deviceList[parentDeviceId]['statusNextTime'] = datetime.datetime.now() - datetime.timedelta(seconds=10)
+                onOffState = newDev.states['onOffState']
+                if not origDev.states['onOffState'] == onOffState:
+                    self.sourceChanged(origDev.id, origDev.name, onOffState)
+                elif not origDev.states.get('lastSeen', None) == newDev.states.get('lastSeen', None):
+                    self.lastSeenChanged(origDev.id)
+
+    def probeChanged(self, target):
+        # called from the prober thread
+        self.sourceChanged(target.id, target.name, target.onOffState)
+
+    def sourceChanged(self, sourceId, name, onOffState):
+        if self.debug:
+            self.debugLog(u'device "%s" has been updated. Now is %s.' % (name, u'on' if onOffState else u'off'))
+        # fan out to every presence device depending on this source
+        for parentDeviceId, source in self.updateableList.get(sourceId, {}).items():
+            presence = self.deviceList.get(parentDeviceId, None)
+            if presence is None:
+                continue
+            presence.lastTransition = time.time()
+            if presence.triggerTime is None:
+                presence.triggerTime = presence.lastTransition
+            presence.trace.append((presence.lastTransition, 'source', sourceId, source, onOffState))
+            self.scheduleAnalyze(presence, self.analyzeCoalesceWindow, coalesce=True)
+            if source == 'unifi':
+                # the event already carries fresh Unifi state, so the
+                # next status request can wait a full interval
+                statusInterval = self.nextStatusInterval(presence)
+                if statusInterval > 0:
+                    self.scheduleStatus(presence, statusInterval)
+            else:
+                # a beacon or ping change says nothing about the WIFI, refresh it
+                self.scheduleStatus(presence, self.analyzeCoalesceWindow, coalesce=True)
+            if not source == 'probe':
+                # ... and the ping hosts get a look too
+                self.probeSoon(presence)
+
+    def lastSeenChanged(self, sourceId):
+        # a status response: analyses waiting for it run now, nobody else
+        # cares about a client that is merely still there
+        for parentDeviceId, source in self.updateableList.get(sourceId, {}).items():
+            presence = self.deviceList.get(parentDeviceId, None)
+            if presence is not None and presence.analyzeNextTime is not None:
+                self.scheduleAnalyze(presence, 0, coalesce=True)
+
+    def probeSoon(self, presence):
+        for sourceId, source, group in presence.sources:
+            if source == 'probe':
+                self.prober.probeSoon(sourceId)
+
+    def presenceDeviceUpdated(self, presence, origDev, newDev):
+        # keep the record pointing at the latest copy of the device
+        presence.ref = newDev
+        presence.states.update(newDev.states)
+        # our own state writes come back through here, nothing to reload
+        if origDev.pluginProps == newDev.pluginProps:
+            return
+        # the record is rebuilt on the concurrent thread, where the analyzer
+        # reads it; a later edit before then replaces this one
+        presence.pendingProps = newDev.pluginProps
+        self.scheduler.schedule((presence.id, 'configure'), time.time())
+
+    def presenceDeviceConfigure(self, presence):
+        props = presence.pendingProps
+        presence.pendingProps = None
+        if props is None:
+            return
+        oldSources = presence.sources
+        changed = presence.configure(props)
+        if not changed:
+            return
+        indigo.server.log (u"Updated device \"%s\": %s" % (presence.name, u", ".join(changed)))
+
+        # runtime state and schedules stay, only what the change affects is redone
+        if 'sources' in changed:
+            # sources that stay keep their snapshot and probe target
+            kept = set((sourceId, source) for sourceId, source, group in presence.sources)
+            self.deleteDeviceFromUpdateable(presence, [old for old in oldSources if (old[0], old[1]) not in kept])
+            self.addDeviceToUpdateable(presence)
+            # a newly added source device is not a change of its signal
+            for slot, source in enumerate(presence.sources):
+                if source not in oldSources:
+                    snapshot = self.sourceCache.get(source[0], None)
+                    if snapshot is not None and snapshot.onOffState:
+                        presence.onMask |= 1 << slot
+            # ... nor for the timeline, or the group dwell times start over
+            presence.timeline.resume(presence.onMask)
+            self.scheduleAnalyze(presence, self.analyzeCoalesceWindow, coalesce=True)
+
+        if 'rulesFile' in changed:
+            presence.ruleSet = self.getRuleSet(presence.rulesFile)
+            self.scheduleAnalyze(presence, self.analyzeCoalesceWindow, coalesce=True)
+
+        if 'statusInterval' in changed or 'adaptiveStatus' in changed:
+            statusInterval = self.nextStatusInterval(presence)
+            if statusInterval > 0:
+                self.scheduleStatus(presence, statusInterval)
+            else:
+                self.scheduler.cancel((presence.id, 'status'))
+                presence.statusNextTime = None
+
+        self.runtimeSnapshot.touch(presence.id)
+
+    def didDeviceCommPropertyChange(self, origDev, newDev):
+        # configuration changes are patched in place by presenceDeviceUpdated,
+        # restarting the device would throw its runtime state away
+        return False
 
     def addDeviceToList(self,device):
         if device:        
             if device.id not in self.deviceList:   
-                statusNextTime = datetime.datetime.now() - datetime.timedelta(seconds=10)
-                statusInterval = 600 #device.pluginProps["statusInterval"]
-                self.deviceList[device.id] = {
-                 'ref':device,
-                 'statusInterval':statusInterval, 
-                 'statusNextTime': statusNextTime,
-                 'analyze': False, 
-                 'analyzeNextTime': statusNextTime, 
-                 'lastSeen': 0, 
-                 'firstSeen': 0, 
-                 'onUnifi': False, 
-                 'onGeo1': False,
-                 'onGeo2': False,
-                 'onGeo3': False
-                 }       
-                self.addDeviceToUpdateable(device)
+                trace = self.traces.get(device.id, None)
+                if trace is None:
+                    trace = self.traces[device.id] = collections.deque(maxlen=self.traceLength)
+                presence = PresenceRecord(device, time.time(), trace)
+                presence.ruleSet = self.getRuleSet(presence.rulesFile)
+                # carry on from the last known source values after a restart
+                entry = self.runtimeSnapshot.get(device.id)
+                restored = entry is not None and presence.restoreRuntimeState(entry)
+                self.deviceList[device.id] = presence
+                self.watchedDeviceIds.add(device.id)
+                self.addDeviceToUpdateable(presence)
+                if presence.statusInterval > 0:
+                    # the first requests are spread over the whole interval
+                    delay = self.devicePhase(device.id) * presence.statusInterval
+                    if restored and presence.statusNextTime is not None and presence.statusNextTime > time.time():
+                        # keep the old schedule, only overdue requests are spread out
+                        delay = presence.statusNextTime - time.time()
+                    self.scheduleStatus(presence, delay)
 
     def deleteDeviceFromList(self, device):
         if device:
             if device.id in self.deviceList:
-                self.deleteDeviceFromUpdateable(device)
+                self.runtimeSnapshot.store(self.deviceList[device.id])
+                self.deleteDeviceFromUpdateable(self.deviceList[device.id])
+                self.scheduler.cancel((device.id, 'status'))
+                self.scheduler.cancel((device.id, 'analyze'))
+                self.scheduler.cancel((device.id, 'configure'))
+                self.requestLimiter.cancel(device.id)
                 del self.deviceList[device.id]
-
-    def addDeviceToUpdateable(self,device):
-        unifideviceid     = int(device.pluginProps["unifidevice"])
-        geofencedevice1id = int(device.pluginProps["geofencedevice1"])
-        geofencedevice2id = int(device.pluginProps["geofencedevice2"])
-        geofencedevice3id = int(device.pluginProps["geofencedevice3"])
-        if unifideviceid > 0:
-            self.updateableList[unifideviceid]     = {'parentDeviceId': device.id}
-        if geofencedevice1id > 0:    
-            self.updateableList[geofencedevice1id] = {'parentDeviceId': device.id}
-        if geofencedevice2id > 0:
-            self.updateableList[geofencedevice2id] = {'parentDeviceId': device.id}
-        if geofencedevice3id > 0:
-            self.updateableList[geofencedevice3id] = {'parentDeviceId': device.id}
-        
-
-
-    def deleteDeviceFromUpdateable(self,device):
-        unifideviceid     = int(device.pluginProps["unifidevice"])
-        geofencedevice1id = int(device.pluginProps["geofencedevice1"])
-        geofencedevice2id = int(device.pluginProps["geofencedevice2"])
-        geofencedevice3id = int(device.pluginProps["geofencedevice3"])
-        if unifideviceid in self.updateableList:
-            del self.updateableList[unifideviceid]
-        if geofencedevice1id in self.updateableList:
-            del self.updateableList[geofencedevice1id]    
-        if geofencedevice2id in self.updateableList:
-            del self.updateableList[geofencedevice2id]
-        if geofencedevice3id in self.updateableList:
-            del self.updateableList[geofencedevice3id]
+                self.watchedDeviceIds.discard(device.id)
+
+    def getRuleSet(self, rulesFile):
+        # rule sets are compiled once and shared by every device using them
+        if not rulesFile:
+            rulesFile = self.defaultRulesFile
+        if rulesFile not in self.ruleSets:
+            try:
+                self.ruleSets[rulesFile] = RuleSet.load(rulesFile)
+            except RuleError, e:
+                self.errorLog (u"Error: " + unicode(e))
+                if rulesFile == self.defaultRulesFile:
+                    raise
+                return self.getRuleSet(self.defaultRulesFile)
+            if self.ruleSets[rulesFile].unusedInputs:
+                self.debugLog(u"Rules file %s ignores: %s" % (rulesFile, u", ".join(self.ruleSets[rulesFile].unusedInputs)))
+        return self.ruleSets[rulesFile]
+
+    def scheduleStatus(self, presence, delay=0, coalesce=False):
+        presence.statusNextTime = self.scheduler.schedule((presence.id, 'status'), time.time() + delay, coalesce)
+
+    def scheduleAnalyze(self, presence, delay=0, coalesce=False):
+        presence.analyzeNextTime = self.scheduler.schedule((presence.id, 'analyze'), time.time() + delay, coalesce)
+
+    def devicePhase(self, deviceId):
+        # deterministic value in [0, 1), well spread even for consecutive ids
+        return (deviceId * 0.6180339887498949) % 1.0
+
+    def nextStatusInterval(self, presence, refreshing=False):
+        # every device keeps its own period within the jitter, so devices
+        # sharing an interval drift apart instead of asking together.
+        # Adaptive devices poll slower while nothing happens, and early only
+        # when the lastSeen of a connected client is about to cross one of
+        # the analyzer thresholds, so rule #8 never sees it stale. Source
+        # changes do not speed polling up: the events carry their own news.
+        # refreshing: a status request goes out now and renews lastSeen
+        statusInterval = presence.statusInterval
+        if statusInterval <= 0:
+            return statusInterval
+        jitter = 1.0 + self.statusJitter * (2 * self.devicePhase(presence.id) - 1)
+        if not presence.adaptiveStatus:
+            return int(max(statusInterval * jitter, 1))
+
+        now = time.time()
+        interval = statusInterval
+        stableTime = now - presence.lastTransition
+        if stableTime > self.statusStableWindow:
+            backoff = min(2 ** int(stableTime / self.statusStableWindow), self.statusBackoffMax)
+            interval = statusInterval * backoff
+        interval *= jitter
+
+        lastSeen = now if refreshing else presence.lastSeen
+        if lastSeen > 0 and self.unifiConnected(presence):
+            for threshold in self.lastSeenThresholds:
+                crossing = lastSeen + threshold - self.statusThresholdLead - now
+                if crossing > 0:
+                    interval = min(interval, crossing)
+                    break
+        return int(max(interval, min(statusInterval, self.statusIntervalMin)))
+
+    def unifiConnected(self, presence):
+        for slot, (sourceId, source, group) in enumerate(presence.sources):
+            if source == 'unifi' and presence.onMask & (1 << slot):
+                return True
+        return False
+
+    def addDeviceToUpdateable(self,presence):
+        for slot, (sourceId, source, group) in enumerate(presence.sources):
+            self.updateableList.setdefault(sourceId, {})[presence.id] = source
+            if source == 'probe':
+                if sourceId not in self.sourceCache:
+                    # a restart carries on from the saved state of the host
+                    self.sourceCache[sourceId] = self.prober.add(sourceId, bool(presence.onMask & (1 << slot)))
+                continue
+            self.watchedDeviceIds.add(sourceId)
+            if sourceId not in self.sourceCache:
+                self.readSource(sourceId)
+
+    def deleteDeviceFromUpdateable(self,presence, sources=None):
+        if sources is None:
+            sources = presence.sources
+        for sourceId, source, group in sources:
+            dependents = self.updateableList.get(sourceId, None)
+            if dependents is not None:
+                dependents.pop(presence.id, None)
+                if not dependents:
+                    del self.updateableList[sourceId]
+                    self.sourceCache.pop(sourceId, None)
+                    if source == 'probe':
+                        self.prober.remove(sourceId)
+                    elif sourceId not in self.deviceList:
+                        self.watchedDeviceIds.discard(sourceId)
+
+    def readSource(self, sourceId):
+        # the only place source devices are fetched from the server
+        try:
+            self.sourceCache[sourceId] = SourceSnapshot(indigo.devices[sourceId])
+        except KeyError:
+            self.errorLog (u"Error: source device %d not found" % sourceId)
+            self.sourceCache.pop(sourceId, None)
+
+    def reconcileSources(self):
+        # catch anything deviceUpdated might have missed, and act on it the
+        # way deviceUpdated would have
+        for sourceId in self.sourceCache.keys():
+            if sourceId in self.prober:
+                continue
+            old = self.sourceCache.get(sourceId, None)
+            self.readSource(sourceId)
+            new = self.sourceCache.get(sourceId, None)
+            if old is None or new is None:
+                continue
+            if not old.onOffState == new.onOffState:
+                self.sourceChanged(sourceId, new.name, new.onOffState)
+            elif not old.lastSeen == new.lastSeen:
+                # nobody is waiting for this one, analyze it anyway
+                for parentDeviceId in self.updateableList.get(sourceId, {}):
+                    presence = self.deviceList.get(parentDeviceId, None)
+                    if presence is not None:
+                        self.scheduleAnalyze(presence, self.analyzeCoalesceWindow, coalesce=True)
 
     def startup(self):
         self.loadPluginPrefs()
         self.debugLog(u"startup called")
+
+        # before any deviceStartComm, so records start from the saved state
+        if self.runtimeSnapshot.load():
+            self.debugLog(u"Loaded runtime state of %d devices" % len(self.runtimeSnapshot.entries))
                 
         self.unifiPlugin  = indigo.server.getPlugin("com.tenallero.indigoplugin.unifi")
         self.beaconPlugin = indigo.server.getPlugin("se.furtenbach.indigo.plugin.beacon")
@@ -141,11 +454,33 @@ class Plugin(indigo.PluginBase):
             self.errorLog (u"Error: Unifi plugin is not enabled")
         if not self.beaconPlugin.isEnabled():
             self.errorLog (u"Error: Beacon plugin is not enabled")        
-        self.updater.checkForUpdate()
+        # update checks never hold up startup, report the last known result
+        # and check again in the background when due
+        updateUrl = self.updater.getCachedUpdate()
+        if updateUrl is not None:
+            self.errorLog (u"A new version is available: " + updateUrl)
+        if self.updater.autoCheck:
+            self.scheduler.schedule((0, 'update'), self.updater.nextCheckTime())
+        self.requestPool.start()
+        self.prober.start()
+        self.scheduler.schedule((0, 'reconcile'), time.time() + self.sourceReconcileInterval)
+        self.scheduler.schedule((0, 'snapshot'), time.time() + self.snapshotInterval)
         indigo.devices.subscribeToChanges()
 
     def shutdown(self):
         self.debugLog(u"shutdown called")
+        self.requestPool.stop()
+        self.prober.stop()
+        self.saveRuntimeSnapshot(flush=True)
+
+    def saveRuntimeSnapshot(self, flush=False):
+        try:
+            folder = os.path.dirname(self.runtimeSnapshot.path)
+            if not os.path.isdir(folder):
+                os.makedirs(folder)
+            self.runtimeSnapshot.save(self.deviceList, flush=flush)
+        except (IOError, OSError), e:
+            self.errorLog (u"Error: cannot save runtime state: " + unicode(e))
 
     def getDeviceConfigUiValues(self, pluginProps, typeId, devId):
         valuesDict = pluginProps
@@ -154,9 +489,44 @@ class Plugin(indigo.PluginBase):
 
     def validateDeviceConfigUi(self, valuesDict, typeId, devId):
         self.debugLog(u"validating device Prefs called") 
+        errorMsgDict = indigo.Dict()
+        try:
+            if int(valuesDict.get("statusInterval", 600)) < 0:
+                raise ValueError
+        except ValueError:
+            errorMsgDict["statusInterval"] = u"Enter a number of seconds (0 disables polling)"
+            return (False, valuesDict, errorMsgDict)
+        try:
+            if float(valuesDict.get("debounce", 0) or 0) < 0:
+                raise ValueError
+        except ValueError:
+            errorMsgDict["debounce"] = u"Enter a number of seconds (0 takes every change at once)"
+            return (False, valuesDict, errorMsgDict)
+        for text in valuesDict.get("pinghosts", "").replace(',', ' ').split():
+            try:
+                parseTarget(text)
+            except ValueError, e:
+                errorMsgDict["pinghosts"] = unicode(e)
+                return (False, valuesDict, errorMsgDict)
+        rulesFile = valuesDict.get("rulesFile", "").strip()
+        if rulesFile:
+            try:
+                self.ruleSets[rulesFile] = RuleSet.load(rulesFile)
+            except RuleError, e:
+                errorMsgDict["rulesFile"] = unicode(e)
+                return (False, valuesDict, errorMsgDict)
         return (True, valuesDict)
 
     def validatePrefsConfigUi(self, valuesDict):        
+        errorMsgDict = indigo.Dict()
+        for key in ('statusWorkers', 'statusTimeout', 'statusRate', 'probeInterval'):
+            try:
+                if float(valuesDict.get(key, 1)) <= 0:
+                    raise ValueError
+            except ValueError:
+                errorMsgDict[key] = u"Enter a positive number"
+        if len(errorMsgDict) > 0:
+            return (False, valuesDict, errorMsgDict)
         return (True, valuesDict)
 
     def closedDeviceConfigUi(self, valuesDict, userCancelled, typeId, devId):
@@ -179,31 +549,34 @@ class Plugin(indigo.PluginBase):
             self.debug = self.pluginPrefs['debugEnabled']
         else:
             self.debug = False        
+
+        # status request concurrency and timeout
+        statusWorkers = int(float(self.pluginPrefs.get('statusWorkers', 4)))
+        statusTimeout = float(self.pluginPrefs.get('statusTimeout', 10))
+        self.requestPool.configure(statusWorkers, statusTimeout)
+        statusRate    = float(self.pluginPrefs.get('statusRate', 60))
+        self.requestLimiter.configure(statusRate / 60.0, self.statusBurst)
+
+        # ping host probing
+        probeInterval = float(self.pluginPrefs.get('probeInterval', 120))
+        self.prober.configure(probeInterval, self.pluginPrefs.get('probeIcmp', True))
   
     
+    def getDeviceMenu(self, deviceType):
+        # the database is only walked the first time a type is asked for,
+        # the device callbacks keep it current from then on
+        if deviceType not in self.deviceMenus:
+            self.deviceMenus.load(deviceType, indigo.devices.iter(filter=deviceType))
+        return self.deviceMenus.menu(deviceType)
+
     def menuGetDevsUnifi(self, filter, valuesDict, typeId, elemId):
-        menuList = []
-        for dev in indigo.devices.iter(filter="com.tenallero.indigoplugin.unifi.unifiuser"):
-            if dev.enabled:
-                menuList.append((dev.id, dev.name))
-        menuList.append((0,'(None)'))
-        return menuList
+        return self.getDeviceMenu("com.tenallero.indigoplugin.unifi.unifiuser")
            
     def menuGetDevsPing(self, filter, valuesDict, typeId, elemId):
-        menuList = []
-        for dev in indigo.devices.iter(filter="com.tenallero.indigoplugin.ping.pingdevice"):
-            if dev.enabled:
-                menuList.append((dev.id, dev.name))
-        menuList.append((0,'(None)'))
-        return menuList  
+        return self.getDeviceMenu("com.tenallero.indigoplugin.ping.pingdevice")
          
     def menuGetDevsGeofence(self, filter, valuesDict, typeId, elemId):
-        menuList = []
-        for dev in indigo.devices.iter(filter="se.furtenbach.indigo.plugin.beacon.beacon"):
-            if dev.enabled:
-                menuList.append((dev.id, dev.name))
-        menuList.append((0,'(None)'))
-        return menuList  
+        return self.getDeviceMenu("se.furtenbach.indigo.plugin.beacon.beacon")
     
     ###################################################################
     # Concurrent Thread.
@@ -215,40 +588,9 @@ class Plugin(indigo.PluginBase):
         
         try:
             while self.stopThread == False: 
-                indigoDevice = None
-                try:
-                    todayNow = datetime.datetime.now()
-                    for presenceDevice in self.deviceList:
-                        if self.deviceList[presenceDevice]['statusInterval'] > 0:
-                            statusNextTime = self.deviceList[presenceDevice]['statusNextTime']
-
-                            if statusNextTime <= todayNow:                            
-                                statusInterval = self.deviceList[presenceDevice]['statusInterval']
-                                statusNextTime = todayNow + datetime.timedelta(seconds=int(statusInterval))
-                                self.deviceList[presenceDevice]['statusNextTime'] = statusNextTime                         
-
-                                indigoDevice = self.deviceList[presenceDevice]['ref']
-                                
-                                self.deviceList[presenceDevice]['analyze'] = True 
-                                self.deviceList[presenceDevice]['analyzeNextTime'] = todayNow + datetime.timedelta(seconds=1)    
-                                self.debugLog(u'ConcurrentThread. Sent "' + indigoDevice.name + '" status request')                 
-                                self.deviceRequestStatus(indigoDevice)
-                                self.debugLog(u'ConcurrentThread. Received "' + indigoDevice.name + '" status')  
-                        
-                        if self.deviceList[presenceDevice]['analyze']:  
-                            analyzeNextTime = self.deviceList[presenceDevice]['analyzeNextTime'] 
-                            if analyzeNextTime <= todayNow: 
-                                indigoDevice = self.deviceList[presenceDevice]['ref'] 
-                                self.debugLog(u'ConcurrentThread. Analyzing "' + indigoDevice.name + '"')   
-                                self.deviceList[presenceDevice]['analyze'] = False                        
-                                self.deviceAnalyzeStatus(indigoDevice)
-                        
-                        
-                except Exception,e:
-                    self.errorLog (u"Error: " + str(e))
-                    pass
-                self.sleep(0.3)
-            
+                self.runDueTasks(time.time())
+                # sleep until the earliest deadline, or until someone reschedules
+                self.scheduler.wait()
 
         except self.StopThread:
             pass
@@ -257,8 +599,80 @@ class Plugin(indigo.PluginBase):
             self.errorLog (u"Error: " + str(e))
             pass    
 
+    def runDueTasks(self, now):
+        # only the devices whose deadline has passed are touched
+        for presenceDevice, task in self.scheduler.popDue(now):
+            try:
+                self.runTask(presenceDevice, task, now)
+            except Exception,e:
+                self.errorLog (u"Error: " + str(e))
+                pass
+
+    def runTask(self, presenceDevice, task, now):
+        if task == 'reconcile':
+            self.reconcileSources()
+            self.scheduler.schedule((0, 'reconcile'), now + self.sourceReconcileInterval)
+            return
+        if task == 'update':
+            # a failed check keeps the last result and is tried again sooner
+            if self.updater.checkDue(now):
+                self.updater.checkForUpdateInBackground()
+            self.scheduler.schedule((0, 'update'), now + min(self.updater.retryInterval, self.updater.checkInterval))
+            return
+        if task == 'snapshot':
+            self.saveRuntimeSnapshot()
+            self.scheduler.schedule((0, 'snapshot'), now + self.snapshotInterval)
+            return
+        if task == 'reap':
+            # requests running past their timeout are given up on even when
+            # no new one is submitted, and come back while others are pending
+            self.requestPool.reap(now)
+            deadline = self.requestPool.nextTimeout()
+            if deadline is not None:
+                self.scheduler.schedule((0, 'reap'), deadline, coalesce=True)
+            return
+
+        presence = self.deviceList.get(presenceDevice, None)
+        if presence is None:
+            return
+        indigoDevice = presence.ref
+
+        if task == 'status':
+            if presence.statusNextTime is not None and presence.statusNextTime <= now:
+                self.latencyStats['schedule'].record(now - presence.statusNextTime, now)
+            presence.statusNextTime = None
+            throttle = self.requestLimiter.reserve(presenceDevice, now)
+            if throttle > 0:
+                # come back when the reserved token is valid
+                self.scheduleStatus(presence, throttle)
+                return
+            statusInterval = self.nextStatusInterval(presence, refreshing=True)
+            if statusInterval > 0:
+                self.scheduleStatus(presence, statusInterval)
+            if self.deviceRequestStatus(presence):
+                if presence.triggerTime is None:
+                    presence.triggerTime = now
+                presence.trace.append((now, 'status'))
+                # analyzed when the status arrives, or once it times out
+                self.scheduleAnalyze(presence, self.requestPool.timeout, coalesce=True)
+                self.scheduler.schedule((0, 'reap'), now + self.requestPool.timeout, coalesce=True)
+                if self.debug:
+                    self.debugLog(u'ConcurrentThread. Sent "%s" status request' % indigoDevice.name)
+
+        elif task == 'configure':
+            self.presenceDeviceConfigure(presence)
+
+        elif task == 'analyze':
+            if presence.analyzeNextTime is not None and presence.analyzeNextTime <= now:
+                self.latencyStats['schedule'].record(now - presence.analyzeNextTime, now)
+            presence.analyzeNextTime = None
+            if self.debug:
+                self.debugLog(u'ConcurrentThread. Analyzing "%s"' % indigoDevice.name)
+            self.deviceAnalyzeStatus(presence)
+
     def stopConcurrentThread(self):
         self.stopThread = True
+        self.scheduler.interrupt()
         self.debugLog(u"stopConcurrentThread called")
     
     ###################################################################
@@ -267,111 +681,190 @@ class Plugin(indigo.PluginBase):
 
 
     
-    def deviceRequestStatus(self,device):
-        unifideviceid     = int(device.pluginProps["unifidevice"])
-        self.unifiPlugin.executeAction("silentStatusRequest", deviceId=unifideviceid)
+    def deviceRequestStatus(self,presence):
+        unifiIds = [sourceId for sourceId, source, group in presence.sources if source == 'unifi']
+        if not unifiIds:
+            return False
+        def request():
+            for unifiId in unifiIds:
+                self.unifiPlugin.executeAction("silentStatusRequest", deviceId=unifiId)
+        return self.requestPool.submit(presence.id, request, self.deviceStatusReceived)
+
+    def deviceStatusReceived(self, deviceId, error, elapsed):
+        # called from a request pool worker, or from whoever reaped it
+        presence = self.deviceList.get(deviceId, None)
+        if presence is None:
+            return
+        presence.lastRequestRtt = elapsed
+        self.latencyStats['request'].record(elapsed, time.time())
+        if error is None:
+            if self.debug:
+                self.debugLog(u'Received "%s" status (%.2f sec.)' % (presence.name, elapsed))
+            # the renewed lastSeen reaches the source cache with its
+            # deviceUpdated, which pulls this analysis in; without one the
+            # client was not seen and the cache is current already
+            self.scheduleAnalyze(presence, self.statusSettleTime, coalesce=True)
+        else:
+            self.errorLog(u'Error: "' + presence.name + u'" status request failed: ' + unicode(error))
  
-    def deviceAnalyzeStatus(self,device):
-        changeCause  = ""
-        changed      = False
-        changedUnifi = False
-        changedGeo1  = False
-        changedGeo2  = False
-        changedGeo3  = False
+    def deviceAnalyzeStatus(self,presence):
         onOffState   = False
+        device       = presence.ref
+        sourceCache  = self.sourceCache
         
-        unifideviceid     = int(device.pluginProps["unifidevice"])
-        geofencedevice1id = int(device.pluginProps["geofencedevice1"])
-        geofencedevice2id = int(device.pluginProps["geofencedevice2"])
-        geofencedevice3id = int(device.pluginProps["geofencedevice3"])
-        
-        onUnifi = indigo.devices[unifideviceid].states["onOffState"]     
-        onGeo1  = indigo.devices[geofencedevice1id].states["onOffState"]
-        onGeo2  = indigo.devices[geofencedevice2id].states["onOffState"]
-        onGeo3  = indigo.devices[geofencedevice3id].states["onOffState"]
-        
-        firstSeen  = int(indigo.devices[unifideviceid].states["firstSeen"])
-        lastSeen   = int(indigo.devices[unifideviceid].states["lastSeen"])
-       
-        if device.id in self.deviceList:
-            if not onUnifi == self.deviceList[device.id]['onUnifi']:
-                changedUnifi = True
-                changed      = True          
-            if not onGeo1 == self.deviceList[device.id]['onGeo1']:
-                changedGeo1 = True
-                changed     = True
-            if not onGeo2 == self.deviceList[device.id]['onGeo2']:
-                changedGeo2 = True
-                changed     = True
-            if not onGeo3 == self.deviceList[device.id]['onGeo3']:
-                changedGeo3 = True
-                changed     = True
-            if not onUnifi == self.deviceList[device.id]['onUnifi']:
-                changedUnifi = True
-                changed      = True
-                                                                                
-            self.deviceList[device.id]['onUnifi']   = onUnifi
-            self.deviceList[device.id]['onGeo1']    = onGeo1
-            self.deviceList[device.id]['onGeo2']    = onGeo2
-            self.deviceList[device.id]['onGeo3']    = onGeo3
-            self.deviceList[device.id]['firstSeen'] = firstSeen
-            self.deviceList[device.id]['lastSeen']  = lastSeen  
-       
-        now = int(time.time())
-        minutesLastSeen = (now - lastSeen) / 60
-        
-        timeDelta = datetime.datetime.now() - indigo.devices[geofencedevice1id].lastChanged
-        minutesOnGeo1 = (timeDelta.seconds) / 60
-        
-        
-        onOffState = device.states['onOffState']
-       
-        if changed:
-            if changedUnifi:
-                if onUnifi:
-                    onOffState = True
-                    changeCause = u"#1 Se ha conectado a la WIFI"
-                else:
-                    onOffState = False
-                    changeCause = u"#2 Se ha desconectado de la WIFI. Sin actividad durante " + str(int(minutesLastSeen)) + " min."
-            elif onOffState:
-                if changedGeo2 and not onGeo2:
-                    onOffState = False
-                    changeCause = u"#3 Ha salido de Plana Novella"
-                if changedGeo3 and not onGeo3:
-                    onOffState = False
-                    changeCause = u"#4 Ha salido del Parque Natural"                 
-            elif changedGeo1 and onGeo1 and not onUnifi and minutesLastSeen > 20:
-                onOffState = True 
-                changeCause = u"#5 Entra en CanTeula. No estaba conectado a la WIFI desde hace " + str(int(minutesLastSeen)) + " min."
-            elif changedGeo1 and not onGeo1:
-                #onOffState = False
-                changeCause = u"#6 Sale de CanTeula." 
-                
+        # everything is read from the local snapshots, missing sources count
+        # as off. Source states are sampled into the timeline on the
+        # monotonic clock, time rules use the dwell times kept there.
+        clockNow     = monotonic()
+        wallNow      = time.time()
+        timeline     = presence.timeline
+        onMask       = 0
+        wasOnMask    = presence.onMask
+        groupsOn     = 0
+        # the source currently backing the presence: the first one that is
+        # on, in group order
+        activeSource = u''
+        firstSeen    = 0
+        lastSeen     = 0
+        for slot, (sourceId, source, group) in enumerate(presence.sources):
+            snapshot = sourceCache.get(sourceId, None)
+            if snapshot is None:
+                continue
+            if timeline.slotChanged[slot] is None:
+                # first sight: the history starts at the source's own last change
+                timeline.seed(slot, clockNow - wallAge(snapshot.lastChanged, wallNow))
+            if snapshot.onOffState:
+                if not onMask:
+                    activeSource = snapshot.name
+                onMask   |= 1 << slot
+                groupsOn |= 1 << group
+            if source == 'unifi' and snapshot.lastSeen > lastSeen:
+                firstSeen = snapshot.firstSeen
+                lastSeen  = snapshot.lastSeen
+        timeline.record(clockNow, onMask)
+
+        if presence.debounce > 0:
+            # changes count once they have held for the debounce window
+            onMask, matures = timeline.debounce(wasOnMask, presence.debounce, clockNow)
+            if matures is not None:
+                self.scheduleAnalyze(presence, matures - clockNow, coalesce=True)
+            groupsOn = timeline.groupBits(onMask)
+            activeSource = u''
+            if onMask:
+                snapshot = sourceCache.get(presence.sources[(onMask & -onMask).bit_length() - 1][0], None)
+                if snapshot is not None:
+                    activeSource = snapshot.name
+
+        # changes by XOR, the rules see them per group
+        changedMask = onMask ^ wasOnMask
+        if changedMask:
+            groupsChanged = groupsOn ^ timeline.groupBits(wasOnMask)
         else:
-            if not onOffState and onUnifi and minutesLastSeen < 3:
-                onOffState = True
-                changeCause = u"#7 Estaba OUT. Pero, ya estaba conectado a la WIFI"
-            elif onOffState and not onUnifi and onGeo1 and minutesOnGeo1 < 3:
-                onOffState = True
-                changeCause = u"#11 Estaba IN. Seguirá IN aunque no conectado a WIFI, pero si dentro perimetro CanTeula"
-                pass
-            elif onOffState and minutesLastSeen > 15:
-                onOffState = False
-                changeCause = u"#8 Estaba IN. Pero, sin actividad desde hace " + str(int(minutesLastSeen)) + " min."
-            elif onOffState and not onUnifi and not onGeo1:
-                onOffState = False
-                changeCause = u"#9 Estaba IN. No estaba conectado en WIFI. No estaba en Canteula." 
-            elif onOffState and not onUnifi and not onGeo2 and not onGeo3:
-                onOffState = False
-                changeCause = u"#10 Estaba IN. No estaba conectado en WIFI. No estaba en Plana Novella ni Parque Natural." 
-                    
-        if not onOffState == device.states['onOffState']:
+            groupsChanged = 0
+        # the sources and transitions matter after a restart; a renewed
+        # lastSeen or rule only makes the snapshot stale, the Unifi devices
+        # still have the first and the next analysis finds the second again
+        persist = changedMask
+        stale   = not lastSeen == presence.lastSeen
+        presence.onMask    = onMask
+        presence.firstSeen = firstSeen
+        presence.lastSeen  = lastSeen
+
+        # lastSeen comes from the Unifi plugin as a wall clock time
+        minutesLastSeen = (int(wallNow) - lastSeen) / 60
+
+        # minutes every group has been in its current state
+        values = {'minutesLastSeen': minutesLastSeen}
+        for key, changed in zip(GROUP_MINUTES, timeline.groupChanged):
+            values[key] = int(clockNow - changed) / 60 if changed is not None else 0
+        minutesOnGeo1 = values['minutesOnGeo1'] = values['minutesGeo1']
+        
+        onOffState = presence.states.get('onOffState', False)
+        wasOn      = onOffState
+
+        # bit order follows rules.INPUTS
+        index = onOffState | groupsOn << 1 | groupsChanged << (1 + len(GROUPS))
+        started = time.time()
+        rule = presence.ruleSet.evaluate(index, values)
+        self.latencyStats['rules'].record(time.time() - started, started)
+        # the rule of this evaluation, none when nothing matched
+        ruleId = rule.id if rule is not None else None
+        if not ruleId == presence.lastRuleId:
+            presence.lastRuleId = ruleId
+            stale = True
+        if rule is not None and rule.then is not None:
+            onOffState = rule.then
+        presence.trace.append((started, 'analyze', index, minutesLastSeen, minutesOnGeo1, ruleId, onOffState))
+
+        if changedMask or not onOffState == wasOn:
+            presence.lastTransition = time.time()
+            persist = True
+        if presence.adaptiveStatus:
+            # an approaching threshold may pull the next status request in
+            statusInterval = self.nextStatusInterval(presence)
+            if statusInterval > 0:
+                self.scheduleStatus(presence, statusInterval, coalesce=True)
+
+        decided = time.time()
+        if presence.triggerTime is not None:
+            presence.lastDecisionLatency = decided - presence.triggerTime
+            presence.triggerTime = None
+            self.latencyStats['decision'].record(presence.lastDecisionLatency, decided)
+
+        newStates = [
+            ('onOffState',   onOffState),
+            ('lastRuleId',   presence.lastRuleId or u''),
+            ('activeSource', activeSource),
+        ]
+        if not onOffState == wasOn:
+            # the cause is only formatted when it is logged
+            values.update(self.groupNames(presence))
+            changeCause = rule.describe(values)
             if onOffState:
                 indigo.server.log (u'"' + device.name + u'" is IN  (' + changeCause + ')')        
             else:
                 indigo.server.log (u'"' + device.name + u'" is OUT  (' + changeCause + ')') 
-            device.updateStateOnServer(key='onOffState', value=onOffState)            
+            # the instrumentation states ride along with the transition; the
+            # minutes since last seen are those the rules saw then, the Unifi
+            # devices keep their own lastSeen current
+            newStates.extend([
+                ('lastChangeRule',      rule.id),
+                ('lastChangeCause',     changeCause),
+                ('since',               datetime.datetime.fromtimestamp(decided).strftime('%Y-%m-%d %H:%M:%S')),
+                ('lastDecisionLatency', round(presence.lastDecisionLatency, 3)),
+                ('lastRequestRtt',      round(presence.lastRequestRtt, 3)),
+            ])
+            if lastSeen > 0:
+                newStates.append(('minutesLastSeenAtChange', minutesLastSeen))
+
+        if persist:
+            self.runtimeSnapshot.touch(presence.id)
+        elif stale:
+            self.runtimeSnapshot.touch(presence.id, stale=True)
+
+        # one write per evaluation, carrying only what the server does not have yet
+        states = presence.states
+        changes = [{'key': key, 'value': value} for key, value in newStates if not states.get(key, None) == value]
+        if changes:
+            for change in changes:
+                states[change['key']] = change['value']
+            device.updateStatesOnServer(changes)
+            self.latencyStats['write'].record(time.time() - decided, decided)
+        
+    def groupNames(self, presence):
+        # the cause placeholders: per group the source that changed last
+        names = dict((key, u'') for key in GROUP_VALUES)
+        changedAt = {}
+        timeline = presence.timeline
+        for slot, (sourceId, source, group) in enumerate(presence.sources):
+            snapshot = self.sourceCache.get(sourceId, None)
+            changed = timeline.slotChanged[slot]
+            if snapshot is None or changed is None:
+                continue
+            if group not in changedAt or changed > changedAt[group]:
+                changedAt[group] = changed
+                names[GROUP_VALUES[group]] = snapshot.name
+        return names
         
     ###################################################################
     # Custom Action callbacks
@@ -380,7 +873,9 @@ class Plugin(indigo.PluginBase):
     def actionControlSensor(self, action, dev):
         if action.sensorAction == indigo.kSensorAction.RequestStatus:
             indigo.server.log ('sent "' + dev.name + '" status request')
-            self.deviceList[dev.id]['statusNextTime'] = datetime.datetime.now() - datetime.timedelta(seconds=10) 
+            if dev.id in self.deviceList:
+                self.scheduleStatus(self.deviceList[dev.id])
+                self.probeSoon(self.deviceList[dev.id])
             
     ########################################
     # Menu Methods
@@ -396,11 +891,52 @@ class Plugin(indigo.PluginBase):
         return
 
     def checkForUpdates(self):
-        update = self.updater.checkForUpdate() 
-        if (update != None):
-            pass
+        # the result is logged by the updater thread
+        if not self.updater.checkForUpdateInBackground():
+            indigo.server.log("An update check is already running")
         return    
 
     def updatePlugin(self):
         self.updater.update()
+
+    def showStatistics(self):
+        stats = self.requestPool.stats
+        indigo.server.log(u"Status requests: %d queued, %d throttled, %d sent, %d failed, %d timed out, %d pending" % (
+            stats['queued'], self.requestLimiter.throttled, stats['sent'], stats['failed'], stats['timedOut'], len(self.requestPool)))
+        stats = self.prober.stats
+        indigo.server.log(u"Ping hosts: %d probed, %d probes, %d answered, %d changes" % (
+            len(self.prober), stats['probes'], stats['answered'], stats['changes']))
+        indigo.server.log(self.deviceUpdatedStats.summary())
+        indigo.server.log(self.deviceDeletedStats.summary())
+
+    def showLatencyStatistics(self):
+        indigo.server.log(u"Latency by stage (last one to two hours):")
+        for stage in self.latencyStages:
+            indigo.server.log(self.latencyStats[stage].summary())
+        indigo.server.log(u"Last decision by device:")
+        for presence in sorted(self.deviceList.values(), key=lambda presence: presence.name.lower()):
+            indigo.server.log(u'"%s": rule %s, decision %.3f sec., request %.3f sec.' % (
+                presence.name, presence.lastRuleId or u'-', presence.lastDecisionLatency, presence.lastRequestRtt))
+
+    def menuGetDevsPresence(self, filter, valuesDict, typeId, elemId):
+        menuList = [(0, '(All)')]
+        for presence in sorted(self.deviceList.values(), key=lambda presence: presence.name.lower()):
+            menuList.append((presence.id, presence.name))
+        return menuList
+
+    def dumpTrace(self, valuesDict, typeId):
+        deviceId = int(valuesDict.get("presencedevice", 0))
+        for presence in sorted(self.deviceList.values(), key=lambda presence: presence.name.lower()):
+            if deviceId > 0 and not presence.id == deviceId:
+                continue
+            indigo.server.log(u'Trace of "%s" (%d entries):' % (presence.name, len(presence.trace)))
+            for entry in presence.trace:
+                indigo.server.log(u'    ' + describeTraceEntry(entry))
+            # the source changes behind it, as ages on the monotonic clock
+            clockNow = monotonic()
+            indigo.server.log(u'Source changes of "%s":' % presence.name)
+            for changed, mask in presence.timeline.samples():
+                on = [unicode(sourceId) for slot, (sourceId, source, group) in enumerate(presence.sources) if mask & (1 << slot)]
+                indigo.server.log(u'    %d sec. ago: %s' % (clockNow - changed, u', '.join(on) or u'all off'))
+        return True
                     
\ No newline at end of file
@@ -0,0 +1,221 @@
+#! /usr/bin/env python
+# -*- coding: utf-8 -*-
+#######################
+
+import datetime
+import time
+
+from clock import monotonic
+from rules import GROUPS, INPUTS
+from prober import parseTargets
+from timeline import SignalTimeline
+
+# where the sources of the rules.GROUPS groups are configured, in group
+# order: (group, source kind, pluginProps key). 'probe' sources are hosts
+# checked by the plugin's own ReachabilityProber, all others Indigo devices.
+SOURCE_FIELDS = (
+    ('Unifi', 'unifi',    'unifidevice'),
+    ('Geo1',  'geofence', 'geofencedevice1'),
+    ('Geo2',  'geofence', 'geofencedevice2'),
+    ('Geo3',  'geofence', 'geofencedevice3'),
+    ('Ping',  'ping',     'pingdevice'),
+    ('Ping',  'probe',    'pinghosts'),
+)
+
+################################################################################
+# runtime record of one presence device, compiled from its pluginProps when
+# the device starts or its configuration changes
+class PresenceRecord(object):
+
+    __slots__ = (
+        'id', 'ref',
+        # state values last seen on or written to the server
+        'states',
+        # (source device id or probe target, source kind, rules.GROUPS index)
+        # per source slot
+        'sources',
+        # status polling
+        'statusInterval', 'adaptiveStatus', 'statusNextTime', 'analyzeNextTime',
+        # pluginProps waiting to be applied on the concurrent thread
+        'pendingProps',
+        # presence rules
+        'rulesFile', 'ruleSet', 'lastRuleId',
+        # last seen signal values
+        'lastTransition', 'firstSeen', 'lastSeen',
+        # bit n is the onOffState of source slot n, as accepted after the
+        # debounce window (sec.); the samples behind it are in timeline
+        'onMask', 'debounce', 'timeline',
+        # instrumentation
+        'triggerTime', 'lastDecisionLatency', 'lastRequestRtt', 'trace',
+    )
+
+    #---------------------------------------------------------------------------
+    def __init__(self, device, lastTransition=0, trace=None):
+        self.id  = device.id
+        self.ref = device
+        self.states = dict(device.states)
+
+        self.onMask = 0
+        self.timeline = None
+        self.pendingProps = None
+        self.configure(device.pluginProps)
+        self.statusNextTime  = None
+        self.analyzeNextTime = None
+
+        self.ruleSet    = None
+        self.lastRuleId = None
+
+        self.lastTransition = lastTransition
+        self.firstSeen = 0
+        self.lastSeen  = 0
+
+        # set by the first source event or status request since the last
+        # analysis, cleared once the analyzer has decided
+        self.triggerTime         = None
+        self.lastDecisionLatency = 0.0
+        self.lastRequestRtt      = 0.0
+        # bounded deque of trace entries, see describeTraceEntry()
+        self.trace = trace
+
+    #---------------------------------------------------------------------------
+    # takes the settings from pluginProps, returns the names of the
+    # attributes that changed
+    def configure(self, props):
+        sources = []
+        for name, kind, key in SOURCE_FIELDS:
+            parse = parseTargets if kind == 'probe' else parseDeviceIds
+            for sourceId in parse(props.get(key, None)):
+                sources.append((sourceId, kind, GROUPS.index(name)))
+        settings = (
+            ('sources',        tuple(sources)),
+            ('statusInterval', int(props.get("statusInterval", 600))),
+            ('adaptiveStatus', bool(props.get("adaptiveStatus", False))),
+            ('debounce',       float(props.get("debounce", 0) or 0)),
+            ('rulesFile',      props.get("rulesFile", "").strip()),
+        )
+        oldSources = getattr(self, 'sources', ())
+        changed = []
+        for name, value in settings:
+            if not getattr(self, name, None) == value:
+                setattr(self, name, value)
+                changed.append(name)
+
+        if 'sources' in changed:
+            # sources that stay keep their signal, new ones start off
+            onMask = 0
+            for slot, source in enumerate(self.sources):
+                if source in oldSources and self.onMask & (1 << oldSources.index(source)):
+                    onMask |= 1 << slot
+            self.onMask = onMask
+
+            # ... and their history
+            timeline = SignalTimeline([source[2] for source in self.sources], len(GROUPS))
+            if self.timeline is not None:
+                for slot, source in enumerate(self.sources):
+                    if source in oldSources:
+                        timeline.slotChanged[slot] = self.timeline.slotChanged[oldSources.index(source)]
+                timeline.groupChanged = list(self.timeline.groupChanged)
+            timeline.resume(onMask)
+            self.timeline = timeline
+        return changed
+
+    #---------------------------------------------------------------------------
+    # what RuntimeSnapshot stores, the last seen signal values and schedule
+    def runtimeState(self):
+        slotChanged, groupChanged = self.timeline.wallTimes(monotonic(), time.time())
+        return {
+            'sources':        [list(source) for source in self.sources],
+            'on':             self.onMask,
+            'firstSeen':      self.firstSeen,
+            'lastSeen':       self.lastSeen,
+            'lastTransition': self.lastTransition,
+            'lastRuleId':     self.lastRuleId,
+            'statusNextTime': self.statusNextTime,
+            'changed':        slotChanged,
+            'groupChanged':   groupChanged,
+        }
+
+    #---------------------------------------------------------------------------
+    # takes back a runtimeState() entry, unless the sources were reconfigured
+    # in between. Returns whether it was used.
+    def restoreRuntimeState(self, entry):
+        try:
+            if entry['sources'] != [list(source) for source in self.sources]:
+                return False
+            self.onMask         = int(entry['on']) & ((1 << len(self.sources)) - 1)
+            self.firstSeen      = int(entry['firstSeen'])
+            self.lastSeen       = int(entry['lastSeen'])
+            self.lastTransition = float(entry['lastTransition'])
+            self.lastRuleId     = entry['lastRuleId']
+            self.statusNextTime = entry['statusNextTime']
+            self.timeline.resume(self.onMask)
+            # entries from before the timeline have no change times
+            self.timeline.restoreWallTimes(entry.get('changed', []), entry.get('groupChanged', []), monotonic(), time.time())
+        except (KeyError, TypeError, ValueError):
+            return False
+        return True
+
+    #---------------------------------------------------------------------------
+    @property
+    def name(self):
+        return self.ref.name
+
+################################################################################
+# device ids from a source field: a list field holds several ids as strings,
+# settings from before the fields became lists a single id. Unset (0) and
+# repeated ids are dropped.
+def parseDeviceIds(value):
+    if value is None:
+        return []
+    if isinstance(value, basestring):
+        value = value.split(',')
+    elif isinstance(value, (int, long)):
+        value = [value]
+    deviceIds = []
+    for item in value:
+        try:
+            deviceId = int(item)
+        except (TypeError, ValueError):
+            continue
+        if deviceId > 0 and deviceId not in deviceIds:
+            deviceIds.append(deviceId)
+    return deviceIds
+
+################################################################################
+# the few fields of a Unifi, beacon or ping device the analyzer needs, kept current
+# from deviceUpdated so an evaluation never has to ask the Indigo server
+class SourceSnapshot(object):
+
+    __slots__ = ('id', 'name', 'onOffState', 'firstSeen', 'lastSeen', 'lastChanged')
+
+    #---------------------------------------------------------------------------
+    def __init__(self, device):
+        self.id = device.id
+        self.update(device)
+
+    #---------------------------------------------------------------------------
+    def update(self, device):
+        states = device.states
+        self.name        = device.name
+        self.onOffState  = bool(states.get("onOffState", False))
+        self.firstSeen   = int(states.get("firstSeen", 0) or 0)
+        self.lastSeen    = int(states.get("lastSeen", 0) or 0)
+        self.lastChanged = device.lastChanged
+
+################################################################################
+# trace entries are plain tuples, cheap enough to record on every evaluation:
+#   (time, 'source',  source device id or probe target, source kind, onOffState)
+#   (time, 'status')
+#   (time, 'analyze', rules.INPUTS index, minutesLastSeen, minutesOnGeo1, rule id, onOffState)
+def describeTraceEntry(entry):
+    when = datetime.datetime.fromtimestamp(entry[0]).strftime('%Y-%m-%d %H:%M:%S')
+    kind = entry[1]
+    if kind == 'source':
+        return u"%s %s %s is %s" % (when, entry[3], entry[2], u'on' if entry[4] else u'off')
+    if kind == 'status':
+        return u"%s status request sent" % when
+    index, minutesLastSeen, minutesOnGeo1, ruleId, onOffState = entry[2:]
+    inputs = u" ".join(name for bit, name in enumerate(INPUTS[1:], 1) if index & (1 << bit))
+    return u"%s analyze %s [%s] lastSeen %d min., geo1 %d min.: rule %s -> %s" % (
+        when, u'IN' if index & 1 else u'OUT', inputs or u'-', minutesLastSeen, minutesOnGeo1,
+        ruleId or u'-', u'IN' if onOffState else u'OUT')
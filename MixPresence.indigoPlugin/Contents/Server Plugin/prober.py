@@ -0,0 +1,480 @@
+#! /usr/bin/env python
+# -*- coding: utf-8 -*-
+#######################
+
+import Queue
+import collections
+import datetime
+import errno
+import os
+import random
+import select
+import socket
+import struct
+import threading
+import time
+
+from scheduler import DeadlineScheduler
+
+# connect() results that mean the attempt is still under way
+CONNECTING = (errno.EINPROGRESS, errno.EALREADY, errno.EWOULDBLOCK)
+
+ICMP_ECHO_REPLY   = 0
+ICMP_ECHO_REQUEST = 8
+
+################################################################################
+# one host the prober checks. A target is written as "host" or "host:port":
+# a bare host is up when it answers anything, an echo or a TCP SYN or RST on
+# ReachabilityProber.defaultPort, a host:port only when that port accepts.
+# The fields the analyzer reads are those of presence.SourceSnapshot.
+class ProbeTarget(object):
+
+    __slots__ = (
+        'id', 'name', 'host', 'port',
+        'onOffState', 'firstSeen', 'lastSeen', 'lastChanged',
+        # (family, sockaddr) of the last resolution, None if it failed
+        'address', 'resolved', 'resolving',
+        # failed probes in a row, current probe interval (sec.)
+        'failures', 'interval', 'rtt',
+        # probe in flight: start time, TCP socket and echo sequence number
+        'started', 'tcp', 'echo',
+    )
+
+    #---------------------------------------------------------------------------
+    def __init__(self, targetId, onOffState=False):
+        self.id = targetId
+        self.host, self.port = parseTarget(targetId)
+        self.name = unicode(targetId)
+        self.onOffState = onOffState
+        self.firstSeen = 0
+        self.lastSeen = 0
+        self.lastChanged = datetime.datetime.now()
+        self.address = None
+        self.resolved = None
+        self.resolving = False
+        self.failures = 0
+        self.interval = 0
+        self.rtt = 0.0
+        self.started = None
+        self.tcp = None
+        self.echo = None
+
+################################################################################
+# checks the reachability of many hosts from a single thread: every probe is
+# a non-blocking TCP connect and, where the system allows unprivileged ICMP,
+# an echo request, all waited on by one select() call. Host names are
+# resolved on a thread of their own so a slow lookup never holds the others.
+class ReachabilityProber(object):
+
+    # a probe nobody answered within this many seconds failed
+    timeout         = 2.0
+    # probe intervals (sec.): right after a change, while confirming a
+    # suspected departure, and the cap they back off to while stable
+    minInterval     = 10
+    retryInterval   = 3
+    maxInterval     = 120
+    # failed probes in a row before an up target counts as down; phones
+    # drop the odd packet while their WIFI dozes
+    downAfter       = 3
+    # first probes are spread over this many seconds
+    startupSpread   = 5
+    resolveInterval = 300
+    # select() handles at most FD_SETSIZE descriptors
+    maxInFlight     = 256
+    # iOS lockdownd, listening on every iPhone; other phones answer with RST
+    defaultPort     = 62078
+
+    #---------------------------------------------------------------------------
+    def __init__(self, callback):
+        # callback(target) is called from the prober thread when a target
+        # goes up or down
+        self.callback = callback
+        self.icmpEnabled = True
+        # target id -> ProbeTarget
+        self.targets = {}
+        self.lock = threading.Lock()
+        self.schedule = DeadlineScheduler()
+        self.resolveQueue = Queue.Queue()
+        self.running = False
+        self.threads = []
+
+        # owned by the prober thread
+        self.icmp = None
+        self.ident = os.getpid() & 0xffff
+        self.token = os.urandom(8)
+        self.sequence = random.randint(0, 0xffff)
+        # socket -> target of the connects in flight
+        self.connecting = {}
+        # echo sequence number -> target
+        self.echoes = {}
+        # (deadline, target, started) of every probe, in start order
+        self.deadlines = collections.deque()
+        self.wakeRead, self.wakeWrite = socket.socketpair()
+        self.wakeRead.setblocking(0)
+        self.wakeWrite.setblocking(0)
+
+        self.stats = {'probes': 0, 'answered': 0, 'changes': 0}
+
+    #---------------------------------------------------------------------------
+    def configure(self, maxInterval, icmpEnabled):
+        self.maxInterval = max(float(maxInterval), self.minInterval)
+        self.icmpEnabled = bool(icmpEnabled)
+
+    #---------------------------------------------------------------------------
+    def start(self):
+        self.running = True
+        self.threads = [threading.Thread(target=self._run, name='ReachabilityProber'),
+                        threading.Thread(target=self._resolve, name='ReachabilityResolver')]
+        for thread in self.threads:
+            thread.daemon = True
+            thread.start()
+
+    #---------------------------------------------------------------------------
+    def stop(self):
+        self.running = False
+        self.resolveQueue.put(None)
+        self._wake()
+
+    #---------------------------------------------------------------------------
+    # starts probing targetId, or returns the target already probed. A
+    # restarted plugin passes the last known state as onOffState.
+    def add(self, targetId, onOffState=False):
+        with self.lock:
+            target = self.targets.get(targetId, None)
+            if target is None:
+                target = self.targets[targetId] = ProbeTarget(targetId, onOffState)
+                self.schedule.schedule(targetId, time.time() + random.random() * self.startupSpread)
+        self._wake()
+        return target
+
+    #---------------------------------------------------------------------------
+    def remove(self, targetId):
+        with self.lock:
+            self.targets.pop(targetId, None)
+            self.schedule.cancel(targetId)
+
+    #---------------------------------------------------------------------------
+    # moves the next probe of targetId forward to now
+    def probeSoon(self, targetId):
+        if targetId in self.targets:
+            self.schedule.schedule(targetId, time.time(), coalesce=True)
+            self._wake()
+
+    #---------------------------------------------------------------------------
+    def __contains__(self, targetId):
+        return targetId in self.targets
+
+    def __len__(self):
+        return len(self.targets)
+
+    #---------------------------------------------------------------------------
+    def _wake(self):
+        try:
+            self.wakeWrite.send('x')
+        except socket.error:
+            # the buffer is full, a wake up is pending anyway
+            pass
+
+    #---------------------------------------------------------------------------
+    def _run(self):
+        if self.icmpEnabled:
+            self.icmp = openIcmpSocket()
+        try:
+            while self.running:
+                now = time.time()
+                self._startDue(now)
+                self._expire(now)
+
+                timeout = self.schedule.maxWait
+                deadline = self.schedule.nextDeadline()
+                if deadline is not None:
+                    timeout = min(timeout, deadline - now)
+                if self.deadlines:
+                    timeout = min(timeout, self.deadlines[0][0] - now)
+                readers = [self.wakeRead]
+                if self.icmp is not None:
+                    readers.append(self.icmp)
+                try:
+                    readable, writable, failed = select.select(readers, self.connecting.keys(), [], max(timeout, 0))
+                except select.error, e:
+                    if e.args[0] == errno.EINTR:
+                        continue
+                    raise
+
+                now = time.time()
+                for sock in readable:
+                    if sock is self.wakeRead:
+                        self._drainWake()
+                    else:
+                        self._receiveEcho(now)
+                for sock in writable:
+                    self._connected(sock, now)
+        finally:
+            for sock in self.connecting.keys():
+                sock.close()
+            self.connecting = {}
+            if self.icmp is not None:
+                self.icmp.close()
+                self.icmp = None
+
+    #---------------------------------------------------------------------------
+    def _drainWake(self):
+        try:
+            while self.wakeRead.recv(512):
+                pass
+        except socket.error:
+            pass
+
+    #---------------------------------------------------------------------------
+    def _startDue(self, now):
+        for targetId in self.schedule.popDue(now):
+            target = self.targets.get(targetId, None)
+            if target is None or target.started is not None or target.resolving:
+                continue
+            if len(self.deadlines) >= self.maxInFlight:
+                # come back once some probes are done
+                self.schedule.schedule(targetId, now + self.timeout)
+                continue
+            # names are looked up again now and then, failed ones at the
+            # next probe after the failure was recorded
+            if (target.resolved is None or now - target.resolved > self.resolveInterval or
+                    target.address is None and now - target.resolved > self.timeout):
+                # scheduled again once the resolver is done
+                target.resolving = True
+                self.resolveQueue.put(target)
+                continue
+            if target.address is None:
+                self._record(target, False, now)
+                continue
+            self._startProbe(target, now)
+
+    #---------------------------------------------------------------------------
+    def _startProbe(self, target, now):
+        self.stats['probes'] += 1
+        target.started = now
+        family, sockaddr = target.address
+
+        if self.icmp is not None and family == socket.AF_INET and target.port is None:
+            self.sequence = (self.sequence + 1) & 0xffff
+            try:
+                self.icmp.sendto(echoRequest(self.ident, self.sequence, self.token), (sockaddr[0], 0))
+                target.echo = self.sequence
+                self.echoes[self.sequence] = target
+            except socket.error:
+                pass
+
+        sock = socket.socket(family, socket.SOCK_STREAM)
+        sock.setblocking(0)
+        error = sock.connect_ex(sockaddr)
+        if error in CONNECTING:
+            target.tcp = sock
+            self.connecting[sock] = target
+        else:
+            sock.close()
+            if self._answered(target, error):
+                self._finish(target, True, now)
+                return
+        if target.tcp is None and target.echo is None:
+            self._finish(target, False, now)
+            return
+        self.deadlines.append((now + self.timeout, target, now))
+
+    #---------------------------------------------------------------------------
+    # whether a finished connect shows the host is there
+    def _answered(self, target, error):
+        if error in (0, errno.EISCONN):
+            return True
+        return target.port is None and error == errno.ECONNREFUSED
+
+    #---------------------------------------------------------------------------
+    def _connected(self, sock, now):
+        target = self.connecting.pop(sock)
+        error = sock.getsockopt(socket.SOL_SOCKET, socket.SO_ERROR)
+        sock.close()
+        target.tcp = None
+        if self._answered(target, error):
+            self._finish(target, True, now)
+        elif target.echo is None:
+            self._finish(target, False, now)
+
+    #---------------------------------------------------------------------------
+    def _receiveEcho(self, now):
+        try:
+            packet, address = self.icmp.recvfrom(2048)
+        except socket.error:
+            return
+        sequence = parseEchoReply(packet, self.token)
+        target = self.echoes.pop(sequence, None)
+        if target is not None and target.echo == sequence:
+            target.echo = None
+            self._finish(target, True, now)
+
+    #---------------------------------------------------------------------------
+    def _expire(self, now):
+        while self.deadlines and self.deadlines[0][0] <= now:
+            deadline, target, started = self.deadlines.popleft()
+            if target.started == started:
+                self._finish(target, False, now)
+
+    #---------------------------------------------------------------------------
+    # ends the probe in flight for target
+    def _finish(self, target, reachable, now):
+        if target.tcp is not None:
+            self.connecting.pop(target.tcp, None)
+            target.tcp.close()
+            target.tcp = None
+        if target.echo is not None:
+            self.echoes.pop(target.echo, None)
+            target.echo = None
+        if reachable:
+            self.stats['answered'] += 1
+            target.rtt = now - target.started
+        target.started = None
+        self._record(target, reachable, now)
+
+    #---------------------------------------------------------------------------
+    # takes a probe result and plans the next probe: quick after a change or
+    # a first failure, backing off while nothing changes
+    def _record(self, target, reachable, now):
+        changed = False
+        if reachable:
+            target.failures = 0
+            target.lastSeen = int(now)
+            if not target.onOffState:
+                target.onOffState = True
+                target.firstSeen = int(now)
+                changed = True
+        else:
+            target.failures += 1
+            if target.onOffState and target.failures >= self.downAfter:
+                target.onOffState = False
+                changed = True
+
+        if changed:
+            target.interval = self.minInterval
+            delay = target.interval
+        elif target.onOffState and target.failures > 0:
+            # confirm a suspected departure, without backing off
+            delay = self.retryInterval
+        else:
+            target.interval = min(max(target.interval * 2, self.minInterval), self.maxInterval)
+            delay = target.interval
+
+        with self.lock:
+            if self.targets.get(target.id, None) is not target:
+                return
+            # +/- 10%, so targets added together drift apart
+            self.schedule.schedule(target.id, now + delay * random.uniform(0.9, 1.1))
+
+        if changed:
+            self.stats['changes'] += 1
+            target.lastChanged = datetime.datetime.fromtimestamp(now)
+            try:
+                self.callback(target)
+            except Exception:
+                pass
+
+    #---------------------------------------------------------------------------
+    def _resolve(self):
+        while True:
+            target = self.resolveQueue.get()
+            if target is None:
+                break
+            port = target.port or self.defaultPort
+            try:
+                family, socktype, proto, canonname, sockaddr = socket.getaddrinfo(target.host, port, 0, socket.SOCK_STREAM)[0]
+                target.address = (family, sockaddr)
+            except socket.error:
+                target.address = None
+            target.resolved = time.time()
+            target.resolving = False
+            with self.lock:
+                if self.targets.get(target.id, None) is target:
+                    self.schedule.schedule(target.id, time.time())
+            self._wake()
+
+################################################################################
+# "host", "host:port" or "[v6 address]:port" -> (host, port or None)
+def parseTarget(text):
+    text = text.strip().lower()
+    port = None
+    if text.startswith('['):
+        host, sep, rest = text[1:].partition(']')
+        if not sep:
+            raise ValueError('Invalid host "%s"' % text)
+        if rest:
+            if not rest.startswith(':'):
+                raise ValueError('Invalid host "%s"' % text)
+            port = rest[1:]
+    elif text.count(':') == 1:
+        host, port = text.split(':')
+    else:
+        host = text
+    if not host:
+        raise ValueError('Invalid host "%s"' % text)
+    if port is not None:
+        if not port.isdigit() or not 0 < int(port) < 65536:
+            raise ValueError('Invalid port in "%s"' % text)
+        port = int(port)
+    return host, port
+
+#-------------------------------------------------------------------------------
+# canonical target ids from a comma or space separated list of hosts,
+# invalid ones are dropped
+def parseTargets(value):
+    if not value:
+        return []
+    targetIds = []
+    for text in value.replace(',', ' ').split():
+        try:
+            host, port = parseTarget(text)
+        except ValueError:
+            continue
+        if ':' in host:
+            host = '[%s]' % host
+        targetId = host if port is None else '%s:%d' % (host, port)
+        if targetId not in targetIds:
+            targetIds.append(targetId)
+    return targetIds
+
+#-------------------------------------------------------------------------------
+# an ICMP socket, unprivileged where the system allows it; None if neither
+# kind may be opened
+def openIcmpSocket():
+    for kind in (socket.SOCK_DGRAM, socket.SOCK_RAW):
+        try:
+            sock = socket.socket(socket.AF_INET, kind, socket.IPPROTO_ICMP)
+        except socket.error:
+            continue
+        sock.setblocking(0)
+        return sock
+    return None
+
+#-------------------------------------------------------------------------------
+def echoRequest(ident, sequence, token):
+    header = struct.pack('!BBHHH', ICMP_ECHO_REQUEST, 0, 0, ident, sequence)
+    checksum = inetChecksum(header + token)
+    return struct.pack('!BBHHH', ICMP_ECHO_REQUEST, 0, checksum, ident, sequence) + token
+
+#-------------------------------------------------------------------------------
+# sequence number of an echo reply carrying token, or None. Raw sockets
+# hand over the IP header too, datagram ICMP sockets only on some systems.
+# The identifier is not checked, datagram sockets replace it.
+def parseEchoReply(packet, token):
+    if len(packet) >= 20 and ord(packet[0]) >> 4 == 4:
+        packet = packet[(ord(packet[0]) & 0x0f) * 4:]
+    if len(packet) < 8 + len(token):
+        return None
+    icmpType, code, checksum, ident, sequence = struct.unpack('!BBHHH', packet[:8])
+    if not icmpType == ICMP_ECHO_REPLY or not packet[8:8 + len(token)] == token:
+        return None
+    return sequence
+
+#-------------------------------------------------------------------------------
+def inetChecksum(data):
+    if len(data) % 2:
+        data += '\0'
+    total = sum(struct.unpack('!%dH' % (len(data) / 2), data))
+    total = (total >> 16) + (total & 0xffff)
+    total += total >> 16
+    return ~total & 0xffff
@@ -0,0 +1,138 @@
+#! /usr/bin/env python
+# -*- coding: utf-8 -*-
+#######################
+
+import json
+import operator
+
+# groups of presence sources. Each group feeds the rules an on<Group> input,
+# true while any of its sources is on, and a changed<Group> input, true when
+# that flipped since the last evaluation
+GROUPS = ('Unifi', 'Geo1', 'Geo2', 'Geo3', 'Ping')
+# cause placeholders naming the source that stands for a group
+GROUP_VALUES = tuple(group.lower() for group in GROUPS)
+
+# boolean inputs of a presence evaluation, one bit each in the table index
+INPUTS = (('onOffState',) + tuple('on' + group for group in GROUPS) +
+          tuple('changed' + group for group in GROUPS))
+BIT = dict((name, 1 << i) for i, name in enumerate(INPUTS))
+
+# inputs derived from the ones above, usable in rule conditions
+DERIVED = {
+    'changed': lambda inputs: any(inputs['changed' + group] for group in GROUPS),
+}
+
+# minutes a group has been in its current state, on or off
+GROUP_MINUTES = tuple('minutes' + group for group in GROUPS)
+
+# numeric values time predicates may test; minutesOnGeo1 is minutesGeo1
+# under the name older rules files use
+VALUES = ('minutesLastSeen', 'minutesOnGeo1') + GROUP_MINUTES
+
+OPERATORS = {
+    '<':  operator.lt,
+    '<=': operator.le,
+    '>':  operator.gt,
+    '>=': operator.ge,
+}
+
+################################################################################
+class RuleError(Exception):
+    pass
+
+################################################################################
+class Rule(object):
+
+    __slots__ = ('id', 'when', 'predicates', 'then', 'cause')
+
+    #---------------------------------------------------------------------------
+    def __init__(self, definition):
+        try:
+            self.id = unicode(definition['id'])
+            self.when = dict((str(name), bool(value)) for name, value in definition.get('when', {}).items())
+            self.predicates = tuple((str(name), OPERATORS[op], value) for name, op, value in definition.get('time', []))
+            self.then = definition.get('then', None)
+            self.cause = unicode(definition.get('cause', u''))
+        except (KeyError, TypeError, ValueError) as e:
+            raise RuleError('Invalid rule %s: %s' % (definition, e))
+
+        for name in self.when:
+            if name not in BIT and name not in DERIVED:
+                raise RuleError('Rule %s: unknown input "%s"' % (self.id, name))
+        for name, op, value in self.predicates:
+            if name not in VALUES:
+                raise RuleError('Rule %s: unknown value "%s"' % (self.id, name))
+        if self.then not in (True, False, None):
+            raise RuleError('Rule %s: "then" must be true, false or null' % self.id)
+
+    #---------------------------------------------------------------------------
+    def matches(self, inputs):
+        for name, value in self.when.iteritems():
+            if inputs[name] != value:
+                return False
+        return True
+
+    #---------------------------------------------------------------------------
+    def holds(self, values):
+        for name, op, value in self.predicates:
+            if not op(values[name], value):
+                return False
+        return True
+
+    #---------------------------------------------------------------------------
+    # the change cause shown in the log, formatted from the evaluation values
+    def describe(self, values):
+        try:
+            cause = self.cause % values
+        except (KeyError, TypeError, ValueError):
+            cause = self.cause
+        return u'%s %s' % (self.id, cause)
+
+################################################################################
+# an ordered rule set compiled into a decision table: for every combination
+# of the boolean inputs it lists the rules that can fire, in order, up to the
+# first one that needs no time predicate
+class RuleSet(object):
+
+    #---------------------------------------------------------------------------
+    def __init__(self, definitions):
+        self.rules = [Rule(definition) for definition in definitions]
+
+        self.table = []
+        for index in range(1 << len(INPUTS)):
+            inputs = dict((name, bool(index & bit)) for name, bit in BIT.iteritems())
+            for name, derive in DERIVED.iteritems():
+                inputs[name] = derive(inputs)
+
+            candidates = []
+            for rule in self.rules:
+                if rule.matches(inputs):
+                    candidates.append(rule)
+                    if not rule.predicates:
+                        break
+            self.table.append(tuple(candidates))
+
+        # inputs no rule looks at: flipping them never changes the candidates
+        self.unusedInputs = tuple(name for name in INPUTS if all(
+            self.table[index] == self.table[index | BIT[name]]
+            for index in range(len(self.table)) if not index & BIT[name]))
+
+    #---------------------------------------------------------------------------
+    # returns the rule that fires for the input bits, or None
+    def evaluate(self, index, values):
+        for rule in self.table[index]:
+            if not rule.predicates or rule.holds(values):
+                return rule
+        return None
+
+    #---------------------------------------------------------------------------
+    @classmethod
+    def load(cls, path):
+        try:
+            with open(path) as f:
+                definitions = json.load(f)
+        except (IOError, ValueError) as e:
+            raise RuleError('Unable to read rules from %s: %s' % (path, e))
+        if not isinstance(definitions, list):
+            raise RuleError('%s must contain a list of rules' % path)
+        return cls(definitions)
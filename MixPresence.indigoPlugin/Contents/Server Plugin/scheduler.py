@@ -0,0 +1,106 @@
+#! /usr/bin/env python
+# -*- coding: utf-8 -*-
+#######################
+
+import heapq
+import threading
+import time
+
+################################################################################
+class DeadlineScheduler(object):
+
+    # hard upper bound for a single wait, so a lost wake up can never park
+    # the concurrent thread for good
+    maxWait = 60.0
+
+    #---------------------------------------------------------------------------
+    def __init__(self):
+        # min-heap of (deadline, key); entries are invalidated lazily, the
+        # authoritative deadline for every key lives in self.deadlines
+        self.heap = []
+        self.deadlines = {}
+        self.lock = threading.Lock()
+        self.wakeup = threading.Event()
+
+    #---------------------------------------------------------------------------
+    # schedule (or reschedule) key at the given time.time() deadline
+    # with coalesce=True an already pending earlier deadline is kept, so a
+    # burst of requests collapses into a single run. Returns the deadline
+    # that is in effect for key afterwards.
+    def schedule(self, key, deadline, coalesce=False):
+        with self.lock:
+            pending = self.deadlines.get(key, None)
+            if coalesce and (pending is not None) and (pending <= deadline):
+                return pending
+            self.deadlines[key] = deadline
+            heapq.heappush(self.heap, (deadline, key))
+            earliest = (self.heap[0][1] == key and self.heap[0][0] == deadline)
+            self._compact()
+        if earliest:
+            self.wakeup.set()
+        return deadline
+
+    #---------------------------------------------------------------------------
+    # drop every pending deadline for key
+    def cancel(self, key):
+        with self.lock:
+            if key in self.deadlines:
+                del self.deadlines[key]
+                self._compact()
+
+    #---------------------------------------------------------------------------
+    # returns the pending deadline for key, or None
+    def deadline(self, key):
+        return self.deadlines.get(key, None)
+
+    #---------------------------------------------------------------------------
+    # pops and returns the keys that are due at 'now', in deadline order
+    def popDue(self, now):
+        due = []
+        with self.lock:
+            while self.heap and self.heap[0][0] <= now:
+                deadline, key = heapq.heappop(self.heap)
+                if self.deadlines.get(key, None) == deadline:
+                    del self.deadlines[key]
+                    due.append(key)
+        return due
+
+    #---------------------------------------------------------------------------
+    # returns the earliest live deadline, or None if nothing is scheduled
+    def nextDeadline(self):
+        with self.lock:
+            while self.heap:
+                deadline, key = self.heap[0]
+                if self.deadlines.get(key, None) == deadline:
+                    return deadline
+                heapq.heappop(self.heap)
+        return None
+
+    #---------------------------------------------------------------------------
+    # sleeps until the earliest deadline, or until a new earlier one is set
+    def wait(self):
+        # clear first, so a schedule() racing with us still cuts the wait short
+        self.wakeup.clear()
+        deadline = self.nextDeadline()
+        if deadline is None:
+            timeout = self.maxWait
+        else:
+            timeout = min(max(deadline - time.time(), 0.0), self.maxWait)
+        if timeout > 0:
+            self.wakeup.wait(timeout)
+
+    #---------------------------------------------------------------------------
+    # wakes a waiting thread immediately
+    def interrupt(self):
+        self.wakeup.set()
+
+    #---------------------------------------------------------------------------
+    # rebuild the heap once stale entries dominate it (lock must be held)
+    def _compact(self):
+        if len(self.heap) > 2 * len(self.deadlines) + 64:
+            self.heap = [(deadline, key) for key, deadline in self.deadlines.iteritems()]
+            heapq.heapify(self.heap)
+
+    #---------------------------------------------------------------------------
+    def __len__(self):
+        return len(self.deadlines)
@@ -0,0 +1,135 @@
+#! /usr/bin/env python
+# -*- coding: utf-8 -*-
+#######################
+
+import json
+import os
+import threading
+import time
+
+################################################################################
+# on-disk copy of the runtime state of every presence device, so a restarted
+# plugin carries on from the last known source values instead of seeing every
+# source that is on as a fresh change
+class RuntimeSnapshot(object):
+
+    version = 1
+
+    # entries that are only stale wait at most this long (sec.) for a write
+    staleInterval = 900
+
+    #---------------------------------------------------------------------------
+    def __init__(self, path):
+        self.path = path
+        # presence device id -> entry as written to disk
+        self.entries = {}
+        # ids whose entry must be refreshed before the next save
+        self.dirty = set()
+        # ids whose entry is out of date in ways a restart easily survives,
+        # such as a renewed lastSeen; they ride along with the next write
+        self.stale = set()
+        self.changed = False
+        # time.time() of the last write
+        self.written = 0
+        # devices are touched and removed from Indigo callbacks while the
+        # concurrent thread saves
+        self.lock = threading.Lock()
+
+    #---------------------------------------------------------------------------
+    # reads the snapshot file, a missing or broken file leaves it empty
+    def load(self):
+        self.entries = {}
+        try:
+            with open(self.path) as f:
+                data = json.load(f)
+        except (IOError, ValueError):
+            return False
+        if not isinstance(data, dict) or data.get('version', None) != self.version:
+            return False
+        for deviceId, entry in data.get('devices', {}).items():
+            self.entries[int(deviceId)] = entry
+        return True
+
+    #---------------------------------------------------------------------------
+    def get(self, deviceId):
+        return self.entries.get(deviceId, None)
+
+    #---------------------------------------------------------------------------
+    def touch(self, deviceId, stale=False):
+        with self.lock:
+            if stale:
+                self.stale.add(deviceId)
+            else:
+                self.dirty.add(deviceId)
+
+    #---------------------------------------------------------------------------
+    def remove(self, deviceId):
+        with self.lock:
+            self.dirty.discard(deviceId)
+            self.stale.discard(deviceId)
+            if self.entries.pop(deviceId, None) is not None:
+                self.changed = True
+
+    #---------------------------------------------------------------------------
+    # takes the current state of a record right away, for records about to
+    # be dropped and rebuilt
+    def store(self, record):
+        with self.lock:
+            self.dirty.discard(record.id)
+            self.stale.discard(record.id)
+            self.entries[record.id] = record.runtimeState()
+            self.changed = True
+
+    #---------------------------------------------------------------------------
+    # refreshes the dirty and stale entries from records (id ->
+    # PresenceRecord) and replaces the file atomically. Stale entries alone
+    # are written once staleInterval has passed and without waiting for the
+    # disk, flush=True writes them right away. Returns False when there was
+    # nothing to do. Touches during the write are kept for the next save; if
+    # the write fails, the ids saved here are marked again and the error raised.
+    def save(self, records, flush=False):
+        now = time.time()
+        with self.lock:
+            durable = bool(self.dirty or self.changed)
+            if not durable and not (self.stale and (flush or now - self.written >= self.staleInterval)):
+                return False
+            saving, savingStale = self.dirty, self.stale
+            for deviceId in saving | savingStale:
+                record = records.get(deviceId, None)
+                if record is not None:
+                    self.entries[deviceId] = record.runtimeState()
+            self.dirty = set()
+            self.stale = set()
+            self.changed = False
+            entries = dict(self.entries)
+
+        try:
+            self.write(entries, sync=durable or flush)
+        except Exception:
+            with self.lock:
+                self.dirty |= saving
+                self.stale |= savingStale
+                self.changed = self.changed or durable
+            raise
+        self.written = now
+        return True
+
+    #---------------------------------------------------------------------------
+    # replaces the file with entries, sync=False leaves flushing to the system
+    def write(self, entries, sync=True):
+        # the C encoder does the whole document at once, json.dump() does not
+        data = json.dumps({'version': self.version, 'devices': entries}, separators=(',', ':'))
+        tmpPath = self.path + '.tmp'
+        try:
+            with open(tmpPath, 'w') as f:
+                f.write(data)
+                if sync:
+                    f.flush()
+                    os.fsync(f.fileno())
+            os.rename(tmpPath, self.path)
+        except Exception:
+            try:
+                os.remove(tmpPath)
+            except OSError:
+                pass
+            raise
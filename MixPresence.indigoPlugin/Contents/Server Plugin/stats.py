@@ -0,0 +1,94 @@
+#! /usr/bin/env python
+# -*- coding: utf-8 -*-
+#######################
+
+import bisect
+import time
+
+################################################################################
+# counters for one Indigo callback
+class CallbackCounter(object):
+
+    __slots__ = ('name', 'seen', 'accepted', 'rejected', 'elapsed')
+
+    #---------------------------------------------------------------------------
+    def __init__(self, name):
+        self.name     = name
+        self.seen     = 0
+        self.accepted = 0
+        self.rejected = 0
+        self.elapsed  = 0.0
+
+    #---------------------------------------------------------------------------
+    def summary(self):
+        # rejected events cost a set lookup or two and are not timed
+        if self.accepted > 0:
+            average = 1000000.0 * self.elapsed / self.accepted
+        else:
+            average = 0.0
+        return u"%s: %d seen, %d accepted, %d rejected, %.3f sec. total, %.1f usec. per accepted event" % (
+            self.name, self.seen, self.accepted, self.rejected, self.elapsed, average)
+
+# upper bounds (sec.) of the latency histogram buckets, the last bucket takes
+# everything slower
+LATENCY_BOUNDS = (0.001, 0.002, 0.005, 0.01, 0.02, 0.05, 0.1, 0.2, 0.5, 1.0, 2.0, 5.0, 10.0, 20.0, 60.0)
+
+################################################################################
+# rolling latency histogram of one processing stage, covering the last one
+# to two windows
+class LatencyHistogram(object):
+
+    __slots__ = ('name', 'window', 'current', 'previous', 'rotated', 'count', 'total', 'maximum')
+
+    #---------------------------------------------------------------------------
+    def __init__(self, name, window=3600):
+        self.name     = name
+        self.window   = window
+        self.current  = [0] * (len(LATENCY_BOUNDS) + 1)
+        self.previous = [0] * (len(LATENCY_BOUNDS) + 1)
+        self.rotated  = time.time()
+        # since start, not rolling
+        self.count    = 0
+        self.total    = 0.0
+        self.maximum  = 0.0
+
+    #---------------------------------------------------------------------------
+    def record(self, value, now):
+        if now - self.rotated >= self.window:
+            if now - self.rotated < 2 * self.window:
+                self.previous = self.current
+            else:
+                self.previous = [0] * (len(LATENCY_BOUNDS) + 1)
+            self.current = [0] * (len(LATENCY_BOUNDS) + 1)
+            self.rotated = now
+        self.current[bisect.bisect_left(LATENCY_BOUNDS, value)] += 1
+        self.count += 1
+        self.total += value
+        if value > self.maximum:
+            self.maximum = value
+
+    #---------------------------------------------------------------------------
+    # upper bound of the bucket holding the given fraction (never above the
+    # maximum seen), None when empty
+    def percentile(self, fraction):
+        buckets = [current + previous for current, previous in zip(self.current, self.previous)]
+        samples = sum(buckets)
+        if samples == 0:
+            return None
+        rank = fraction * samples
+        seen = 0
+        for index, count in enumerate(buckets):
+            seen += count
+            if count > 0 and seen >= rank:
+                break
+        if index < len(LATENCY_BOUNDS):
+            return min(LATENCY_BOUNDS[index], self.maximum)
+        return self.maximum
+
+    #---------------------------------------------------------------------------
+    def summary(self):
+        if self.count == 0:
+            return u"%-9s no samples" % self.name
+        return u"%-9s %7d samples, avg %.3f, p50 <= %.3f, p90 <= %.3f, p99 <= %.3f, max %.3f sec." % (
+            self.name, self.count, self.total / self.count, self.percentile(0.5), self.percentile(0.9),
+            self.percentile(0.99), self.maximum)
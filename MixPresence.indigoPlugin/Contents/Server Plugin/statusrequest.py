@@ -0,0 +1,284 @@
+#! /usr/bin/env python
+# -*- coding: utf-8 -*-
+#######################
+
+import Queue
+import threading
+import time
+
+################################################################################
+class StatusRequestPool(object):
+
+    #---------------------------------------------------------------------------
+    def __init__(self, workers=4, timeout=10.0):
+        self.queue = Queue.Queue()
+        self.lock = threading.Lock()
+        self.idle = threading.Condition(self.lock)
+        self.threads = []
+        self.workers = 0
+        self.timeout = float(timeout)
+        self.running = False
+
+        # key -> (ticket, start time) of the request that is queued or running
+        self.pending = {}
+        self.ticket = 0
+        # requests taken by a worker whose callback has not returned yet
+        self.busy = 0
+        # worker thread -> (key, ticket, callback, start time) of its request
+        self.active = {}
+        # workers given up on after a timeout, they exit once func() returns
+        self.lost = set()
+
+        self.stats = {'queued': 0, 'sent': 0, 'failed': 0, 'timedOut': 0}
+
+        self.configure(workers, timeout)
+
+    #---------------------------------------------------------------------------
+    # adjust the concurrency limit and the per-request timeout
+    def configure(self, workers, timeout):
+        self.timeout = float(timeout)
+        workers = max(int(workers), 1)
+        with self.lock:
+            retire = self.workers - workers
+            self.workers = workers
+        if self.running:
+            for i in range(retire):
+                self.queue.put(None)
+            self._spawn()
+
+    #---------------------------------------------------------------------------
+    def start(self):
+        self.running = True
+        self._spawn()
+
+    #---------------------------------------------------------------------------
+    def stop(self):
+        self.running = False
+        with self.lock:
+            count = len(self.threads)
+        for i in range(count):
+            self.queue.put(None)
+
+    #---------------------------------------------------------------------------
+    # queue func() for key; callback(key, error, elapsed) is called from the
+    # worker thread once it returns, or from reap() if it runs too long.
+    # Returns False if a request for key is still pending and has not yet
+    # timed out.
+    def submit(self, key, func, callback):
+        now = time.time()
+        self.reap(now)
+        with self.lock:
+            if key in self.pending:
+                ticket, started = self.pending[key]
+                if now - started < self.timeout:
+                    return False
+            self.ticket += 1
+            ticket = self.ticket
+            self.pending[key] = (ticket, now)
+            self.stats['queued'] += 1
+        self.queue.put((key, ticket, func, callback))
+        return True
+
+    #---------------------------------------------------------------------------
+    # blocks until no request is queued or running; returns False on timeout
+    def drain(self, timeout=None):
+        if timeout is not None:
+            deadline = time.time() + timeout
+        while True:
+            self.reap()
+            with self.idle:
+                if not self.pending and not self.busy:
+                    return True
+                wait = self.timeout
+                if timeout is not None:
+                    remaining = deadline - time.time()
+                    if remaining <= 0:
+                        return False
+                    wait = min(wait, remaining)
+                self.idle.wait(wait)
+
+    #---------------------------------------------------------------------------
+    # gives up on requests running past their timeout: their callback gets a
+    # timeout error right away and a new worker takes the slot, the stuck
+    # one exits once func() returns. Returns the number of workers replaced.
+    def reap(self, now=None):
+        if now is None:
+            now = time.time()
+        expired = []
+        reaped = 0
+        with self.idle:
+            for thread, (key, ticket, callback, started) in self.active.items():
+                if now - started < self.timeout:
+                    continue
+                del self.active[thread]
+                reaped += 1
+                self.lost.add(thread)
+                self.threads = [worker for worker in self.threads if worker is not thread]
+                self.busy -= 1
+                self.stats['timedOut'] += 1
+                current = self.pending.get(key, None)
+                if current is not None and current[0] == ticket:
+                    del self.pending[key]
+                    expired.append((key, callback, now - started))
+            if not reaped:
+                return 0
+            if not self.pending and not self.busy:
+                self.idle.notifyAll()
+        if self.running:
+            self._spawn()
+
+        for key, callback, elapsed in expired:
+            try:
+                callback(key, Exception('timed out after %.1f sec.' % elapsed), elapsed)
+            except Exception:
+                pass
+        return reaped
+
+    #---------------------------------------------------------------------------
+    # time.time() at which reap() gives up on the oldest running request, None
+    # when nothing is pending. Queued requests start their clock once a
+    # worker takes them, a full timeout from now is the earliest they expire.
+    def nextTimeout(self):
+        with self.lock:
+            if self.active:
+                return min(started for key, ticket, callback, started in self.active.values()) + self.timeout
+            if self.pending:
+                return time.time() + self.timeout
+        return None
+
+    #---------------------------------------------------------------------------
+    # number of requests that are queued or running
+    def __len__(self):
+        return len(self.pending)
+
+    #---------------------------------------------------------------------------
+    def _spawn(self):
+        with self.lock:
+            self.threads = [thread for thread in self.threads if thread.isAlive()]
+            missing = self.workers - len(self.threads)
+            for i in range(missing):
+                thread = threading.Thread(target=self._run, name='StatusRequestWorker')
+                thread.daemon = True
+                thread.start()
+                self.threads.append(thread)
+
+    #---------------------------------------------------------------------------
+    def _run(self):
+        current = threading.currentThread()
+        while True:
+            item = self.queue.get()
+            if item is None:
+                break
+            if not self._process(current, *item):
+                # timed out, a replacement runs in our place
+                return
+
+        with self.lock:
+            self.threads = [thread for thread in self.threads if thread is not current]
+
+    #---------------------------------------------------------------------------
+    # returns False when the request was reaped while func() ran
+    def _process(self, thread, key, ticket, func, callback):
+        started = time.time()
+        with self.lock:
+            self.busy += 1
+            self.active[thread] = (key, ticket, callback, started)
+            self.stats['sent'] += 1
+        error = None
+        try:
+            func()
+        except Exception as e:
+            error = e
+        elapsed = time.time() - started
+
+        with self.idle:
+            if thread in self.lost:
+                # counted and reported by reap() already
+                self.lost.discard(thread)
+                return False
+            del self.active[thread]
+            if elapsed > self.timeout:
+                self.stats['timedOut'] += 1
+            elif error is not None:
+                self.stats['failed'] += 1
+            current = self.pending.get(key, None)
+            if current is None or current[0] != ticket:
+                # a newer request replaced this one after it timed out
+                callback = None
+            else:
+                del self.pending[key]
+                if elapsed > self.timeout and error is None:
+                    error = Exception('timed out after %.1f sec.' % elapsed)
+
+        try:
+            if callback is not None:
+                callback(key, error, elapsed)
+        except Exception:
+            pass
+        finally:
+            with self.idle:
+                self.busy -= 1
+                if not self.pending and not self.busy:
+                    self.idle.notifyAll()
+        return True
+
+################################################################################
+class TokenBucket(object):
+
+    #---------------------------------------------------------------------------
+    def __init__(self, rate=1.0, burst=5):
+        self.lock = threading.Lock()
+        self.rate = float(rate)
+        self.burst = float(burst)
+        self.tokens = self.burst
+        self.last = time.time()
+
+        # key -> time.time() of a token already promised to key
+        self.reservations = {}
+        self.throttled = 0
+
+    #---------------------------------------------------------------------------
+    # adjust the sustained rate (tokens per second) and the burst size
+    def configure(self, rate, burst):
+        with self.lock:
+            self._refill(time.time())
+            self.rate = float(rate)
+            self.burst = float(burst)
+            self.tokens = min(self.tokens, self.burst)
+
+    #---------------------------------------------------------------------------
+    # takes a token for key. Returns 0 when it may go now, otherwise the
+    # number of seconds until the token reserved for key becomes valid.
+    # Reservations are kept, so asking again at that time returns 0.
+    def reserve(self, key, now):
+        with self.lock:
+            slot = self.reservations.pop(key, None)
+            if slot is not None:
+                if slot <= now:
+                    return 0.0
+                self.reservations[key] = slot
+                return slot - now
+
+            self._refill(now)
+            self.tokens -= 1
+            if self.tokens >= 0:
+                return 0.0
+
+            # borrow from the future: every throttled key gets its own slot
+            slot = now + (-self.tokens) / self.rate
+            self.reservations[key] = slot
+            self.throttled += 1
+            return slot - now
+
+    #---------------------------------------------------------------------------
+    # drops the reservation of key, its token goes back into the bucket
+    def cancel(self, key):
+        with self.lock:
+            if self.reservations.pop(key, None) is not None:
+                self._refill(time.time())
+                self.tokens = min(self.burst, self.tokens + 1)
+
+    #---------------------------------------------------------------------------
+    def _refill(self, now):
+        self.tokens = min(self.burst, self.tokens + (now - self.last) * self.rate)
+        self.last = now
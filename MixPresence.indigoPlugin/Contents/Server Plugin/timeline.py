@@ -0,0 +1,148 @@
+#! /usr/bin/env python
+# -*- coding: utf-8 -*-
+#######################
+
+import time
+
+################################################################################
+# source samples of one presence device on the monotonic clock (clock.py):
+# a ring of the last changes of the source mask (bit n = source slot n),
+# and for every slot and every rules.GROUPS group the time it last changed,
+# so dwell times are a subtraction however long the device has been running
+class SignalTimeline(object):
+
+    # changes kept in the ring
+    length = 32
+
+    __slots__ = ('slotGroups', 'times', 'masks', 'head', 'count', 'mask', 'slotChanged', 'groupChanged', 'groupMask')
+
+    #---------------------------------------------------------------------------
+    # slotGroups is the group of every source slot
+    def __init__(self, slotGroups, groupCount):
+        self.slotGroups = tuple(slotGroups)
+        self.times = [0.0] * self.length
+        self.masks = [0] * self.length
+        # next ring position to write, samples in the ring
+        self.head = 0
+        self.count = 0
+        # last recorded mask and its group bits, None before the first sample
+        self.mask = None
+        self.groupMask = 0
+        # monotonic time of the last change, None while unknown
+        self.slotChanged = [None] * len(self.slotGroups)
+        self.groupChanged = [None] * groupCount
+
+    #---------------------------------------------------------------------------
+    # group bits of the groups with a slot of mask on
+    def groupBits(self, mask):
+        bits = 0
+        for slot, group in enumerate(self.slotGroups):
+            if mask & (1 << slot):
+                bits |= 1 << group
+        return bits
+
+    #---------------------------------------------------------------------------
+    # takes the mask seen at now; only a change is stored, and only the slots
+    # and groups that flipped get a new change time. The first sample has
+    # nothing to compare with and changes no times.
+    def record(self, now, mask):
+        if mask == self.mask:
+            return
+        groupMask = self.groupBits(mask)
+        if self.mask is not None:
+            self._stamp(self.slotChanged, mask ^ self.mask, now)
+            self._stamp(self.groupChanged, groupMask ^ self.groupMask, now)
+        self.mask = mask
+        self.groupMask = groupMask
+
+        self.times[self.head] = now
+        self.masks[self.head] = mask
+        self.head = (self.head + 1) % self.length
+        self.count = min(self.count + 1, self.length)
+
+    #---------------------------------------------------------------------------
+    # the times of the set bits of flipped become now
+    def _stamp(self, changed, flipped, now):
+        while flipped:
+            low = flipped & -flipped
+            changed[low.bit_length() - 1] = now
+            flipped ^= low
+
+    #---------------------------------------------------------------------------
+    # takes mask as the last recorded one without storing a sample, for
+    # masks restored or carried over from before
+    def resume(self, mask):
+        self.mask = mask
+        self.groupMask = self.groupBits(mask)
+
+    #---------------------------------------------------------------------------
+    # sets an unknown slot change time, from the source's own last change.
+    # Its group takes it when that is the later change.
+    def seed(self, slot, changed):
+        self.slotChanged[slot] = changed
+        group = self.slotGroups[slot]
+        if self.groupChanged[group] is None or changed > self.groupChanged[group]:
+            self.groupChanged[group] = changed
+
+    #---------------------------------------------------------------------------
+    # seconds a slot has been in its current state, None while unknown
+    def dwell(self, slot, now):
+        changed = self.slotChanged[slot]
+        if changed is None:
+            return None
+        return now - changed
+
+    #---------------------------------------------------------------------------
+    def groupDwell(self, group, now):
+        changed = self.groupChanged[group]
+        if changed is None:
+            return None
+        return now - changed
+
+    #---------------------------------------------------------------------------
+    # the last recorded mask as seen through a debounce window: starting
+    # from the accepted mask, every slot that differs takes its new value
+    # once it has held for window seconds; flapping back restarts the wait.
+    # Returns the mask and when the next held back change matures, or None.
+    def debounce(self, accepted, window, now):
+        mask = accepted
+        matures = None
+        pending = (self.mask or 0) ^ accepted
+        while pending:
+            low = pending & -pending
+            pending ^= low
+            changed = self.slotChanged[low.bit_length() - 1]
+            if changed is None or now - changed >= window:
+                mask ^= low
+            elif matures is None or changed + window < matures:
+                matures = changed + window
+        return mask, matures
+
+    #---------------------------------------------------------------------------
+    # (monotonic time, mask) of the stored changes, oldest first
+    def samples(self):
+        start = (self.head - self.count) % self.length
+        return [(self.times[(start + i) % self.length], self.masks[(start + i) % self.length])
+                for i in range(self.count)]
+
+    #---------------------------------------------------------------------------
+    # change times as wall clock times, to outlive the monotonic clock
+    def wallTimes(self, now, wallNow):
+        toWall = lambda changed: None if changed is None else wallNow - (now - changed)
+        return [toWall(changed) for changed in self.slotChanged], [toWall(changed) for changed in self.groupChanged]
+
+    #---------------------------------------------------------------------------
+    # takes back wallTimes(); a time in the future (the wall clock was set
+    # back meanwhile) counts as a change right now
+    def restoreWallTimes(self, slotTimes, groupTimes, now, wallNow):
+        toMonotonic = lambda wall: None if wall is None else now - max(wallNow - wall, 0.0)
+        if len(slotTimes) == len(self.slotChanged):
+            self.slotChanged = [toMonotonic(wall) for wall in slotTimes]
+        if len(groupTimes) == len(self.groupChanged):
+            self.groupChanged = [toMonotonic(wall) for wall in groupTimes]
+
+################################################################################
+# seconds since a naive local datetime such as an Indigo lastChanged, never
+# negative. Only good for seeding: local time is ambiguous around DST.
+def wallAge(moment, wallNow):
+    return max(wallNow - time.mktime(moment.timetuple()) - moment.microsecond * 1e-6, 0.0)
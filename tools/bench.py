@@ -0,0 +1,288 @@
+#! /usr/bin/env python
+# -*- coding: utf-8 -*-
+#######################
+#
+# Benchmarks MixPresence against the offline indigo stub and compares the
+# results with tools/bench_baseline.json.
+#
+#   python2 tools/bench.py                      # 10, 100 and 1000 devices
+#   python2 tools/bench.py --devices 10,100
+#   python2 tools/bench.py --update-baseline --repeat 5 --reason "why it changed"
+#
+# For every device count it measures:
+#
+#   idleCpu            CPU used by runConcurrentThread while nothing is due (%)
+#   analysesPerSec     deviceAnalyzeStatus calls per second
+#   latencyP50/P99     source onOffState change to presence state write (sec.)
+#   roundTripsPerEval  server round trips (lookups, writes, actions) per
+#                      evaluation while replaying synthetic commuter traffic
+#
+# Every scenario runs in a fresh interpreter; with --repeat the median of
+# the runs is used. The exit status is 1 when a metric regressed beyond the
+# tolerance. A change that makes the plugin slower on purpose updates the
+# baseline and states why; the reasons, and the measured spread behind any
+# slack in METRICS, are kept in the "history" list of the baseline file.
+
+import json
+import optparse
+import os
+import subprocess
+import sys
+import threading
+import time
+
+TOOLS_DIR = os.path.dirname(os.path.abspath(__file__))
+BASELINE  = os.path.join(TOOLS_DIR, 'bench_baseline.json')
+
+SCENARIOS = ('idle', 'throughput', 'latency', 'replay')
+
+# metric -> (higher is better, absolute slack). idleCpu counts 10 ms clock
+# ticks, 0.33% each over the idle window, and was seen anywhere from 0 to
+# two ticks; the others stay within the tolerance alone.
+METRICS = {
+    'idleCpu':           (False, 0.67),
+    'analysesPerSec':    (True,  0.0),
+    'latencyP50':        (False, 0.0),
+    'latencyP99':        (False, 0.0),
+    'roundTripsPerEval': (False, 0.0),
+}
+
+################################################################################
+# scenarios, each run in its own process
+
+#-------------------------------------------------------------------------------
+def startQuiet(replay):
+    replay.start()
+    # every device analyzed once, so the records know the current source states
+    for presence in replay.plugin.deviceList.values():
+        replay.plugin.deviceAnalyzeStatus(presence)
+    # ... and no status request due for the next hour
+    for presence in replay.plugin.deviceList.values():
+        replay.plugin.scheduleStatus(presence, 3600)
+
+#-------------------------------------------------------------------------------
+def runThread(replay):
+    thread = threading.Thread(target=replay.plugin.runConcurrentThread)
+    thread.daemon = True
+    thread.start()
+    return thread
+
+#-------------------------------------------------------------------------------
+def stopThread(replay, thread):
+    replay.plugin.stopConcurrentThread()
+    thread.join(5)
+
+#-------------------------------------------------------------------------------
+def scenarioIdle(devices, options):
+    import replay as replayModule
+    replay = replayModule.Replay(devices, virtualTime=False)
+    startQuiet(replay)
+
+    thread = runThread(replay)
+    time.sleep(0.2)
+    cpuStart = sum(os.times()[:2])
+    wallStart = time.time()
+    time.sleep(options.idleSeconds)
+    cpu = sum(os.times()[:2]) - cpuStart
+    wall = time.time() - wallStart
+    stopThread(replay, thread)
+
+    return {'idleCpu': 100.0 * cpu / wall}
+
+#-------------------------------------------------------------------------------
+def scenarioThroughput(devices, options):
+    import replay as replayModule
+    import indigo
+    replay = replayModule.Replay(devices)
+    replay.start()
+
+    plugin = replay.plugin
+    records = plugin.deviceList.values()
+    # the first passes write the initial states of every device; what is
+    # measured is the steady state, once a pass writes nothing
+    for attempt in range(5):
+        writes = indigo.server.stats['stateWrites']
+        for presence in records:
+            plugin.deviceAnalyzeStatus(presence)
+        if indigo.server.stats['stateWrites'] == writes:
+            break
+    count = 0
+    started = time.clock()
+    while True:
+        for presence in records:
+            plugin.deviceAnalyzeStatus(presence)
+        count += len(records)
+        elapsed = time.clock() - started
+        if elapsed >= options.throughputSeconds:
+            break
+
+    return {'analysesPerSec': count / elapsed}
+
+#-------------------------------------------------------------------------------
+def scenarioLatency(devices, options):
+    import replay as replayModule
+    import indigo
+    replay = replayModule.Replay(devices, virtualTime=False)
+    startQuiet(replay)
+    thread = runThread(replay)
+
+    samples = min(devices, options.latencySamples)
+    latencies = []
+    for state in (False, True):
+        flipped = {}
+        for person in range(samples):
+            flipped[replayModule.PRESENCE_BASE + person] = time.time() - replay.startTime
+            indigo.devices.setStates(replayModule.UNIFI_BASE + person, onOffState=state, lastSeen=int(time.time()))
+            time.sleep(options.latencySpacing)
+
+        deadline = time.time() + 5
+        while time.time() < deadline:
+            done = [t for t, deviceId, value in replay.transitions if value == state and deviceId in flipped]
+            if len(done) >= samples:
+                break
+            time.sleep(0.05)
+
+        for t, deviceId, value in replay.transitions:
+            if value == state and deviceId in flipped:
+                latencies.append(t - flipped.pop(deviceId))
+        # anything left was never written
+        latencies.extend([float('inf')] * len(flipped))
+
+    stopThread(replay, thread)
+    latencies.sort()
+    return {
+        'latencyP50': percentile(latencies, 0.5),
+        'latencyP99': percentile(latencies, 0.99),
+    }
+
+#-------------------------------------------------------------------------------
+def scenarioReplay(devices, options):
+    import replay as replayModule
+    import indigo
+    events = replayModule.syntheticTrace(devices, 1)
+    replay = replayModule.Replay(devices)
+    replay.start()
+    indigo.server.resetStats()
+    replay.analyses = 0
+    replay.run(events, until=options.replayHours * 3600)
+
+    stats = indigo.server.stats
+    roundTrips = stats['deviceLookups'] + stats['deviceIterations'] + stats['stateWrites'] + stats['actions']
+    return {'roundTripsPerEval': float(roundTrips) / max(replay.analyses, 1)}
+
+#-------------------------------------------------------------------------------
+def percentile(values, fraction):
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    return ordered[min(int(fraction * len(ordered)), len(ordered) - 1)]
+
+################################################################################
+def runScenario(name, devices, options):
+    command = [sys.executable, os.path.abspath(__file__), '--scenario', name, '--devices', str(devices),
+               '--idle-seconds', str(options.idleSeconds), '--throughput-seconds', str(options.throughputSeconds),
+               '--latency-samples', str(options.latencySamples), '--replay-hours', str(options.replayHours)]
+    process = subprocess.Popen(command, stdout=subprocess.PIPE)
+    out, err = process.communicate()
+    if process.returncode != 0:
+        raise Exception('scenario %s with %d devices failed' % (name, devices))
+    # the plugin may have logged before the result line
+    return json.loads(out.strip().splitlines()[-1])
+
+#-------------------------------------------------------------------------------
+def median(values):
+    ordered = sorted(values)
+    return ordered[len(ordered) // 2]
+
+#-------------------------------------------------------------------------------
+def compare(results, baseline, tolerance):
+    regressions = []
+    for devices, metrics in sorted(results.items(), key=lambda item: int(item[0])):
+        reference = baseline.get(devices, {})
+        for metric, value in sorted(metrics.items()):
+            if metric not in reference:
+                continue
+            higherIsBetter, slack = METRICS[metric]
+            expected = reference[metric]
+            if higherIsBetter:
+                failed = value < expected * (1.0 - tolerance) - slack
+            else:
+                failed = value > expected * (1.0 + tolerance) + slack
+            if failed:
+                regressions.append('%s devices: %s %.4g (baseline %.4g)' % (devices, metric, value, expected))
+    return regressions
+
+#-------------------------------------------------------------------------------
+def main():
+    parser = optparse.OptionParser(usage='%prog [options]')
+    parser.add_option('--devices', default='10,100,1000', help='comma separated device counts [%default]')
+    parser.add_option('--tolerance', type='float', default=0.2, help='allowed relative regression [%default]')
+    parser.add_option('--baseline', default=BASELINE, help='baseline file [%default]')
+    parser.add_option('--update-baseline', action='store_true', help='store the results as the new baseline')
+    parser.add_option('--reason', help='why the baseline changes, required with --update-baseline')
+    parser.add_option('--repeat', type='int', default=1, help='runs per device count, the median counts [%default]')
+    parser.add_option('--idle-seconds', dest='idleSeconds', type='float', default=3.0)
+    parser.add_option('--throughput-seconds', dest='throughputSeconds', type='float', default=1.0)
+    parser.add_option('--latency-samples', dest='latencySamples', type='int', default=100)
+    parser.add_option('--latency-spacing', dest='latencySpacing', type='float', default=0.005)
+    parser.add_option('--replay-hours', dest='replayHours', type='float', default=12.0)
+    parser.add_option('--scenario', choices=SCENARIOS, help=optparse.SUPPRESS_HELP)
+    options, args = parser.parse_args()
+
+    if options.scenario:
+        sys.path.insert(0, TOOLS_DIR)
+        devices = int(options.devices)
+        scenario = globals()['scenario' + options.scenario.capitalize()]
+        result = scenario(devices, options)
+        sys.stdout.write('\n' + json.dumps(result) + '\n')
+        sys.stdout.flush()
+        # worker threads of the plugin must not keep us alive
+        os._exit(0)
+
+    if options.update_baseline and not options.reason:
+        parser.error('--update-baseline needs a --reason')
+
+    results = {}
+    for devices in [int(count) for count in options.devices.split(',')]:
+        runs = []
+        for run in range(max(options.repeat, 1)):
+            metrics = {}
+            for name in SCENARIOS:
+                metrics.update(runScenario(name, devices, options))
+            runs.append(metrics)
+        metrics = dict((metric, median([run[metric] for run in runs])) for metric in runs[0])
+        results[str(devices)] = metrics
+        print '%5d devices: idle CPU %.2f%%, %.0f analyses/sec., latency p50 %.3f sec. p99 %.3f sec., %.3f round trips/evaluation' % (
+            devices, metrics['idleCpu'], metrics['analysesPerSec'], metrics['latencyP50'], metrics['latencyP99'],
+            metrics['roundTripsPerEval'])
+
+    if options.update_baseline:
+        baseline = {}
+        if os.path.exists(options.baseline):
+            with open(options.baseline) as f:
+                baseline = json.load(f)
+        baseline.update(results)
+        baseline.setdefault('history', []).append({
+            'date':    time.strftime('%Y-%m-%d'),
+            'devices': sorted(results, key=int),
+            'reason':  options.reason,
+        })
+        with open(options.baseline, 'w') as f:
+            json.dump(baseline, f, indent=4, sort_keys=True, separators=(',', ': '))
+            f.write('\n')
+        print 'Baseline written to %s' % options.baseline
+        return 0
+
+    if not os.path.exists(options.baseline):
+        print 'No baseline at %s, run with --update-baseline first' % options.baseline
+        return 0
+
+    with open(options.baseline) as f:
+        baseline = json.load(f)
+    regressions = compare(results, baseline, options.tolerance)
+    for regression in regressions:
+        print 'REGRESSION %s' % regression
+    return 1 if regressions else 0
+
+if __name__ == '__main__':
+    sys.exit(main())
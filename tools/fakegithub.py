@@ -0,0 +1,294 @@
+#! /usr/bin/env python
+# -*- coding: utf-8 -*-
+#######################
+#
+# Local stand-in for the parts of the GitHub API the plugin updater (ghpu.py)
+# talks to, so update checks can be exercised without the network.
+#
+#   python2 tools/fakegithub.py --port 8000 --version 9.9.9
+#   python2 tools/fakegithub.py --check
+#   python2 tools/httpcheck.py
+#
+# then set "api = http://127.0.0.1:8000" in the [repository] section of
+# ghpu.cfg. From Python, FakeGitHub(version='9.9.9').start() serves on a free
+# port on a background thread; its url attribute is the API base URL.
+# --check runs the plugin updater against such a server and reports what it
+# sent over how many connections; tools/httpcheck.py tests the HTTP client
+# of the updater against it.
+#
+# Served paths:
+#
+#   /repos/<owner>/<repo>/releases/latest   release metadata
+#   /rate_limit                             rate limit status
+#   /zipball/<tag>                          redirect to /codeload/<tag>
+#   /codeload/<tag>                         zip of the plugin in this tree,
+#                                           with a Digest: SHA-256 header
+#
+# Release metadata carries ETag, Last-Modified and X-RateLimit-* headers like
+# the real API: conditional requests that match get a 304 that does not count
+# against the rate limit, and an exhausted limit gets a 403.
+
+import BaseHTTPServer
+import SocketServer
+import base64
+import email.utils
+import hashlib
+import json
+import optparse
+import os
+import socket
+import sys
+import tempfile
+import threading
+import time
+import zipfile
+from StringIO import StringIO
+
+TOOLS_DIR  = os.path.dirname(os.path.abspath(__file__))
+REPO_DIR   = os.path.dirname(TOOLS_DIR)
+PLUGIN_DIR = 'MixPresence.indigoPlugin'
+
+################################################################################
+class FakeGitHub(object):
+
+    #---------------------------------------------------------------------------
+    def __init__(self, version='9.9.9', owner='tenallero', repo='Indigo-MixPresence', port=0):
+        self.version = version
+        self.owner = owner
+        self.repo = repo
+        self.rateLimit = 60
+        self.rateRemaining = 60
+        self.rateReset = int(time.time()) + 3600
+        # Cache-Control max-age of release metadata
+        self.maxAge = 60
+        self.published = time.time()
+        # seconds every response is held back, to play a slow network
+        self.delay = 0.0
+        # the next this many requests get a 503, to play a flaky backend
+        self.failures = 0
+        # (method, path) of every request served
+        self.requests = []
+        self.zipball = None
+
+        fake = self
+        class Handler(RequestHandler):
+            server_version = 'FakeGitHub/1.0'
+            github = fake
+        self.server = ThreadingHTTPServer(('127.0.0.1', port), Handler)
+        self.url = 'http://127.0.0.1:%d' % self.server.server_address[1]
+        self.thread = None
+
+    #---------------------------------------------------------------------------
+    def start(self):
+        self.thread = threading.Thread(target=self.server.serve_forever)
+        self.thread.daemon = True
+        self.thread.start()
+        return self
+
+    #---------------------------------------------------------------------------
+    def stop(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+    #---------------------------------------------------------------------------
+    @property
+    def tag(self):
+        return 'v' + self.version
+
+    #---------------------------------------------------------------------------
+    def release(self):
+        return {
+            'tag_name':    self.tag,
+            'name':        self.tag,
+            'html_url':    'https://github.com/%s/%s/releases/tag/%s' % (self.owner, self.repo, self.tag),
+            'zipball_url': '%s/zipball/%s' % (self.url, self.tag),
+        }
+
+    #---------------------------------------------------------------------------
+    def etag(self):
+        return '"%s"' % hashlib.sha1(json.dumps(self.release(), sort_keys=True)).hexdigest()
+
+    #---------------------------------------------------------------------------
+    def lastModified(self):
+        return email.utils.formatdate(self.published, usegmt=True)
+
+    #---------------------------------------------------------------------------
+    def rateHeaders(self):
+        return {
+            'X-RateLimit-Limit':     str(self.rateLimit),
+            'X-RateLimit-Remaining': str(self.rateRemaining),
+            'X-RateLimit-Reset':     str(self.rateReset),
+        }
+
+    #---------------------------------------------------------------------------
+    # the plugin folder of this tree, below the usual <owner>-<repo>-<sha>/
+    # top directory of a GitHub zipball
+    def buildZipball(self):
+        if self.zipball is None:
+            topdir = '%s-%s-%s/' % (self.owner, self.repo, self.tag)
+            data = StringIO()
+            archive = zipfile.ZipFile(data, 'w', zipfile.ZIP_DEFLATED)
+            archive.writestr(topdir, '')
+            for folder, dirs, files in os.walk(os.path.join(REPO_DIR, PLUGIN_DIR)):
+                for name in files:
+                    if name.endswith('.pyc'):
+                        continue
+                    path = os.path.join(folder, name)
+                    archive.write(path, topdir + os.path.relpath(path, REPO_DIR))
+            archive.writestr(topdir + 'README.md', 'fake release\n')
+            archive.close()
+            self.zipball = data.getvalue()
+        return self.zipball
+
+class ThreadingHTTPServer(SocketServer.ThreadingMixIn, BaseHTTPServer.HTTPServer):
+    daemon_threads = True
+
+    #---------------------------------------------------------------------------
+    # clients dropping their connection are no news to a test server
+    def handle_error(self, request, clientAddress):
+        if not isinstance(sys.exc_info()[1], socket.error):
+            BaseHTTPServer.HTTPServer.handle_error(self, request, clientAddress)
+
+################################################################################
+class RequestHandler(BaseHTTPServer.BaseHTTPRequestHandler):
+
+    # keep-alive, like the real API
+    protocol_version = 'HTTP/1.1'
+    github = None
+
+    #---------------------------------------------------------------------------
+    def do_GET(self):
+        github = self.github
+        github.requests.append(('GET', self.path))
+        if github.delay > 0:
+            time.sleep(github.delay)
+        if github.failures > 0:
+            github.failures -= 1
+            self.sendJson(503, {'message': 'Service Unavailable'})
+            return
+
+        path = self.path.split('?', 1)[0]
+        if path == '/repos/%s/%s/releases/latest' % (github.owner, github.repo):
+            self.sendRelease()
+        elif path == '/rate_limit':
+            self.sendJson(200, {'rate': {'limit': github.rateLimit, 'remaining': github.rateRemaining,
+                                         'reset': github.rateReset}})
+        elif path == '/zipball/' + github.tag:
+            self.send(302, '', None, {'Location': '%s/codeload/%s' % (github.url, github.tag)})
+        elif path == '/codeload/' + github.tag:
+            zipball = github.buildZipball()
+            digest = 'SHA-256=' + base64.b64encode(hashlib.sha256(zipball).digest())
+            self.send(200, zipball, 'application/zip', {'Digest': digest})
+        else:
+            self.sendJson(404, {'message': 'Not Found'})
+
+    #---------------------------------------------------------------------------
+    def sendRelease(self):
+        github = self.github
+        headers = {
+            'ETag':          github.etag(),
+            'Last-Modified': github.lastModified(),
+            'Cache-Control': 'public, max-age=%d' % github.maxAge,
+        }
+        # If-None-Match wins over If-Modified-Since, as in RFC 7232
+        if 'If-None-Match' in self.headers:
+            notModified = self.headers['If-None-Match'] == headers['ETag']
+        else:
+            notModified = self.headers.get('If-Modified-Since', None) == headers['Last-Modified']
+        if notModified:
+            headers.update(github.rateHeaders())
+            self.send(304, '', None, headers)
+            return
+        if github.rateRemaining <= 0:
+            headers = github.rateHeaders()
+            self.sendJson(403, {'message': 'API rate limit exceeded'}, headers)
+            return
+        github.rateRemaining -= 1
+        headers.update(github.rateHeaders())
+        self.sendJson(200, github.release(), headers)
+
+    #---------------------------------------------------------------------------
+    def sendJson(self, status, data, headers=None):
+        self.send(status, json.dumps(data), 'application/json; charset=utf-8', headers)
+
+    #---------------------------------------------------------------------------
+    def send(self, status, body, contentType, headers=None):
+        self.send_response(status)
+        if contentType is not None:
+            self.send_header('Content-Type', contentType)
+        if status != 304:
+            self.send_header('Content-Length', str(len(body)))
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+        if self.command != 'HEAD':
+            self.wfile.write(body)
+
+    #---------------------------------------------------------------------------
+    def log_message(self, format, *args):
+        pass
+
+################################################################################
+# exercises ghpu.GitHubPluginUpdater against a FakeGitHub, returns False if
+# something did not behave
+def check():
+    sys.path.insert(0, os.path.join(REPO_DIR, PLUGIN_DIR, 'Contents', 'Server Plugin'))
+    import ghpu
+
+    class Plugin(object):
+        pluginId = 'com.tenallero.indigoplugin.mixpresence'
+        pluginVersion = '0.0.1'
+        def debugLog(self, msg): pass
+        def errorLog(self, msg): print '  %s' % msg
+
+    github = FakeGitHub().start()
+    cacheFile = os.path.join(tempfile.mkdtemp(prefix='fakegithub-'), 'update.json')
+    updater = ghpu.GitHubPluginUpdater(Plugin(), os.path.join(REPO_DIR, PLUGIN_DIR, 'Contents', 'Server Plugin', 'ghpu.cfg'), cacheFile)
+    updater.api = github.url
+    installed = []
+    updater._installPlugin = installed.append
+    updater._log = lambda msg: None
+
+    results = []
+    def step(name, expected, value):
+        served = len(github.requests)
+        results.append(value == expected)
+        print '%-40s %s (%d requests so far, %d connections)' % (
+            name, 'ok' if value == expected else 'FAILED', served, updater.http.connectionsOpened)
+
+    step('first check finds the release', True, updater.checkForUpdate())
+    step('second check is served from cache', 1, updater.checkForUpdate() and len(github.requests))
+    updater.responses.values()[0]['expires'] = 0
+    remaining = github.rateRemaining
+    step('stale cache is revalidated', True, updater.checkForUpdate())
+    step('... with a free 304', remaining, github.rateRemaining)
+    step('update downloads and extracts', True, updater.update())
+    step('... the plugin folder', True, len(installed) == 1 and os.path.isdir(installed[0]))
+    step('connections were reused', 1, updater.http.connectionsOpened)
+    updater.http.close()
+    github.stop()
+    return all(results)
+
+################################################################################
+def main():
+    parser = optparse.OptionParser(usage='%prog [options]')
+    parser.add_option('--port', type='int', default=8000, help='port to listen on [%default]')
+    parser.add_option('--version', default='9.9.9', help='version of the latest release [%default]')
+    parser.add_option('--delay', type='float', default=0.0, help='seconds to hold every response [%default]')
+    parser.add_option('--check', action='store_true', help='run the plugin updater against a private server')
+    options, args = parser.parse_args()
+
+    if options.check:
+        return 0 if check() else 1
+
+    github = FakeGitHub(options.version, port=options.port)
+    github.delay = options.delay
+    print 'Serving release %s at %s' % (github.tag, github.url)
+    try:
+        github.server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,239 @@
+#! /usr/bin/env python
+# -*- coding: utf-8 -*-
+#######################
+#
+# Tests the HTTP client of the plugin updater (ghpu.HTTPClient) against a
+# FakeGitHub on a free local port: retries with backoff, timeouts, redirects
+# and keep-alive connection reuse. Also checks that the updater keeps the last
+# known release when GitHub goes away.
+#
+#   python2 tools/httpcheck.py
+#   python2 tools/httpcheck.py -v
+#
+# The exit status is 1 when a check fails.
+
+import os
+import shutil
+import socket
+import sys
+import tempfile
+import time
+import unittest
+
+TOOLS_DIR  = os.path.dirname(os.path.abspath(__file__))
+PLUGIN_DIR = os.path.join(os.path.dirname(TOOLS_DIR), 'MixPresence.indigoPlugin', 'Contents', 'Server Plugin')
+
+sys.path.insert(0, PLUGIN_DIR)
+sys.path.insert(0, TOOLS_DIR)
+
+import ghpu
+from fakegithub import FakeGitHub
+
+################################################################################
+class HTTPClientCheck(unittest.TestCase):
+
+    #---------------------------------------------------------------------------
+    def setUp(self):
+        self.github = FakeGitHub().start()
+        self.messages = []
+        self.latest = '%s/repos/%s/%s/releases/latest' % (self.github.url, self.github.owner, self.github.repo)
+
+    #---------------------------------------------------------------------------
+    def tearDown(self):
+        self.github.stop()
+
+    #---------------------------------------------------------------------------
+    def client(self, **kwargs):
+        client = ghpu.HTTPClient(**kwargs)
+        client.log = self.messages.append
+        self.addCleanup(client.close)
+        return client
+
+    #---------------------------------------------------------------------------
+    def paths(self):
+        return [path for method, path in self.github.requests]
+
+    #---------------------------------------------------------------------------
+    def testRetriesTransientErrorsWithBackoff(self):
+        client = self.client(retries=3, backoff=0.1)
+        self.github.failures = 2
+        started = time.time()
+        status, headers, body = client.fetch(self.latest)
+        elapsed = time.time() - started
+
+        self.assertEqual(status, 200)
+        self.assertEqual(len(self.github.requests), 3)
+        # 0.1 then 0.2 sec., doubling per attempt
+        retries = [message for message in self.messages if 'retrying' in message]
+        self.assertEqual(len(retries), 2)
+        self.assertTrue(retries[0].endswith('retrying in 0.1 sec.'), retries[0])
+        self.assertTrue(retries[1].endswith('retrying in 0.2 sec.'), retries[1])
+        self.assertTrue(elapsed >= 0.3, elapsed)
+        # the 503 bodies were read, so every attempt used the same connection
+        self.assertEqual(client.connectionsOpened, 1)
+
+    #---------------------------------------------------------------------------
+    def testGivesUpAfterTheLastRetry(self):
+        client = self.client(retries=2, backoff=0.01)
+        self.github.failures = 5
+        status, headers, body = client.fetch(self.latest)
+
+        self.assertEqual(status, 503)
+        self.assertEqual(len(self.github.requests), 3)
+
+    #---------------------------------------------------------------------------
+    def testTimesOut(self):
+        client = self.client(timeout=0.2, retries=1, backoff=0.01)
+        self.github.delay = 1.0
+        started = time.time()
+        self.assertRaises(socket.timeout, client.fetch, self.latest)
+        elapsed = time.time() - started
+
+        # two attempts of 0.2 sec., not two full responses
+        self.assertTrue(elapsed < 1.0, elapsed)
+        self.assertEqual(client.connectionsOpened, 2)
+
+    #---------------------------------------------------------------------------
+    def testFollowsRedirects(self):
+        client = self.client()
+        status, headers, body = client.fetch('%s/zipball/%s' % (self.github.url, self.github.tag))
+
+        self.assertEqual(status, 200)
+        self.assertEqual(self.paths(), ['/zipball/' + self.github.tag, '/codeload/' + self.github.tag])
+        self.assertEqual(body, self.github.buildZipball())
+        self.assertTrue(headers['digest'].startswith('SHA-256='))
+        self.assertEqual(client.connectionsOpened, 1)
+
+    #---------------------------------------------------------------------------
+    def testStopsAtTooManyRedirects(self):
+        client = self.client()
+        url = '%s/zipball/%s' % (self.github.url, self.github.tag)
+        self.assertRaises(ghpu.HTTPError, client.open, url, None, 0)
+
+    #---------------------------------------------------------------------------
+    def testReusesKeepAliveConnections(self):
+        client = self.client()
+        for i in range(5):
+            status, headers, body = client.fetch(self.latest)
+            self.assertEqual(status, 200)
+
+        self.assertEqual(len(self.github.requests), 5)
+        self.assertEqual(client.connectionsOpened, 1)
+
+    #---------------------------------------------------------------------------
+    def testReconnectsWhenTheServerDropsAnIdleConnection(self):
+        client = self.client(retries=0)
+        client.fetch(self.latest)
+        # the pooled connection goes away as if the server timed it out
+        for conn in client.idle.values():
+            conn.sock.shutdown(socket.SHUT_RDWR)
+        status, headers, body = client.fetch(self.latest)
+
+        self.assertEqual(status, 200)
+        self.assertEqual(client.connectionsOpened, 2)
+
+    #---------------------------------------------------------------------------
+    def testPartlyReadBodyIsNotReused(self):
+        client = self.client()
+        response = client.open('%s/codeload/%s' % (self.github.url, self.github.tag))
+        response.read(16)
+        response.close()
+        client.fetch(self.latest)
+
+        self.assertEqual(client.connectionsOpened, 2)
+
+################################################################################
+class UpdaterCheck(unittest.TestCase):
+
+    #---------------------------------------------------------------------------
+    class Plugin(object):
+        pluginVersion = '1.0.0'
+        def __init__(self): self.errors = []
+        def debugLog(self, msg): pass
+        def errorLog(self, msg): self.errors.append(msg)
+
+    #---------------------------------------------------------------------------
+    def setUp(self):
+        self.github = FakeGitHub().start()
+        self.githubUp = True
+        self.folder = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.folder)
+
+        configFile = os.path.join(self.folder, 'ghpu.cfg')
+        with open(configFile, 'w') as f:
+            f.write('[repository]\nowner = %s\nname = %s\napi = %s\n'
+                    % (self.github.owner, self.github.repo, self.github.url))
+        self.plugin = self.Plugin()
+        self.updater = ghpu.GitHubPluginUpdater(self.plugin, configFile, os.path.join(self.folder, 'update.json'))
+        self.updater.http.backoff = 0.01
+        self.updater._log = lambda msg: None
+        self.addCleanup(self.updater.http.close)
+
+    #---------------------------------------------------------------------------
+    def tearDown(self):
+        if self.githubUp:
+            self.github.stop()
+
+    #---------------------------------------------------------------------------
+    # GitHub goes away, with the pooled connection and the cached copy stale
+    def stopGitHub(self):
+        self.github.stop()
+        self.githubUp = False
+        self.updater.http.close()
+        for cached in self.updater.responses.values():
+            cached['expires'] = 0
+
+    #---------------------------------------------------------------------------
+    def testKeepsTheCachedUpdateWhenGitHubIsDown(self):
+        release = self.github.release()
+        self.assertTrue(self.updater.checkForUpdate())
+        checkedAt = self.updater.lastCheck['checkedAt']
+
+        self.stopGitHub()
+        self.assertTrue(self.updater.checkForUpdate())
+        self.assertEqual(self.updater.getCachedUpdate(), release['html_url'])
+        self.assertEqual(self.updater.lastCheck['checkedAt'], checkedAt)
+        self.assertTrue(self.updater.lastError != None)
+
+    #---------------------------------------------------------------------------
+    def testFailedCheckLeavesTheLastResultAlone(self):
+        release = self.github.release()
+        self.updater.checkForUpdate()
+        checkedAt = self.updater.lastCheck['checkedAt']
+
+        # without a cached response there is nothing to fall back to
+        self.stopGitHub()
+        self.updater.responses = { }
+        self.assertFalse(self.updater.checkForUpdate())
+        self.assertEqual(self.updater.getCachedUpdate(), release['html_url'])
+        self.assertEqual(self.updater.lastCheck['checkedAt'], checkedAt)
+        self.assertTrue(self.updater.checkDue(checkedAt + self.updater.checkInterval))
+        self.assertEqual(self.plugin.errors[-1], 'Update check failed, keeping the last result')
+
+        # and it survives a restart
+        restarted = ghpu.GitHubPluginUpdater(self.plugin, os.path.join(self.folder, 'ghpu.cfg'), self.updater.cacheFile)
+        self.assertEqual(restarted.getCachedUpdate(), release['html_url'])
+
+    #---------------------------------------------------------------------------
+    def testServerErrorsKeepTheCachedUpdate(self):
+        release = self.github.release()
+        self.updater.checkForUpdate()
+        for cached in self.updater.responses.values():
+            cached['expires'] = 0
+
+        self.github.failures = 10
+        self.assertTrue(self.updater.checkForUpdate())
+        self.assertEqual(self.updater.getCachedUpdate(), release['html_url'])
+        self.assertEqual(self.updater.lastError, 'HTTP 503')
+
+################################################################################
+def main():
+    verbosity = 2 if '-v' in sys.argv[1:] else 1
+    loader = unittest.TestLoader()
+    suite = unittest.TestSuite([loader.loadTestsFromTestCase(HTTPClientCheck),
+                                loader.loadTestsFromTestCase(UpdaterCheck)])
+    result = unittest.TextTestRunner(verbosity=verbosity).run(suite)
+    return 0 if result.wasSuccessful() else 1
+
+if __name__ == '__main__':
+    sys.exit(main())
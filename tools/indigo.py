@@ -0,0 +1,298 @@
+#! /usr/bin/env python
+# -*- coding: utf-8 -*-
+#######################
+#
+# Offline stand-in for the parts of the Indigo 'indigo' module MixPresence
+# uses, so plugin.py can be loaded and driven on any machine. Put this
+# directory first on sys.path, before importing plugin.
+#
+# Server round trips are counted in server.stats so tools can report them.
+
+import copy
+import datetime
+import threading
+import time
+
+################################################################################
+class Dict(dict):
+    pass
+
+class List(list):
+    pass
+
+class kSensorAction(object):
+    RequestStatus = 'RequestStatus'
+    TurnOn        = 'TurnOn'
+    TurnOff       = 'TurnOff'
+
+################################################################################
+class Device(object):
+
+    #---------------------------------------------------------------------------
+    def __init__(self, id, name, pluginId='', deviceTypeId='', pluginProps=None, states=None, enabled=True):
+        self.id = id
+        self.name = name
+        self.pluginId = pluginId
+        self.deviceTypeId = deviceTypeId
+        self.pluginProps = Dict(pluginProps or {})
+        self.states = Dict(states or {})
+        self.enabled = enabled
+        self.lastChanged = datetime.datetime.fromtimestamp(time.time())
+
+    #---------------------------------------------------------------------------
+    # the server hands out copies all the time; only the two dicts are
+    # mutable and state values are plain scalars, the generic deepcopy would
+    # cost most of a simulation
+    def __deepcopy__(self, memo):
+        device = Device.__new__(Device)
+        device.__dict__.update(self.__dict__)
+        device.pluginProps = Dict(copy.deepcopy(dict(self.pluginProps), memo))
+        device.states = Dict(self.states)
+        return device
+
+    #---------------------------------------------------------------------------
+    def updateStateOnServer(self, key, value, **kwargs):
+        self.updateStatesOnServer([{'key': key, 'value': value}])
+
+    #---------------------------------------------------------------------------
+    def updateStatesOnServer(self, keyValueList):
+        server.stats['stateWrites'] += 1
+        states = dict((item['key'], item['value']) for item in keyValueList)
+        self.states.update(states)
+        devices._update(self.id, states)
+
+    #---------------------------------------------------------------------------
+    def replacePluginPropsOnServer(self, pluginProps):
+        server.stats['propWrites'] += 1
+        devices._replaceProps(self.id, pluginProps)
+
+    #---------------------------------------------------------------------------
+    def stateListOrDisplayStateIdChanged(self):
+        pass
+
+    #---------------------------------------------------------------------------
+    def refreshFromServer(self):
+        current = devices[self.id]
+        self.__dict__.update(copy.deepcopy(current.__dict__))
+
+################################################################################
+class DeviceList(object):
+
+    #---------------------------------------------------------------------------
+    def __init__(self):
+        self.lock = threading.RLock()
+        self.db = {}
+        self.subscribers = []
+
+    #---------------------------------------------------------------------------
+    # every lookup hands out a copy, like the real server does
+    def __getitem__(self, id):
+        server.stats['deviceLookups'] += 1
+        with self.lock:
+            return copy.deepcopy(self.db[id])
+
+    def __contains__(self, id):
+        return id in self.db
+
+    def __len__(self):
+        return len(self.db)
+
+    def get(self, id, default=None):
+        try:
+            return self[id]
+        except KeyError:
+            return default
+
+    #---------------------------------------------------------------------------
+    # filter is "<pluginId>.<deviceTypeId>", "<pluginId>" or "self"
+    def iter(self, filter=''):
+        server.stats['deviceIterations'] += 1
+        with self.lock:
+            found = [copy.deepcopy(device) for device in self.db.values() if _matches(device, filter)]
+        return iter(found)
+
+    def itervalues(self):
+        return self.iter()
+
+    #---------------------------------------------------------------------------
+    def subscribeToChanges(self):
+        plugin = server.activePlugin
+        if plugin is not None and plugin not in self.subscribers:
+            self.subscribers.append(plugin)
+
+    #---------------------------------------------------------------------------
+    # stub API: add a device and tell subscribers about it
+    def add(self, device):
+        with self.lock:
+            self.db[device.id] = device
+        for plugin in self._listeners(device):
+            plugin.deviceCreated(copy.deepcopy(device))
+        return device
+
+    #---------------------------------------------------------------------------
+    # stub API: remove a device and tell subscribers about it
+    def remove(self, id):
+        with self.lock:
+            device = self.db.pop(id)
+        for plugin in self._listeners(device):
+            plugin.deviceDeleted(device)
+
+    #---------------------------------------------------------------------------
+    # stub API: change states the way another plugin would
+    def setStates(self, id, **states):
+        self._update(id, states)
+
+    #---------------------------------------------------------------------------
+    def _update(self, id, states):
+        with self.lock:
+            device = self.db[id]
+            origDev = copy.deepcopy(device)
+            changed = False
+            for key, value in states.items():
+                if device.states.get(key, None) != value:
+                    device.states[key] = value
+                    changed = True
+            if not changed:
+                return
+            device.lastChanged = datetime.datetime.fromtimestamp(time.time())
+            newDev = copy.deepcopy(device)
+        for plugin in self._listeners(device):
+            plugin.deviceUpdated(origDev, newDev)
+
+    #---------------------------------------------------------------------------
+    def _replaceProps(self, id, pluginProps):
+        with self.lock:
+            device = self.db[id]
+            origDev = copy.deepcopy(device)
+            device.pluginProps = Dict(pluginProps)
+            newDev = copy.deepcopy(device)
+        for plugin in self._listeners(device):
+            plugin.deviceUpdated(origDev, newDev)
+
+    #---------------------------------------------------------------------------
+    # subscribers see every device, the owning plugin always sees its own
+    def _listeners(self, device):
+        listeners = list(self.subscribers)
+        owner = server.plugins.get(device.pluginId, None)
+        if isinstance(owner, PluginBase) and owner not in listeners:
+            listeners.append(owner)
+        return listeners
+
+def _matches(device, filter):
+    if filter in ('', None):
+        return True
+    if filter == 'self':
+        return server.activePlugin is not None and device.pluginId == server.activePlugin.pluginId
+    return filter in (device.pluginId, device.pluginId + '.' + device.deviceTypeId)
+
+################################################################################
+# what indigo.server.getPlugin() returns for other plugins
+class PluginInfo(object):
+
+    #---------------------------------------------------------------------------
+    def __init__(self, pluginId, enabled=True):
+        self.pluginId = pluginId
+        self.enabled = enabled
+        # actionId -> callable(deviceId, props)
+        self.actions = {}
+
+    def isEnabled(self):
+        return self.enabled
+
+    def isRunning(self):
+        return self.enabled
+
+    #---------------------------------------------------------------------------
+    def executeAction(self, actionId, deviceId=0, props=None, waitUntilDone=True):
+        server.stats['actions'] += 1
+        handler = self.actions.get(actionId, None)
+        if handler is not None:
+            return handler(deviceId, props or {})
+
+################################################################################
+class Server(object):
+
+    #---------------------------------------------------------------------------
+    def __init__(self):
+        self.plugins = {}
+        self.activePlugin = None
+        self.installFolder = '/tmp/indigo'
+        self.echo = True
+        self.logEntries = []
+        self.stats = {}
+        self.resetStats()
+
+    #---------------------------------------------------------------------------
+    def resetStats(self):
+        for key in ('deviceLookups', 'deviceIterations', 'stateWrites', 'propWrites', 'actions', 'logs'):
+            self.stats[key] = 0
+
+    #---------------------------------------------------------------------------
+    def log(self, message, type=None, isError=False):
+        self.stats['logs'] += 1
+        entry = (type or 'Plugin', unicode(message))
+        self.logEntries.append(entry)
+        if self.echo:
+            print (u'%s\t%s' % entry).encode('utf-8')
+
+    #---------------------------------------------------------------------------
+    def getPlugin(self, pluginId):
+        if pluginId not in self.plugins:
+            self.plugins[pluginId] = PluginInfo(pluginId)
+        return self.plugins[pluginId]
+
+    def getInstallFolderPath(self):
+        return self.installFolder
+
+server = Server()
+devices = DeviceList()
+
+################################################################################
+class PluginBase(object):
+
+    class StopThread(Exception):
+        pass
+
+    #---------------------------------------------------------------------------
+    def __init__(self, pluginId, pluginDisplayName, pluginVersion, pluginPrefs):
+        self.pluginId = pluginId
+        self.pluginDisplayName = pluginDisplayName
+        self.pluginVersion = pluginVersion
+        self.pluginPrefs = Dict(pluginPrefs or {})
+        self.debug = False
+        self.stopThread = False
+        server.plugins[pluginId] = self
+        server.activePlugin = self
+
+    def __del__(self):
+        pass
+
+    #---------------------------------------------------------------------------
+    def debugLog(self, message):
+        if self.debug:
+            server.log(message, type=self.pluginDisplayName + ' Debug')
+
+    def errorLog(self, message):
+        server.log(message, type=self.pluginDisplayName + ' Error', isError=True)
+
+    #---------------------------------------------------------------------------
+    def sleep(self, seconds):
+        if self.stopThread:
+            raise self.StopThread()
+        time.sleep(seconds)
+        if self.stopThread:
+            raise self.StopThread()
+
+    #---------------------------------------------------------------------------
+    # default callbacks, overridden by the plugin
+    def deviceCreated(self, device):
+        pass
+
+    def deviceDeleted(self, device):
+        pass
+
+    def deviceUpdated(self, origDev, newDev):
+        pass
+
+    def isEnabled(self):
+        return True
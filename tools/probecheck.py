@@ -0,0 +1,213 @@
+#! /usr/bin/env python
+# -*- coding: utf-8 -*-
+#######################
+#
+# Tests the ping host prober (prober.ReachabilityProber) against listeners
+# on the loopback interface, with shortened intervals: which answers count
+# as up, the missed probes it takes to count as down, and targets that do
+# not resolve.
+#
+#   python2 tools/probecheck.py
+#   python2 tools/probecheck.py -v
+#
+# The exit status is 1 when a check fails. Echo checks are skipped where the
+# system allows no ICMP socket.
+
+import os
+import socket
+import sys
+import threading
+import time
+import unittest
+
+TOOLS_DIR  = os.path.dirname(os.path.abspath(__file__))
+PLUGIN_DIR = os.path.join(os.path.dirname(TOOLS_DIR), 'MixPresence.indigoPlugin', 'Contents', 'Server Plugin')
+
+sys.path.insert(0, PLUGIN_DIR)
+
+import prober
+
+################################################################################
+# the plugin's prober on a faster clock
+class FastProber(prober.ReachabilityProber):
+    timeout       = 0.3
+    minInterval   = 0.3
+    retryInterval = 0.1
+    maxInterval   = 0.6
+    startupSpread = 0.05
+
+#-------------------------------------------------------------------------------
+def listener():
+    sock = socket.socket()
+    sock.bind(('127.0.0.1', 0))
+    sock.listen(16)
+    return sock
+
+#-------------------------------------------------------------------------------
+# a loopback port nothing listens on
+def closedPort():
+    sock = socket.socket()
+    sock.bind(('127.0.0.1', 0))
+    port = sock.getsockname()[1]
+    sock.close()
+    return port
+
+################################################################################
+class ProberCheck(unittest.TestCase):
+
+    #---------------------------------------------------------------------------
+    def setUp(self):
+        self.changes = []
+        self.changed = threading.Event()
+        self.prober = FastProber(self.callback)
+
+    #---------------------------------------------------------------------------
+    def tearDown(self):
+        self.prober.stop()
+
+    #---------------------------------------------------------------------------
+    def callback(self, target):
+        self.changes.append((time.time(), target.id, target.onOffState))
+        self.changed.set()
+
+    #---------------------------------------------------------------------------
+    def start(self, icmpEnabled=False):
+        self.prober.configure(self.prober.maxInterval, icmpEnabled)
+        self.prober.start()
+
+    #---------------------------------------------------------------------------
+    # waits until every target has the state, returns False on timeout
+    def waitFor(self, targetIds, onOffState, timeout=3.0):
+        deadline = time.time() + timeout
+        while time.time() < deadline:
+            if all(self.prober.targets[targetId].onOffState == onOffState for targetId in targetIds):
+                return True
+            time.sleep(0.02)
+        return False
+
+    #---------------------------------------------------------------------------
+    def testListeningPortsComeUp(self):
+        listeners = [listener() for i in range(20)]
+        self.addCleanup(lambda: [sock.close() for sock in listeners])
+        targetIds = ['127.0.0.1:%d' % sock.getsockname()[1] for sock in listeners]
+        self.start()
+        for targetId in targetIds:
+            self.prober.add(targetId)
+
+        self.assertTrue(self.waitFor(targetIds, True))
+        self.assertEqual(sorted(targetId for t, targetId, state in self.changes), sorted(targetIds))
+
+    #---------------------------------------------------------------------------
+    def testClosedPortStaysDown(self):
+        targetId = '127.0.0.1:%d' % closedPort()
+        # the loopback answers echoes, which must not count for a host:port
+        self.start(icmpEnabled=True)
+        self.prober.add(targetId)
+
+        time.sleep(1.0)
+        target = self.prober.targets[targetId]
+        self.assertFalse(target.onOffState)
+        self.assertTrue(target.failures >= 2, target.failures)
+        self.assertEqual(self.changes, [])
+
+    #---------------------------------------------------------------------------
+    def testBareHostAnswersWithReset(self):
+        # nothing listens on the default port of the loopback, its RST
+        # shows the host is there
+        self.start()
+        self.prober.add('127.0.0.1')
+
+        self.assertTrue(self.waitFor(['127.0.0.1'], True))
+
+    #---------------------------------------------------------------------------
+    def testGoesDownAfterThreeMissedProbes(self):
+        sock = listener()
+        targetId = '127.0.0.1:%d' % sock.getsockname()[1]
+        self.start()
+        self.prober.add(targetId)
+        self.assertTrue(self.waitFor([targetId], True))
+        probes = self.prober.stats['probes']
+
+        sock.close()
+        closed = time.time()
+        self.assertTrue(self.waitFor([targetId], False))
+        # down with the third miss in a row, after two quick retries
+        self.assertEqual(self.prober.stats['probes'] - probes, FastProber.downAfter)
+        self.assertTrue(self.changes[-1][0] - closed >= (FastProber.downAfter - 1) * FastProber.retryInterval * 0.9)
+        self.assertEqual([state for t, targetId, state in self.changes], [True, False])
+
+    #---------------------------------------------------------------------------
+    def testSingleMissIsNoDeparture(self):
+        target = prober.ProbeTarget('127.0.0.1:1', onOffState=True)
+        self.prober.targets[target.id] = target
+        now = time.time()
+        for reachable in (False, False, True, False, False, True):
+            self.prober._record(target, reachable, now)
+            self.assertTrue(target.onOffState)
+        self.prober._record(target, False, now)
+        self.prober._record(target, False, now)
+        self.assertTrue(target.onOffState)
+        self.prober._record(target, False, now)
+        self.assertFalse(target.onOffState)
+        self.assertEqual(len(self.changes), 1)
+
+    #---------------------------------------------------------------------------
+    def testUnresolvableHostStaysDown(self):
+        self.start()
+        self.prober.add('nonexistent.invalid')
+
+        time.sleep(1.0)
+        target = self.prober.targets['nonexistent.invalid']
+        self.assertIsNone(target.address)
+        self.assertFalse(target.onOffState)
+        self.assertTrue(target.failures >= 1, target.failures)
+
+    #---------------------------------------------------------------------------
+    def testRemovedTargetIsNotProbed(self):
+        sock = listener()
+        self.addCleanup(sock.close)
+        targetId = '127.0.0.1:%d' % sock.getsockname()[1]
+        self.start()
+        self.prober.add(targetId)
+        self.assertTrue(self.waitFor([targetId], True))
+
+        self.prober.remove(targetId)
+        time.sleep(0.2)
+        probes = self.prober.stats['probes']
+        time.sleep(1.0)
+        self.assertEqual(self.prober.stats['probes'], probes)
+
+    #---------------------------------------------------------------------------
+    def testEchoReplyOnLoopback(self):
+        sock = prober.openIcmpSocket()
+        if sock is None:
+            self.skipTest('no ICMP socket allowed')
+        self.addCleanup(sock.close)
+        sock.setblocking(1)
+        sock.settimeout(1.0)
+        token = os.urandom(8)
+        sock.sendto(prober.echoRequest(1234, 77, token), ('127.0.0.1', 0))
+        # a raw socket also sees our own request go by
+        for i in range(3):
+            packet, address = sock.recvfrom(2048)
+            sequence = prober.parseEchoReply(packet, token)
+            if sequence is not None:
+                break
+        self.assertEqual(sequence, 77)
+        self.assertIsNone(prober.parseEchoReply(packet, os.urandom(8)))
+
+    #---------------------------------------------------------------------------
+    def testParseTargets(self):
+        self.assertEqual(prober.parseTargets('10.0.0.2, Phone.local:62078 ::1 [fe80::1]:80 bad:port 10.0.0.2'),
+                         ['10.0.0.2', 'phone.local:62078', '[::1]', '[fe80::1]:80'])
+        self.assertRaises(ValueError, prober.parseTarget, 'host:99999')
+
+################################################################################
+def main():
+    verbosity = 2 if '-v' in sys.argv[1:] else 1
+    suite = unittest.TestLoader().loadTestsFromTestCase(ProberCheck)
+    result = unittest.TextTestRunner(verbosity=verbosity).run(suite)
+    return 0 if result.wasSuccessful() else 1
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,452 @@
+#! /usr/bin/env python
+# -*- coding: utf-8 -*-
+#######################
+#
+# Replays Unifi and beacon state changes through MixPresence on a simulated
+# clock, using the offline indigo stub in this directory.
+#
+#   python2 tools/replay.py --devices 200 --days 3
+#   python2 tools/replay.py --devices 200 --days 3 --adaptive
+#   python2 tools/replay.py --trace recorded.jsonl
+#   python2 tools/replay.py --devices 5 --days 1 --record synthetic.jsonl
+#
+# A trace is a JSON lines file, one event per line, ordered by time:
+#
+#   {"t": 3600.0, "id": 10001, "states": {"onOffState": false}}
+#   {"t": 3600.0, "truth": 1, "home": false}
+#
+# 't' is seconds since the start of the replay. State events are applied to
+# source device 'id' as if its plugin changed them; a "lastSeen" of "now" is
+# replaced by the simulated time. Truth events record when person 'truth'
+# really arrived or left and are only used for the detection report.
+#
+# The plugin runs as it would in Indigo, except for what only costs wall
+# time in a simulation: status requests run inline when the driver drains
+# the pool, the runtime snapshot is kept in memory and source devices are
+# read from the stub without copying them.
+
+import Queue
+import datetime
+import json
+import optparse
+import os
+import random
+import sys
+import tempfile
+import time
+
+TOOLS_DIR  = os.path.dirname(os.path.abspath(__file__))
+PLUGIN_DIR = os.path.join(os.path.dirname(TOOLS_DIR), 'MixPresence.indigoPlugin', 'Contents', 'Server Plugin')
+
+sys.path.insert(0, PLUGIN_DIR)
+sys.path.insert(0, TOOLS_DIR)
+
+import indigo
+
+PLUGIN_ID = 'com.tenallero.indigoplugin.mixpresence'
+UNIFI_ID  = 'com.tenallero.indigoplugin.unifi'
+BEACON_ID = 'se.furtenbach.indigo.plugin.beacon'
+
+# device id ranges of the simulated world
+PRESENCE_BASE = 1
+UNIFI_BASE    = 100000
+GEOFENCE_BASE = 200000
+
+# simulated wall clock of the first event: a Monday at midnight
+EPOCH = time.mktime((2024, 1, 1, 0, 0, 0, 0, 1, -1))
+
+################################################################################
+# a clock that only moves when the driver says so. Installing it replaces
+# time.time() process wide; datetime.now() is served to the plugin module.
+class VirtualClock(object):
+
+    #---------------------------------------------------------------------------
+    def __init__(self, start=EPOCH):
+        self.now = float(start)
+        self.start = float(start)
+        self.realTime = time.time
+
+    #---------------------------------------------------------------------------
+    def time(self):
+        return self.now
+
+    #---------------------------------------------------------------------------
+    def advance(self, to):
+        if to > self.now:
+            self.now = to
+
+    #---------------------------------------------------------------------------
+    def install(self, *modules):
+        clock = self
+
+        class VirtualDatetime(datetime.datetime):
+            @classmethod
+            def now(cls, tz=None):
+                return datetime.datetime.fromtimestamp(clock.now, tz)
+
+        class DatetimeModule(object):
+            timedelta = datetime.timedelta
+            date      = datetime.date
+        DatetimeModule.datetime = VirtualDatetime
+
+        time.time = self.time
+        for module in modules:
+            if hasattr(module, 'datetime'):
+                module.datetime = DatetimeModule
+            # the monotonic clock runs with the simulation too
+            if hasattr(module, 'monotonic'):
+                module.monotonic = self.time
+
+################################################################################
+# synthetic commuters: every person leaves in the morning and comes back in
+# the evening, crossing the three perimeters on the way
+def syntheticTrace(people, days, seed=1):
+    rnd = random.Random(seed)
+    events = []
+    for person in range(people):
+        unifiId = UNIFI_BASE + person
+        geoIds = [GEOFENCE_BASE + 3 * person + i for i in range(3)]
+        for day in range(days):
+            base = day * 86400.0
+            # the odd day at home
+            if rnd.random() < 0.1:
+                continue
+            leave = base + 7.5 * 3600 + rnd.uniform(0, 2 * 3600)
+            back  = base + 17 * 3600 + rnd.uniform(0, 4 * 3600)
+
+            events.append((leave, {'truth': PRESENCE_BASE + person, 'home': False}))
+            events.append((leave + rnd.uniform(0, 120), {'id': unifiId, 'states': {'onOffState': False}}))
+            events.append((leave + rnd.uniform(30, 180), {'id': geoIds[0], 'states': {'onOffState': False}}))
+            events.append((leave + rnd.uniform(300, 600), {'id': geoIds[1], 'states': {'onOffState': False}}))
+            events.append((leave + rnd.uniform(900, 1800), {'id': geoIds[2], 'states': {'onOffState': False}}))
+
+            events.append((back - rnd.uniform(900, 1800), {'id': geoIds[2], 'states': {'onOffState': True}}))
+            events.append((back - rnd.uniform(300, 600), {'id': geoIds[1], 'states': {'onOffState': True}}))
+            events.append((back - rnd.uniform(30, 180), {'id': geoIds[0], 'states': {'onOffState': True}}))
+            events.append((back, {'truth': PRESENCE_BASE + person, 'home': True}))
+            events.append((back + rnd.uniform(10, 300), {'id': unifiId, 'states': {'onOffState': True, 'lastSeen': 'now'}}))
+
+    events.sort(key=lambda event: event[0])
+    return events
+
+#-------------------------------------------------------------------------------
+def readTrace(path):
+    events = []
+    with open(path) as f:
+        for line in f:
+            line = line.strip()
+            if line:
+                event = json.loads(line)
+                events.append((float(event.pop('t')), event))
+    events.sort(key=lambda event: event[0])
+    return events
+
+#-------------------------------------------------------------------------------
+def writeTrace(path, events):
+    with open(path, 'w') as f:
+        for t, event in events:
+            record = dict(event)
+            record['t'] = round(t, 3)
+            f.write(json.dumps(record, sort_keys=True) + '\n')
+
+#-------------------------------------------------------------------------------
+def tracePeople(events):
+    people = set()
+    for t, event in events:
+        if 'truth' in event:
+            people.add(event['truth'] - PRESENCE_BASE)
+        elif event['id'] >= GEOFENCE_BASE:
+            people.add((event['id'] - GEOFENCE_BASE) // 3)
+        elif event['id'] >= UNIFI_BASE:
+            people.add(event['id'] - UNIFI_BASE)
+    return len(people) and max(people) + 1
+
+#-------------------------------------------------------------------------------
+# stand-ins for the parts of the plugin that wait on threads or the disk,
+# built on the real classes so the plugin sees the same behaviour
+def simulationClasses():
+    import statusrequest
+    import snapshot
+
+    ############################################################################
+    # status requests are queued as usual and run on the driver's thread when
+    # it drains the pool, in the order the workers would have taken them
+    class InlineRequestPool(statusrequest.StatusRequestPool):
+
+        #-----------------------------------------------------------------------
+        def _spawn(self):
+            pass
+
+        #-----------------------------------------------------------------------
+        def drain(self, timeout=None):
+            while True:
+                try:
+                    item = self.queue.get_nowait()
+                except Queue.Empty:
+                    return True
+                if item is not None:
+                    self._process(None, *item)
+
+    ############################################################################
+    # entries are refreshed like the real snapshot does, but never written:
+    # nothing reads them back during a replay. Writes are counted.
+    class MemorySnapshot(snapshot.RuntimeSnapshot):
+
+        #-----------------------------------------------------------------------
+        def __init__(self, path):
+            snapshot.RuntimeSnapshot.__init__(self, path)
+            self.writes = 0
+            self.syncs = 0
+
+        #-----------------------------------------------------------------------
+        def write(self, entries, sync=True):
+            self.writes += 1
+            self.syncs += sync
+
+    return InlineRequestPool, MemorySnapshot
+
+################################################################################
+class Replay(object):
+
+    #---------------------------------------------------------------------------
+    # with virtualTime=False the plugin runs on the real clock with its own
+    # worker threads and snapshot file, for tools that drive
+    # runConcurrentThread itself
+    def __init__(self, people, debug=False, echo=False, prefs=None, virtualTime=True, adaptive=False):
+        self.people = people
+        self.adaptive = adaptive
+        self.clock = VirtualClock()
+        indigo.server.echo = echo
+        # a fresh install folder, so no runtime snapshot of an earlier run is used
+        indigo.server.installFolder = tempfile.mkdtemp(prefix='mixpresence-')
+
+        # the plugin resolves ghpu.cfg and rules.json relative to its folder
+        os.chdir(PLUGIN_DIR)
+        import plugin
+        import presence
+        if virtualTime:
+            self.clock.install(plugin, presence)
+        self.module = plugin
+        self.startTime = time.time()
+
+        self.unifi = indigo.server.getPlugin(UNIFI_ID)
+        self.unifi.actions['silentStatusRequest'] = self.silentStatusRequest
+        indigo.server.getPlugin(BEACON_ID)
+
+        self.buildDevices()
+
+        pluginPrefs = {'debugEnabled': debug}
+        pluginPrefs.update(prefs or {})
+        self.plugin = plugin.Plugin(PLUGIN_ID, 'MixPresence', '0.0.0', pluginPrefs)
+        # no network from a simulation
+        self.plugin.updater.autoCheck = False
+        self.plugin.updater.checkForUpdate = lambda *args, **kwargs: False
+        if virtualTime:
+            # ... no worker threads, disk writes or device copies either
+            InlineRequestPool, MemorySnapshot = simulationClasses()
+            self.plugin.requestPool = InlineRequestPool()
+            self.plugin.runtimeSnapshot = MemorySnapshot(self.plugin.runtimeSnapshot.path)
+            self.plugin.readSource = self.readSource
+
+        # transitions of the presence devices as (time, person id, state)
+        self.transitions = []
+        indigo.devices.subscribers.append(self)
+
+        self.analyses = 0
+        analyze = self.plugin.deviceAnalyzeStatus
+        def countingAnalyze(presence):
+            self.analyses += 1
+            return analyze(presence)
+        self.plugin.deviceAnalyzeStatus = countingAnalyze
+
+    #---------------------------------------------------------------------------
+    def buildDevices(self):
+        now = int(time.time())
+        for person in range(self.people):
+            unifiId = UNIFI_BASE + person
+            geoIds = [GEOFENCE_BASE + 3 * person + i for i in range(3)]
+            indigo.devices.add(indigo.Device(unifiId, u'Phone %d' % person, UNIFI_ID, 'unifiuser',
+                states={'onOffState': True, 'firstSeen': now - 86400, 'lastSeen': now}))
+            for i, geoId in enumerate(geoIds):
+                indigo.devices.add(indigo.Device(geoId, u'Perimeter %d of %d' % (i + 1, person), BEACON_ID, 'beacon',
+                    states={'onOffState': True}))
+            indigo.devices.add(indigo.Device(PRESENCE_BASE + person, u'Person %d' % person, PLUGIN_ID, 'presence',
+                pluginProps={'unifidevice': unifiId, 'pingdevice': 0,
+                             'geofencedevice1': geoIds[0], 'geofencedevice2': geoIds[1], 'geofencedevice3': geoIds[2],
+                             'statusInterval': 600, 'adaptiveStatus': self.adaptive},
+                states={'onOffState': True}))
+
+    #---------------------------------------------------------------------------
+    # Plugin.readSource without the copy every lookup of the stub makes; the
+    # snapshots only read from the device. Lookups are still counted.
+    def readSource(self, sourceId):
+        plugin = self.plugin
+        indigo.server.stats['deviceLookups'] += 1
+        device = indigo.devices.db.get(sourceId, None)
+        if device is None:
+            plugin.errorLog(u"Error: source device %d not found" % sourceId)
+            plugin.sourceCache.pop(sourceId, None)
+        else:
+            plugin.sourceCache[sourceId] = self.module.SourceSnapshot(device)
+
+    #---------------------------------------------------------------------------
+    # the Unifi plugin refreshes lastSeen of clients that are connected
+    def silentStatusRequest(self, deviceId, props):
+        device = indigo.devices.db.get(deviceId, None)
+        if device is not None and device.states.get('onOffState', False):
+            indigo.devices.setStates(deviceId, lastSeen=int(time.time()))
+
+    #---------------------------------------------------------------------------
+    # subscriber callbacks of the stub
+    def deviceUpdated(self, origDev, newDev):
+        if newDev.pluginId == PLUGIN_ID and origDev.states.get('onOffState') != newDev.states.get('onOffState'):
+            self.transitions.append((time.time() - self.startTime, newDev.id, newDev.states['onOffState']))
+
+    def deviceCreated(self, device):
+        pass
+
+    def deviceDeleted(self, device):
+        pass
+
+    #---------------------------------------------------------------------------
+    def start(self):
+        self.plugin.startup()
+        for person in range(self.people):
+            self.plugin.deviceStartComm(indigo.devices[PRESENCE_BASE + person])
+
+    #---------------------------------------------------------------------------
+    def stop(self):
+        self.plugin.shutdown()
+        for person in range(self.people):
+            self.plugin.deviceStopComm(indigo.devices[PRESENCE_BASE + person])
+
+    #---------------------------------------------------------------------------
+    # runs what the concurrent thread would run at the current time and runs
+    # the status requests it fired
+    def step(self):
+        self.plugin.runDueTasks(self.clock.now)
+        self.plugin.requestPool.drain()
+
+    #---------------------------------------------------------------------------
+    # replays the events; until defaults to the last event plus an hour
+    def run(self, events, until=None):
+        start = self.clock.start
+        if until is None:
+            until = (events[-1][0] if events else 0) + 3600
+        until += start
+
+        truth = []
+        index = 0
+        while True:
+            eventTime = start + events[index][0] if index < len(events) else None
+            deadline = self.plugin.scheduler.nextDeadline()
+
+            if eventTime is not None and (deadline is None or eventTime <= deadline):
+                if eventTime > until:
+                    break
+                self.clock.advance(eventTime)
+                event = events[index][1]
+                index += 1
+                if 'truth' in event:
+                    truth.append((eventTime - start, event['truth'], bool(event['home'])))
+                    continue
+                states = dict(event['states'])
+                if states.get('lastSeen', None) == 'now':
+                    states['lastSeen'] = int(self.clock.now)
+                indigo.devices.setStates(event['id'], **states)
+                self.plugin.requestPool.drain()
+            elif deadline is not None and deadline <= until:
+                self.clock.advance(deadline)
+                self.step()
+            else:
+                break
+
+        self.clock.advance(until)
+        return truth
+
+    #---------------------------------------------------------------------------
+    # how well and how fast the presence devices followed the truth events
+    def detection(self, truth):
+        delays = {True: [], False: []}
+        missed = 0
+        byPerson = {}
+        for t, personId, state in self.transitions:
+            byPerson.setdefault(personId, []).append((t, state))
+
+        truthByPerson = {}
+        for t, personId, home in truth:
+            truthByPerson.setdefault(personId, []).append((t, home))
+
+        spurious = 0
+        for personId, changes in truthByPerson.items():
+            transitions = byPerson.get(personId, [])
+            for i, (t, home) in enumerate(changes):
+                # look for the matching transition up to the next truth event;
+                # geofences may legitimately fire a little early
+                end = changes[i + 1][0] if i + 1 < len(changes) else float('inf')
+                begin = changes[i - 1][0] if i > 0 else float('-inf')
+                hit = [ct for ct, state in transitions if state == home and begin < ct < end]
+                if hit:
+                    delays[home].append(hit[0] - t)
+                else:
+                    missed += 1
+            spurious += max(len(transitions) - len(changes), 0)
+
+        return {'arrivals': delays[True], 'departures': delays[False], 'missed': missed, 'spurious': spurious}
+
+################################################################################
+def percentile(values, fraction):
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    return ordered[min(int(fraction * len(ordered)), len(ordered) - 1)]
+
+#-------------------------------------------------------------------------------
+def main():
+    parser = optparse.OptionParser(usage='%prog [options]')
+    parser.add_option('--devices', type='int', default=10, help='presence devices to simulate [%default]')
+    parser.add_option('--days', type='int', default=1, help='days of synthetic events [%default]')
+    parser.add_option('--seed', type='int', default=1, help='seed of the synthetic trace [%default]')
+    parser.add_option('--trace', help='replay this JSON lines trace instead of a synthetic one')
+    parser.add_option('--record', help='write the trace that was replayed to this file')
+    parser.add_option('--adaptive', action='store_true', help='enable adaptive status polling on every device')
+    parser.add_option('--debug', action='store_true', help='enable plugin debug logging')
+    parser.add_option('--log', action='store_true', help='echo the Indigo event log')
+    options, args = parser.parse_args()
+
+    if options.trace:
+        events = readTrace(options.trace)
+        people = tracePeople(events)
+    else:
+        events = syntheticTrace(options.devices, options.days, options.seed)
+        people = options.devices
+    if options.record:
+        writeTrace(options.record, events)
+
+    replay = Replay(people, debug=options.debug, echo=options.log or options.debug, adaptive=options.adaptive)
+    wallStart = replay.clock.realTime()
+    replay.start()
+    truth = replay.run(events)
+    replay.stop()
+    wallTime = replay.clock.realTime() - wallStart
+
+    stats = indigo.server.stats
+    simulated = replay.clock.now - replay.clock.start
+    result = replay.detection(truth)
+    print 'Simulated %d presence devices for %.1f h in %.2f sec.' % (people, simulated / 3600, wallTime)
+    print '  source events     %d' % (len(events) - len(truth))
+    print '  analyses          %d' % replay.analyses
+    print '  transitions       %d' % len(replay.transitions)
+    print '  status requests   %d' % stats['actions']
+    print '  device lookups    %d' % stats['deviceLookups']
+    print '  state writes      %d' % stats['stateWrites']
+    print '  snapshot writes   %d, %d synced' % (replay.plugin.runtimeSnapshot.writes, replay.plugin.runtimeSnapshot.syncs)
+    for name in ('arrivals', 'departures'):
+        delays = result[name]
+        print '  %-17s %d detected, p50 %.0f sec., p99 %.0f sec.' % (
+            name, len(delays), percentile(delays, 0.5), percentile(delays, 0.99))
+    print '  missed            %d' % result['missed']
+    print '  spurious          %d' % result['spurious']
+
+if __name__ == '__main__':
+    main()
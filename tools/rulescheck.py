@@ -0,0 +1,124 @@
+#! /usr/bin/env python
+# -*- coding: utf-8 -*-
+#######################
+#
+# Tests the default presence rules (rules.json) and their compiled decision
+# table: for every combination of inputs and for values on either side of
+# every threshold the table picks the same rule as walking the list in order,
+# every input is used by some rule and the Ping rules decide as documented.
+#
+#   python2 tools/rulescheck.py
+#   python2 tools/rulescheck.py -v
+#
+# The exit status is 1 when a check fails.
+
+import itertools
+import json
+import os
+import sys
+import unittest
+
+TOOLS_DIR  = os.path.dirname(os.path.abspath(__file__))
+PLUGIN_DIR = os.path.join(os.path.dirname(TOOLS_DIR), 'MixPresence.indigoPlugin', 'Contents', 'Server Plugin')
+RULES_FILE = os.path.join(PLUGIN_DIR, 'rules.json')
+
+sys.path.insert(0, PLUGIN_DIR)
+
+from rules import BIT, DERIVED, GROUP_MINUTES, Rule, RuleSet
+
+#-------------------------------------------------------------------------------
+def index(**inputs):
+    return sum(BIT[name] for name, value in inputs.items() if value)
+
+#-------------------------------------------------------------------------------
+def values(minutesLastSeen=0, minutesGeo1=0):
+    result = dict((key, 0) for key in GROUP_MINUTES)
+    result['minutesLastSeen'] = minutesLastSeen
+    result['minutesGeo1'] = result['minutesOnGeo1'] = minutesGeo1
+    return result
+
+################################################################################
+class RulesCheck(unittest.TestCase):
+
+    #---------------------------------------------------------------------------
+    def setUp(self):
+        with open(RULES_FILE) as f:
+            self.definitions = json.load(f)
+        self.ruleSet = RuleSet(self.definitions)
+
+    #---------------------------------------------------------------------------
+    # the rule that fires, by walking the rules in order
+    def firstMatch(self, rules, index, values):
+        inputs = dict((name, bool(index & bit)) for name, bit in BIT.iteritems())
+        for name, derive in DERIVED.iteritems():
+            inputs[name] = derive(inputs)
+        for rule in rules:
+            if rule.matches(inputs) and rule.holds(values):
+                return rule
+        return None
+
+    #---------------------------------------------------------------------------
+    def decide(self, index, minutesLastSeen=0, minutesGeo1=0):
+        rule = self.ruleSet.evaluate(index, values(minutesLastSeen, minutesGeo1))
+        return (rule.id if rule is not None else None, rule.then if rule is not None else None)
+
+    #---------------------------------------------------------------------------
+    def testTableMatchesTheRulesInOrder(self):
+        rules = [Rule(definition) for definition in self.definitions]
+        # either side of every threshold of the default rules
+        thresholds = {}
+        for rule in rules:
+            for name, op, value in rule.predicates:
+                thresholds.setdefault(name, set([0, 100])).update([value - 1, value, value + 1])
+        lastSeens = sorted(thresholds.get('minutesLastSeen', [0]))
+        geo1s = sorted(thresholds.get('minutesOnGeo1', [0]))
+
+        for i in range(len(self.ruleSet.table)):
+            for minutesLastSeen, minutesGeo1 in itertools.product(lastSeens, geo1s):
+                current = values(minutesLastSeen, minutesGeo1)
+                expected = self.firstMatch(rules, i, current)
+                rule = self.ruleSet.evaluate(i, current)
+                self.assertEqual(rule.id if rule else None, expected.id if expected else None,
+                                 'index %d, %r' % (i, current))
+
+    #---------------------------------------------------------------------------
+    def testEveryInputIsUsed(self):
+        self.assertEqual(self.ruleSet.unusedInputs, ())
+        # and one that is not is found
+        withoutPing = [definition for definition in self.definitions if 'onPing' not in definition['when']]
+        self.assertEqual(RuleSet(withoutPing).unusedInputs, ('onPing',))
+
+    #---------------------------------------------------------------------------
+    def testAnsweringPingIsIn(self):
+        self.assertEqual(self.decide(index(onPing=True, changedPing=True), 100), ('#12', True))
+        # ... also when it came up together with a perimeter
+        self.assertEqual(self.decide(index(onPing=True, changedPing=True, onGeo3=True, changedGeo3=True), 100),
+                         ('#12', True))
+
+    #---------------------------------------------------------------------------
+    def testAnsweringPingWhileOutIsIn(self):
+        self.assertEqual(self.decide(index(onPing=True), 100), ('#13', True))
+
+    #---------------------------------------------------------------------------
+    def testAnsweringPingKeepsIn(self):
+        # without the WIFI or perimeters, long after the phone was last seen
+        self.assertEqual(self.decide(index(onOffState=True, onPing=True), 100), ('#14', True))
+
+    #---------------------------------------------------------------------------
+    def testWifiStillWinsOverPing(self):
+        self.assertEqual(self.decide(index(onOffState=True, onPing=True, changedUnifi=True), 100)[1], False)
+
+    #---------------------------------------------------------------------------
+    def testPingLossChangesNothing(self):
+        self.assertEqual(self.decide(index(onOffState=True, changedPing=True), 100)[1], None)
+        self.assertEqual(self.decide(index(onOffState=True, onUnifi=True, changedPing=True), 0)[1], None)
+
+################################################################################
+def main():
+    verbosity = 2 if '-v' in sys.argv[1:] else 1
+    suite = unittest.TestLoader().loadTestsFromTestCase(RulesCheck)
+    result = unittest.TextTestRunner(verbosity=verbosity).run(suite)
+    return 0 if result.wasSuccessful() else 1
+
+if __name__ == '__main__':
+    sys.exit(main())